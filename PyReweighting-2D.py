@@ -3,67 +3,37 @@
 ## Required Software:
 # Python: https://www.python.org/downloads/
 # NumPy and SciPy: http://www.scipy.org/scipylib/download.html
-# matplotlib: http://matplotlib.org/downloads.html
+# matplotlib: http://matplotlib.org/downloads.html (only for -plot)
+#
+# The reweighting engine lives in pyreweighting.py next to this script; this
+# file is the command line front end. Several jobs can be given to -job and
+# are all computed in one process from the same loaded and binned data.
+# With -chunk the input is streamed in blocks into per-bin sums instead of
+# being loaded whole (every job except amd_dV). With -bootstrap the sums are
+# kept per WE iteration, segment or run of frames (-block) and resampled into
+# replicate PMFs whose per-bin mean and standard deviation are written to
+# <job>-err files next to the PMF. Figures are only drawn with -plot, which
+# imports matplotlib on first use with the non-interactive Agg backend, so
+# numeric runs on compute nodes never load it. With -bincache the per-frame
+# bin indices are stored on disk and reused by later runs on the same data
+# and bins. With -sparse only the occupied bins are kept and written, and
+# -adaptive additionally merges bins below the cutoff with their neighbours.
+# With -columns the surface is computed over any number of input columns
+# (1D, 2D, 3D, ...) by a streamed BinAccumulatorND, and -marginal writes the
+# lower dimensional surfaces of chosen axes from the same per-bin sums.
 
-import math
-import scipy
-import scipy.stats as stats
 import numpy as np
-import sys
-import matplotlib.pyplot as plt
-import csv
 from argparse import ArgumentParser
-from scipy.optimize import curve_fit
-## from scipy.optimize import *
-
-print ("============================================================")
-print ("PyReweighting: Python scripts used to reweight accelerated molecular dynamics simulations.")
-print ("  ")
-print ("Authors: Yinglong Miao <yinglong.miao@gmail.com>")
-print ("         Bill Sinko <wsinko@gmail.com>")
-print ("\n\
-Copyright <2014-2019> <Yinglong Miao and William Sinko> \n\
-\n\
-Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the \"PyReweighting\"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following citation: \n\
-\n\
-Miao Y, Sinko W, Pierce L, Bucher D, Walker RC, McCammon JA (2014) Improved reweighting of accelerated molecular dynamics simulations for free energy calculation. J Chemical Theory and Computation. 10(7): 2677-2689.")
-print (" ")
+
+from pyreweighting import (BANNER, JOBS, WEIGHTED_JOBS, STREAM_JOBS, CHUNK_FRAMES, BinAccumulator, BinAccumulatorND,
+                           BlockAccumulator, BLOCK_KINDS, Reweighter, SparseReweighter, anharm, isharvest, output_pmf2D, output_pmf2D_err,
+                           output_pmf2D_sparse, output_pmfND, inputcolumns, output_dV, output_dV_anharm2D,
+                           output_dV_stat2D, output_dV_mat2D)
 
 ###########MAIN
 def main():
-## Set control parameters
-    plt_figs = 1
-
-    args = cmdlineparse()   
-    
-    data=loadfiletoarray(args.input)
-    
-    rows = len(data[:,0])
-    weights,dV = weightparse(rows, args)
-
-    if args.discX:
-        discX=float(args.discX)
-    else :
-        discX = 6
-
-    if args.discY:
-        discY=float(args.discY)
-    else :
-        discY = 6
-
-    if args.Xdim:
-        binsX= assignbins(args.Xdim, discX)
-    else:
-        max_data = discX * (int(np.amax(data[:,0])/discX) + 1)
-        min_data = discX * (int(np.amin(data[:,0])/discX) - 1)
-        binsX= assignbins([min_data,max_data], discX)  ## Default bin size
-
-    if args.Ydim:
-        binsY= assignbins(args.Ydim, discY)
-    else:
-        max_data = discY * (int(np.amax(data[:,1])/discY) + 1)
-        min_data = discY * (int(np.amin(data[:,1])/discY) - 1)
-        binsY= assignbins([min_data,max_data], discY)  ## Default bin size
+    print (BANNER)
+    args = cmdlineparse()
 
 ##  SET MAX ENERGY FOR ALL INFINITY VALUES
     if args.Emax:
@@ -77,147 +47,280 @@ def main():
     else :
         hist_min = 10	# minimum number of configurations in one bin
 
-##  SET ORDER of McLaurin series expansion
+##  SET ORDER(S) of McLaurin series expansion
     if args.order:
-        order=int(args.order)
+        orders=list(dict.fromkeys(int(o) for o in args.order))
     else :
-        order = 10	# default
+        orders = [10]	# default
+    order = orders[0]
 
 ##  SET TEMPERATURE
     if args.T:
         T=float(args.T)
     else :
         T = 300	# simulation temperature
-    beta = 1.0/(0.001987*T)
 
-##REWEIGHTING
-##  SET flag for Gaussian fitting of deltaV
-    if args.fit:
-        fit=args.fit
-    else :
-        fit=False	# simulation temperature
+    jobs = list(dict.fromkeys(args.job))
+    weighted = [job for job in jobs if job in WEIGHTED_JOBS]
+    if weighted and not args.weight:
+        raise SystemExit("ERROR: -weight is required for " + ", ".join(weighted))
+
+    if args.adaptive:
+        args.sparse = True
+    if args.sparse:
+        if args.chunk or args.bootstrap:
+            raise SystemExit("ERROR: -sparse/-adaptive cannot be used with -chunk/-bootstrap")
+        if "amd_dV" in jobs:
+            raise SystemExit("ERROR: -sparse/-adaptive cannot be used with amd_dV")
+
+    if args.columns or args.marginal:
+        return mainND(args, jobs, weighted, T, hist_min, cb_max, orders)
+
+    blocks = None
+    if args.chunk or args.bootstrap:
+        unstreamable = [job for job in jobs if job not in STREAM_JOBS]
+        if unstreamable:
+            raise SystemExit("ERROR: -chunk/-bootstrap cannot be used with " + ", ".join(unstreamable))
+    if args.bootstrap:
+        if args.block in BLOCK_KINDS and not isharvest(args.input):
+            raise SystemExit("ERROR: -block "+args.block+" needs a harvest.npy/harvest.h5 input; give a number of frames instead")
+        try:
+            blocks = BlockAccumulator.fromfiles(args.input, args.weight if weighted else None, by=args.block,
+                                                Xdim=args.Xdim, Ydim=args.Ydim,
+                                                discX=args.discX or 6, discY=args.discY or 6,
+                                                T=T, chunk=int(args.chunk or CHUNK_FRAMES), hist_min=hist_min, cb_max=cb_max, order=orders)
+        except ValueError as e:
+            raise SystemExit("ERROR: -block "+args.block+": "+str(e))
+        print ("BLOCKS:         "+str(len(blocks.labels))+" by "+args.block)
+        rw = blocks.total()
+    elif args.chunk:
+        rw = BinAccumulator.fromfiles(args.input, args.weight if weighted else None,
+                                      Xdim=args.Xdim, Ydim=args.Ydim,
+                                      discX=args.discX or 6, discY=args.discY or 6,
+                                      T=T, chunk=int(args.chunk), hist_min=hist_min, cb_max=cb_max, order=orders)
+    elif args.sparse:
+        rw = SparseReweighter.fromfiles(args.input, args.weight if weighted else None,
+                                        Xdim=args.Xdim, Ydim=args.Ydim,
+                                        discX=args.discX or 6, discY=args.discY or 6,
+                                        T=T, hist_min=hist_min, cb_max=cb_max, bincache=args.bincache,
+                                        adaptive=int(args.adaptive or 0))
+    else:
+        rw = Reweighter.fromfiles(args.input, args.weight if weighted else None,
+                                  Xdim=args.Xdim, Ydim=args.Ydim,
+                                  discX=args.discX or 6, discY=args.discY or 6,
+                                  T=T, hist_min=hist_min, cb_max=cb_max, bincache=args.bincache)
+    print ("DATA LOADED:    "+args.input)
+    if isinstance(rw, SparseReweighter):
+        print ("OCCUPIED BINS:  "+str(len(rw.cells))+" of "+str(rw.nbinsX*rw.nbinsY))
+    if "amdweight_MC" in jobs and isinstance(rw, Reweighter):
+        rw.maclaurin(orders)    ## every requested order in one pass over the frames
+
+    for job in jobs:
+        ## with several jobs every output is prefixed by its job name so nothing is overwritten
+        prefix = job+'-' if len(jobs) > 1 else ''
+        for order in (orders if job == "amdweight_MC" else orders[:1]):
+            ## and with several Maclaurin orders by the order
+            oprefix = prefix+'order'+str(order)+'-' if job == "amdweight_MC" and len(orders) > 1 else prefix
+            runjob(rw, job, args.input, oprefix, order, args.dVmat, args.plot)
+            if blocks is not None:
+                bootstrapjob(blocks, rw, job, args.input, oprefix, order, args)
+
+    print (" ")
+    print ("END")
+
+##N-DIMENSIONAL SURFACES AND THEIR MARGINALS
+def mainND(args, jobs, weighted, T, hist_min, cb_max, orders):
+    unstreamable = [job for job in jobs if job not in STREAM_JOBS]
+    if unstreamable:
+        raise SystemExit("ERROR: -columns/-marginal cannot be used with " + ", ".join(unstreamable))
+    if args.sparse or args.bootstrap:
+        raise SystemExit("ERROR: -columns/-marginal cannot be used with -sparse/-adaptive/-bootstrap")
+    ncols = len(inputcolumns(args.input, args.columns))
+    if args.disc:
+        discs = [float(d) for d in args.disc]*ncols if len(args.disc) == 1 else [float(d) for d in args.disc]
+    else:
+        discs = ([float(args.discX or 6), float(args.discY or 6)] + [6.0]*ncols)[:ncols]
+    if args.dims:
+        dims = [args.dims[i:i+2] for i in range(0, len(args.dims), 2)]
+    else:
+        dims = ([args.Xdim, args.Ydim] + [None]*ncols)[:ncols]
+    if len(discs) != ncols or len(dims) != ncols:
+        raise SystemExit("ERROR: -disc needs 1 or %d sizes and -dims %d min/max pairs" % (ncols, ncols))
+    marginals = [[int(a) for a in m.split(',')] for m in args.marginal or []]
+    if any(a < 0 or a >= ncols for axes in marginals for a in axes):
+        raise SystemExit("ERROR: -marginal axes must be between 0 and %d" % (ncols-1))
+
+    acc = BinAccumulatorND.fromfiles(args.input, args.weight if weighted else None, columns=args.columns,
+                                     dims=dims, discs=discs, T=T, chunk=int(args.chunk or CHUNK_FRAMES),
+                                     hist_min=hist_min, cb_max=cb_max, order=orders)
+    print ("DATA LOADED:    "+args.input+" ("+str(ncols)+" columns, "+" x ".join(str(n) for n in acc.shape)+" bins)")
+
+    for job in jobs:
+        prefix = job+'-' if len(jobs) > 1 else ''
+        for order in (orders if job == "amdweight_MC" else orders[:1]):
+            oprefix = prefix+'order'+str(order)+'-' if job == "amdweight_MC" and len(orders) > 1 else prefix
+            ndjob(acc, job, args.input, oprefix, order, args.plot)
+            for axes in marginals:
+                ndjob(acc.marginal(axes), job, args.input, oprefix+'dims'+'_'.join(str(a) for a in axes)+'-', order, args.plot)
+
+    print (" ")
+    print ("END")
+
+def ndjob(acc, job, input, prefix, order, plot=False):
+    if job == "amdweight_CE":
+        dV_avg, dV_std = acc.dVaverage()
+        print ('dV all: avg = ', dV_avg, 'std = ', dV_std)
+    results = acc.run(job, order)
+    for term, grid in results.items():
+        name = {'pmf': 'pmf-', 'hist': 'histo-'}.get(term, 'pmf-'+term+'-')
+        output_pmfND(prefix+name+str(input)+'.xvg', grid, acc.bins)
+    if plot and len(acc.shape) == 2 and job != "histo":
+        plotjob(acc, results.get('c2', results.get('pmf')), None, prefix)    ## the figure of runjob (c2 for amdweight_CE)
+
+def writepmf(rw, pmffile, hist2):
+    ## a sparse result has one row per occupied bin
+    if isinstance(rw, SparseReweighter):
+        output_pmf2D_sparse(pmffile,hist2,rw.cells,rw.binsX,rw.binsY)
+    else:
+        output_pmf2D(pmffile,hist2,rw.binsX,rw.binsY)
+
+def runjob(rw, job, input, prefix, order, dVmat='text', plot=False):
+    plt_figs = 1
+    binsX = rw.binsX
+    binsY = rw.binsY
 
 ##REWEIGHTING
-    if args.job == "amdweight_CE":
-        hist2,newedgesX,newedgesY,c1,c2,c3 = reweight_CE(data,hist_min,binsX,discX,binsY,discY,dV,T,fit)
-        pmf = hist2pmf2D(hist2,hist_min,T)
-        c1 = -np.multiply(1.0/beta,c1)
-        c2 = -np.multiply(1.0/beta,c2)
-        c3 = -np.multiply(1.0/beta,c3)
-        
-        c12 = np.add(c1,c2)
-        c123 = np.add(c12,c3)
-        pmf_c1 = np.add(pmf, c1)
-        print ("pmf_min-c1 = ", np.min(pmf_c1))
-        pmf_c1 = normalize2D(pmf_c1,cb_max)
-        pmf_c2 = np.add(pmf, c12)
-        print ("pmf_min-c2 = ", np.min(pmf_c2))
-        pmf_c2 = normalize2D(pmf_c2,cb_max)
-        pmf_c3 = np.add(pmf, c123)
-        print ("pmf_min-c3 = ", np.min(pmf_c3))
-        pmf_c3 = normalize2D(pmf_c3,cb_max)
-    elif args.job == "amdweight_MC":
-        n=order
-        MCweight=np.zeros(len(dV))
-        beta_dV=np.multiply(dV,beta)
-        for x in range(0,n+1):
-          MCweight=np.add(MCweight,(np.divide(np.power(beta_dV, x), float(scipy.special.factorial(x)))))
-        weights=MCweight
-        hist2,newedgesX,newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=weights)
-        hist2=prephist(hist2,T,cb_max)
-    elif args.job == "amdweight":
-        hist2,newedgesX,newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=weights)
-        hist2=prephist(hist2,T,cb_max)
-    else :
-        hist2,newedgesX,newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=None)
-        hist2=prephist(hist2,T,cb_max)
+    if job == "amdweight_CE":
+        dV_avg, dV_std = rw.dVaverage()
+        print ('dV all: avg = ', dV_avg, 'std = ', dV_std)
+        raw = rw.amdweight_CE(normalize=False)
+        pmf_c1, pmf_c2, pmf_c3 = rw.amdweight_CE()
+        for name, pmf in zip(("c1", "c2", "c3"), raw):
+            print ("pmf_min-"+name+" = ", np.min(pmf))
+    elif job == "amdweight_MC":
+        hist2 = rw.amdweight_MC(order)
+    elif job == "amdweight":
+        hist2 = rw.amdweight()
+    elif job == "weighthist":
+        hist2 = rw.weighthist()
+    elif job in ("noweight", "amd_time"):
+        hist2 = rw.noweight()
 
 ##SAVE FREE ENERGY DATA INTO A FILE
-    if args.job == "amdweight_MC" or args.job == "amdweight" or args.job == "noweight" :
-        pmffile = 'pmf-'+str(args.input)+'.xvg'
-        output_pmf2D(pmffile,hist2,binsX,binsY)
-    if args.job == "amdweight_CE" :
+    if job in ("amdweight_MC", "amdweight", "weighthist", "noweight", "amd_time"):
+        pmffile = prefix+'pmf-'+str(input)+'.xvg'
+        writepmf(rw,pmffile,hist2)
+    if job == "amdweight_CE" :
         hist2 = pmf_c1
-        pmffile = 'pmf-c1-'+str(args.input)+'.xvg'
-        output_pmf2D(pmffile,hist2,binsX,binsY)
+        pmffile = prefix+'pmf-c1-'+str(input)+'.xvg'
+        writepmf(rw,pmffile,hist2)
 
         hist2 = pmf_c3
-        pmffile = 'pmf-c3-'+str(args.input)+'.xvg'
-        output_pmf2D(pmffile,hist2,binsX,binsY)
+        pmffile = prefix+'pmf-c3-'+str(input)+'.xvg'
+        writepmf(rw,pmffile,hist2)
 
         hist2 = pmf_c2
-        pmffile = 'pmf-c2-'+str(args.input)+'.xvg'
-        output_pmf2D(pmffile,hist2,binsX,binsY)
+        pmffile = prefix+'pmf-c2-'+str(input)+'.xvg'
+        writepmf(rw,pmffile,hist2)
+
+    if job == "histo" :
+        hist2 = rw.histo()
+        pmffile = prefix+'histo-'+str(input)+'.xvg'
+        if isinstance(rw, SparseReweighter):
+            output_pmf2D_sparse(pmffile,hist2,rw.cells,binsX,binsY)
+        else:
+            output_dV_anharm2D(pmffile,binsX,binsY,hist2)
+
+    if job == "amd_dV":
+        plt_figs = 0
+        hist2,binfX,binfY,dV_avg,dV_std,dV_anharm,dV_ragged = rw.amd_dV()
 
-    if args.job == "histo" :
-        hist2,newedgesX,newedgesY = histo(data,hist_min,binsX,discX,binsY)
-        pmffile = 'histo-'+str(args.input)+'.xvg'
-        output_dV_anharm2D(pmffile,binsX,binsY,hist2)
+        pmffile = prefix+'dV-hist-2D-'+str(input) + '.xvg'
+        output_dV(pmffile,rw.dV)
 
-    if args.job == "amd_dV":
-        plt_figs = 0
-        hist2,newedgesX,newedgesY,binfX,binfY,dV_avg,dV_std,dV_anharm,dV_mat = reweight_dV(data,hist_min,binsX,binsY,discX,discY,dV,T)
-        
-        pmffile = 'dV-hist-2D-'+str(args.input) + '.xvg'
-        output_dV(pmffile,dV)
-        
-        alpha = anharm(dV)
+        alpha = anharm(rw.dV)
         print ("Anharmonicity of all dV = " + str(alpha))
-        
-        pmffile = 'dV-anharm-2D-'+str(args.input)+'.xvg'
+
+        pmffile = prefix+'dV-anharm-2D-'+str(input)+'.xvg'
         output_dV_anharm2D(pmffile,binsX,binsY,dV_anharm)
-        
-        pmffile = 'dV-stat-2D-'+str(args.input)+'.xvg'
+
+        pmffile = prefix+'dV-stat-2D-'+str(input)+'.xvg'
         output_dV_stat2D(pmffile,binsX,binsY,dV_avg,dV_std,dV_anharm)
-        
-        pmffile = 'dV-mat-2D-'+str(args.input)+'.xvg'
-        output_dV_mat2D(pmffile,binsX,binsY,hist2,dV_avg,dV_std,dV_anharm,dV_mat)
+
+        pmffile = prefix+'dV-mat-2D-'+str(input)+'.xvg'
+        sidecar = prefix+'dV-mat-2D-'+str(input)+'.npz' if dVmat == 'npz' else None
+        output_dV_mat2D(pmffile,binsX,binsY,hist2,dV_avg,dV_std,dV_anharm,dV_ragged,sidecar)
+        if sidecar:
+            print ("dV SAMPLES SAVED "+sidecar)
+
+    if plt_figs and plot :
+        ## a streamed run keeps no per-frame weights to plot
+        weights = rw.weights(job, order) if isinstance(rw, Reweighter) else None
+        if isinstance(rw, SparseReweighter):
+            hist2 = rw.dense(hist2, rw.cb_max)   ## empty bins drawn at Emax
+        plotjob(rw, hist2, weights, prefix)
+
+##BLOCK-BOOTSTRAP ERROR BARS
+def bootstrapjob(blocks, rw, job, input, prefix, order, args):
+    errors = blocks.bootstrap(job, int(args.bootstrap), seed=args.seed, workers=args.workers, order=order)
+    full = rw.run(job, order)
+    for term, (mean, std) in errors.items():
+        name = {'pmf': 'pmf', 'hist': 'histo'}.get(term, 'pmf-'+term)
+        pmffile = prefix+name+'-err-'+str(input)+'.xvg'
+        output_pmf2D_err(pmffile,full[term],mean,std,rw.binsX,rw.binsY)
+        print ("BOOTSTRAP "+str(args.bootstrap)+" REPLICATES SAVED "+pmffile)
 
 ###PLOTTING FUNCTION FOR FREE ENERGY FIGURE
-    if plt_figs :
-        cbar_ticks=[0, cb_max*.25, cb_max*.5, cb_max*.75, 8.0]
-        plt.figure(2, figsize=(11,8.5))
-        extent = [newedgesX[0], newedgesX[-1], newedgesY[-1], newedgesY[0]]
-        print (extent)
-        plt.imshow(hist2.transpose(), extent=extent, interpolation='gaussian')
-        cb = plt.colorbar(ticks=cbar_ticks, format=('% .1f'), aspect=10) # grab the Colorbar instance
-        imaxes = plt.gca()
-        plt.sca(cb.ax)
-        #plt.clim(vmin=0,vmax=8.0)
-        plt.yticks(fontsize=18)
-        plt.sca(imaxes)
-        axis=(min(binsX), max(binsX), min(binsY), max(binsY))
-        plt.axis(axis)
-        plt.xticks(size='18')
-        plt.yticks(size='18')
-        plt.xlabel('RMSD ($\AA$)',fontsize=18)
-        plt.ylabel('Radius of gyration ($\AA$)',fontsize=18)
+def plotjob(rw, hist2, weights, prefix):
+    import matplotlib
+    matplotlib.use('Agg')   ## no display on compute nodes
+    import matplotlib.pyplot as plt
+    cb_max = rw.cb_max
+    binsX, binsY = rw.edges()
+    cbar_ticks=[0, cb_max*.25, cb_max*.5, cb_max*.75, 8.0]
+    plt.figure(2, figsize=(11,8.5))
+    extent = [binsX[0], binsX[-1], binsY[-1], binsY[0]]
+    print (extent)
+    plt.imshow(hist2.transpose(), extent=extent, interpolation='gaussian')
+    cb = plt.colorbar(ticks=cbar_ticks, format=('% .1f'), aspect=10) # grab the Colorbar instance
+    imaxes = plt.gca()
+    plt.sca(cb.ax)
+    #plt.clim(vmin=0,vmax=8.0)
+    plt.yticks(fontsize=18)
+    plt.sca(imaxes)
+    axis=(min(binsX), max(binsX), min(binsY), max(binsY))
+    plt.axis(axis)
+    plt.xticks(size='18')
+    plt.yticks(size='18')
+    plt.xlabel('RMSD ($\\AA$)',fontsize=18)
+    plt.ylabel('Radius of gyration ($\\AA$)',fontsize=18)
 ##    	plt.xlabel(r'$\phi$',fontsize=18)
 ##    	plt.ylabel(r'$\psi$',fontsize=18)
 ##    	plt.xlabel(r'$\chi$1',fontsize=18)
 ##    	plt.ylabel(r'$\chi$2',fontsize=18)
-        plt.savefig('2D_Free_energy_surface.png',bbox_inches=0)
-        print ("FIGURE SAVED 2D_Free_energy_surface.png")
-    
-###PLOTTING FUNCTION FOR WEIGHTS histogram
-        [hist, edges] = np.histogram(weights, bins=100)
-        width=np.absolute(np.subtract(edges[0], edges[1]))
-        plt.figure(1, figsize=(11,8.5))
-        plt.bar(edges[:100], hist, width=width, log=True)
-        plt.yscale('log')   ###if typerror is thrown delete .matplotlib/fontList.cache  file
-        plt.xticks(fontsize='18')
-        plt.yticks(fontsize='18')
-        plt.savefig('weights.png',bbox_inches=0)
-        print ("FIGURE SAVED weights.png")
+    plt.savefig(prefix+'2D_Free_energy_surface.png',bbox_inches=0)
+    print ("FIGURE SAVED "+prefix+"2D_Free_energy_surface.png")
+    plt.close(2)
 
-    print (" ")
-    print ("END")
+###PLOTTING FUNCTION FOR WEIGHTS histogram
+    if weights is None:
+        return
+    [hist, edges] = np.histogram(weights, bins=100)
+    width=np.absolute(np.subtract(edges[0], edges[1]))
+    plt.figure(1, figsize=(11,8.5))
+    plt.bar(edges[:100], hist, width=width, log=True)
+    plt.yscale('log')   ###if typerror is thrown delete .matplotlib/fontList.cache  file
+    plt.xticks(fontsize='18')
+    plt.yticks(fontsize='18')
+    plt.savefig(prefix+'weights.png',bbox_inches=0)
+    print ("FIGURE SAVED "+prefix+"weights.png")
+    plt.close(1)
 
 def cmdlineparse():
     parser = ArgumentParser(description="command line arguments")
-    parser.add_argument("-input", dest="input", required=True, help="2D input file", metavar="<2D input file>")
-    parser.add_argument("-job", dest="job", required=True, help="Reweighting method to use: <noweight>, <weighthist>, <amd_time>, <amd_dV>, <amdweight>, <amdweight_MC>, <amdweight_CE>", metavar="<Job type reweighting method>")
-    parser.add_argument("-weight", dest="weight", required=False, help="weight file", metavar="<weight file>")
+    parser.add_argument("-input", dest="input", required=True, help="2D input file (text, or harvest.npy/harvest.h5 from data_extract.py)", metavar="<2D input file>")
+    parser.add_argument("-job", dest="job", required=True, nargs="+", choices=JOBS, help="Reweighting method(s) to use: <noweight>, <weighthist>, <amd_time>, <amd_dV>, <amdweight>, <amdweight_MC>, <amdweight_CE>, <histo>. With several jobs, output files are prefixed with '<job>-'", metavar="<Job type reweighting method>")
+    parser.add_argument("-weight", dest="weight", required=False, help="weight file (weights.dat, or the same harvest.npy/harvest.h5 as -input)", metavar="<weight file>")
     parser.add_argument("-Xdim", dest="Xdim", required=False, nargs="+", help="Xdimensions", metavar="<Xmin Xmax >")
     parser.add_argument("-Ydim", dest="Ydim", required=False, nargs="+", help="Ydimension", metavar="<Ymin Ymax >")
     parser.add_argument("-discX", dest="discX", required=False,  help="Discretization size in X dimension", metavar="<discretization-X>")
@@ -226,247 +329,23 @@ def cmdlineparse():
     parser.add_argument("-T", dest="T", required=False,  help="Temperature", metavar="<Temperature>")
     parser.add_argument("-Emax", dest="Emax", required=False,  help="Maximum free energy", metavar="<Emax>")
     parser.add_argument("-fit", dest="fit", required=False, help="Fit deltaV distribution", metavar="<fit>")
-    parser.add_argument("-order", dest="order", required=False, help="Order of Maclaurin series", metavar="<order>")
+    parser.add_argument("-order", dest="order", required=False, nargs="+", help="Order(s) of Maclaurin series; several orders are computed in one pass and their amdweight_MC outputs prefixed with 'order<N>-'", metavar="<order>")
+    parser.add_argument("-chunk", dest="chunk", required=False, help="Stream the input in blocks of this many frames instead of loading it whole (not for amd_dV)", metavar="<frames>")
+    parser.add_argument("-bincache", dest="bincache", required=False, help="Directory caching the per-frame bin indices (int32, keyed by a hash of the data and bins) for later runs on the same data", metavar="<directory>")
+    parser.add_argument("-sparse", dest="sparse", action="store_true", help="Keep and write only the occupied bins (one row per occupied bin; not with -chunk/-bootstrap or amd_dV)")
+    parser.add_argument("-adaptive", dest="adaptive", required=False, help="Implies -sparse; merge bins below the cutoff with their neighbours in 2x2 blocks, up to this many times", metavar="<levels>")
+    parser.add_argument("-columns", dest="columns", required=False, nargs="+", help="Input columns to bin, any number of them: indices of a text input or names of a harvest file (e.g. rmsd rg rg_max); streams the data into an N-D grid (jobs of -chunk only)", metavar="<column>")
+    parser.add_argument("-disc", dest="disc", required=False, nargs="+", help="With -columns: bin size of every column, or one size for all (default: -discX, -discY, then 6)", metavar="<discretization>")
+    parser.add_argument("-dims", dest="dims", required=False, nargs="+", help="With -columns: min and max of every column (default: range of the data)", metavar="<min max>")
+    parser.add_argument("-marginal", dest="marginal", required=False, nargs="+", help="Also write the surface of these axes (comma separated, e.g. 0 1 0,2), summed from the N-D bins over the other axes; output prefixed with 'dims<axes>-'", metavar="<axes>")
+    parser.add_argument("-plot", dest="plot", action="store_true", help="Save the 2D_Free_energy_surface.png and weights.png figures (needs matplotlib)")
+    parser.add_argument("-dVmat", dest="dVmat", required=False, default="text", choices=("text", "npz"), help="amd_dV per-bin dV samples: printed as lists in dV-mat-2D-*.xvg (text), or stored as ragged offsets/values in a dV-mat-2D-*.npz sidecar (npz)", metavar="<text|npz>")
+    parser.add_argument("-bootstrap", dest="bootstrap", required=False, help="Number of block-bootstrap replicates for per-bin error bars (not for amd_dV)", metavar="<replicates>")
+    parser.add_argument("-block", dest="block", required=False, default="iteration", help="Bootstrap blocks: iteration or segment (harvest.npy/harvest.h5 input), or a number of consecutive frames", metavar="<iteration|segment|frames>")
+    parser.add_argument("-seed", dest="seed", required=False, type=int, help="Random seed for the bootstrap", metavar="<seed>")
+    parser.add_argument("-j", dest="workers", required=False, type=int, help="Threads computing bootstrap replicates", metavar="<threads>")
     args=parser.parse_args()
     return args
-    
-def loadfiletoarray(file):
-    loaded=np.loadtxt(file, usecols=[0,1])
-    print ("DATA LOADED:    "+file)
-    return loaded
-
-def weightparse(rows, args):
-    if args.job == "weighthist":
-        data=np.loadtxt(args.weight)
-        weights=data[:,0]
-        dV = np.zeros(rows)
-    elif args.job == "amd_time" or args.job == "amd_dV" or args.job == "amdweight" or args.job == "amdweight_MC" or args.job == "amdweight_CE" :
-        data=np.loadtxt(args.weight)
-        weights = np.exp(data[:,0])
-        dV = data[:,2]
-    elif args.job == "noweight" or args.job == "histo":
-        weights = np.zeros(rows)
-        weights = weights + 1
-        dV = np.zeros(rows)
-    else:
-        print ("ERROR JOBTYPE"+ args.job+ " NOT RECOGNIZED")
-        del data
-        del weights
-        del dV
-    return weights,dV
-
-def histo(data,hist_min,binsX,discX,binsY,discY):
-    hist2, newedgesX, newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=None)
-    return hist2,newedgesX,newedgesY
-
-def assignbins(dim, disc):
-    minimum=float(dim[0])
-    maximum=float(dim[1])
-    bins =np.arange(minimum,(maximum+disc),disc)
-    return bins
-
-def normalize2D(pmf,cb_max):
-    pmf=pmf-np.min(pmf)  ## zero value to lowest energy state
-    temphist=pmf
-    #set infinity free energy values to is cb_max
-    for jy in range(len(temphist[0,:])):
-      for jx in range(len(temphist[:,0])):
-        if np.isinf(temphist[jx,jy]):
-                temphist[jx,jy]=cb_max
-    return temphist
-
-def prephist(hist2,T,cb_max):
-    hist2=np.add(hist2,0.000000000000000001)  ###so that distrib
-    hist2=(0.001987*T)*np.log(hist2) ####Convert to free energy in Kcal/mol
-    hist2=np.max(hist2)-hist2  ## zero value to lowest energy state
-    temphist2=hist2
-    #set infinity free energy values to is cb_max
-    for jy in range(len(temphist2[0,:])):
-        for jx in range(len(temphist2[:,0])):
-            if np.isinf(temphist2[jx,jy]):
-                temphist2[jx,jy]=cb_max
-    return temphist2
-
-# memory usage is much reduced with multidimensional list for dV_mat; pretty fast ~ O(N)
-def reweight_CE(data,hist_min,binsX,discX,binsY,discY,dV,T,fit):
-    hist2, newedgesX, newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=None)
-
-    beta = 1.0/(0.001987*T)
-    nf = len(data[:,0])
-    nbinsX = len(hist2[:,0])
-    nbinsY = len(hist2[0,:])
-
-    c1 = np.zeros((nbinsX,nbinsY)) 
-    c2 = np.zeros((nbinsX,nbinsY)) 
-    c3 = np.zeros((nbinsX,nbinsY)) 
-
-    binfX = np.zeros(nf) # array for storing assigned bin of each frame
-    binfY = np.zeros(nf) # array for storing assigned bin of each frame
-    nA = np.zeros((nbinsX,nbinsY),dtype=int) # nA is equivalent to hist here
-    dV_avg = np.zeros((nbinsX,nbinsY)) 
-    dV_avg2 = np.zeros((nbinsX,nbinsY)) 
-    dV_avg3 = np.zeros((nbinsX,nbinsY)) 
-    dV_std = np.zeros((nbinsX,nbinsY)) 
-
-    dV_avg_all=np.average(dV)
-    dV_std_all=np.std(dV)
-    print ('dV all: avg = ', dV_avg_all, 'std = ', dV_std_all)
-
-    dV_mat = [[[[] for i in range(1)] for i in range(nbinsY)] for i in range(nbinsX)]
-    for i in range(len(data[:,0])):
-        jx = int((data[i,0]-binsX[0])/discX)
-        jy = int((data[i,1]-binsY[0])/discY)
-        if jx < nbinsX and jy < nbinsY :
-          binfX[i] = jx
-          binfY[i] = jy
-          dV_mat[jx][jy].append(dV[i])
-          nA[jx,jy] = nA[jx,jy]+1
-
-    for jx in range(nbinsX):
-      for jy in range(nbinsY):
-        if nA[jx,jy]>=hist_min :
-           num = int(nA[jx,jy])
-           atemp = np.asarray(dV_mat[jx][jy][1:num+1])
-           atemp2 = np.power(atemp,2)
-           atemp3 = np.power(atemp,3)
-           dV_avg[jx,jy] = np.average(atemp)
-           dV_std[jx,jy]=np.std(atemp)
-           dV_avg2[jx,jy]=np.average(atemp2)
-           dV_avg3[jx,jy]=np.average(atemp3)
-           del atemp
-           del atemp2
-           del atemp3
-           c1[jx,jy] = beta*dV_avg[jx,jy]
-           c2[jx,jy] = 0.5*beta**2*dV_std[jx,jy]**2
-           c3[jx,jy] = (1.0/6.0)*beta**3*(dV_avg3[jx,jy]-3.0*dV_avg2[jx,jy]*dV_avg[jx,jy]+2.0*dV_avg[jx,jy]**3)
-
-    del dV_mat
-    del dV_avg 
-    del dV_avg2
-    del dV_avg3
-    del dV_std 
-    return hist2,newedgesX,newedgesY,c1,c2,c3
-
-def reweight_dV(data,hist_min,binsX,binsY,discX,discY,dV,T):
-    hist2, newedgesX, newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=None)
-
-    nf = len(data[:,0])
-    nbinsX = len(hist2[:,0])
-    nbinsY = len(hist2[0,:])
-
-    binfX = np.zeros(nf) # array for storing assigned bin of each frame
-    binfY = np.zeros(nf) # array for storing assigned bin of each frame
-    nA = np.zeros((nbinsX,nbinsY),dtype=int) # nA is equivalent to hist here
-    dV_avg = np.zeros((nbinsX,nbinsY)) 
-    dV_std = np.zeros((nbinsX,nbinsY)) 
-    dV_anharm = np.zeros((nbinsX,nbinsY)) 
-
-    dV_mat = [[[[] for i in range(1)] for i in range(nbinsY)] for i in range(nbinsX)]
-    for i in range(len(data[:,0])):
-        jx = int((data[i,0]-binsX[0])/discX)
-        jy = int((data[i,1]-binsY[0])/discY)
-        if jx < nbinsX and jy < nbinsY :
-            binfX[i] = jx
-            binfY[i] = jy
-            dV_mat[jx][jy].append(dV[i])
-            nA[jx,jy] = nA[jx,jy]+1
-
-    for jx in range(nbinsX):
-      for jy in range(nbinsY):
-        dV_anharm[jx,jy] = 100
-        if nA[jx,jy]>=hist_min :
-            num = int(nA[jx,jy])
-            atemp = np.asarray(dV_mat[jx][jy][1:num+1])
-            dV_avg[jx,jy] = np.average(atemp)
-            dV_std[jx,jy]=np.std(atemp)
-            dV_anharm[jx,jy] = anharm(atemp)
-            del atemp
-    return hist2,newedgesX,newedgesY,binfX,binfY,dV_avg,dV_std,dV_anharm,dV_mat
-
-##  Convert histogram to free energy in Kcal/mol
-def hist2pmf2D(hist,hist_min,T):
-        nbinsX = len(hist[:,0])
-        nbinsY = len(hist[0,:])
-        pmf = np.zeros((nbinsX,nbinsY))
-        pmf_min = 100
-        for jx in range(len(hist[:,0])):
-          for jy in range(len(hist[0,:])):
-            if hist[jx,jy]>=hist_min :
-              pmf[jx,jy]=-(0.001987*T)*np.log(hist[jx,jy])
-            if pmf_min > pmf[jx,jy] :
-              pmf_min=pmf[jx,jy]
-##        pmf=pmf-pmf_min  ## zero value to lowest energy state
-        return pmf
-
-def output_pmf2D(pmffile,hist,binsX,binsY):
-        fpmf = open(pmffile, 'w')
-        strpmf='#RC1\tRC2\tPMF(kcal/mol)\n\n@    xaxis  label \"RC1\"\n@    yaxis  label \"RC2\"\n@TYPE xy\n'
-        fpmf.write(strpmf)
-        for jx in range(len(hist[:,0])):
-          for jy in range(len(hist[0,:])):
-                strpmf=str(binsX[jx]) + ' \t' + str(binsY[jy]) + ' \t' + str(hist[jx,jy]) + '\n'
-                fpmf.write(strpmf)
-        fpmf.closed
-        return fpmf
-
-def output_dV(pmffile,dV):
-        fpmf = open(pmffile, 'w')
-        strpmf='#dV \tp(dV) \n\n@    xaxis  label \"dV\"\n@    yaxis  label \"p(dV)\"\n@TYPE xy\n'
-        hist_dV, bin_dV = np.histogram(dV, bins=50)
-        for k in range(len(hist_dV)):
-            strpmf=strpmf + str(bin_dV[k]) + ' \t' + str(hist_dV[k]) + ' \n'
-        fpmf.write(strpmf)
-        fpmf.closed
-        return fpmf
-
-def output_dV_anharm2D(pmffile,binsX,binsY,dV_anharm):
-        fpmf = open(pmffile, 'w')
-        strpmf='#RC \tdV_anharm \tError\n\n@    xaxis  label \"RC\"\n@    yaxis  label \"dV_anmarm\"\n@TYPE xy\n'
-        fpmf.write(strpmf)
-        for jx in range(len(dV_anharm[:,0])):
-          for jy in range(len(dV_anharm[0,:])):
-                strpmf=str(binsX[jx]) + ' \t' + str(binsY[jy]) + ' \t' + str(dV_anharm[jx,jy]) + '\n'
-                fpmf.write(strpmf)
-        fpmf.closed
-        return fpmf
-
-def output_dV_stat2D(pmffile,binsX,binsY,dV_avg,dV_std,dV_anharm):
-        fpmf = open(pmffile, 'w')
-        strpmf='#RC \tdV_avg(kcal/mol) \tError\n\n@    xaxis  label \"RC\"\n@    yaxis  label \"dV(kcal/mol)\"\n@TYPE xydy\n'
-        fpmf.write(strpmf)
-        for jx in range(len(dV_anharm[:,0])):
-          for jy in range(len(dV_anharm[0,:])):
-            strpmf=str(binsX[jx]) + ' \t' + str(binsY[jy]) + ' \t' + str(dV_avg[jx,jy]) + ' \t' + str(dV_std[jx,jy]) + ' \t' + str(dV_anharm[jx,jy]) + '\n'
-            fpmf.write(strpmf)
-        fpmf.closed
-        return fpmf
-
-def output_dV_mat2D(pmffile,binsX,binsY,hist,dV_avg,dV_std,dV_anharm,dV_mat):
-        fpmf = open(pmffile, 'w')
-        strpmf='#RC \tNf \tdV_avg \tdV_std \tdV_ij \n\n@    xaxis  label \"RC\"\n@    yaxis  label \"dV(kcal/mol)\"\n@TYPE xy\n'
-        fpmf.write(strpmf)
-        for jx in range(len(hist[:,0])):
-          for jy in range(len(hist[0,:])):
-            nf_j = int(hist[jx,jy])
-            strpmf=str(binsX[jx]) + ' \t' + str(binsY[jy]) + ' \t' + str(hist[jx,jy]) + ' \t' + str(dV_avg[jx,jy]) + ' \t' + str(dV_std[jx,jy]) + ' \t' + str(dV_anharm[jx,jy])
-            strpmf=strpmf + ' \t' + str(dV_mat[jx][jy][1:nf_j+1])
-            strpmf=strpmf + '\n'
-            fpmf.write(strpmf)
-        fpmf.closed
-        return fpmf
-
-def anharm(data):
-    var=np.var(data)
-    hist, edges=np.histogram(data, 50, normed=True)
-    hist=np.add(hist,0.000000000000000001)  ###so that distrib
-    dx=edges[1]-edges[0]
-    S1=-1*np.trapz(np.multiply(hist, np.log(hist)),dx=dx)
-    S2=0.5*np.log(2.00*np.pi*np.exp(1.0)*var+0.000000000000000001)
-    alpha=S2-S1
-    if np.isinf(alpha):
-       alpha = 100
-    return alpha
- 
+
 if __name__ == '__main__':
     main()
-    
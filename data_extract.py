@@ -1,64 +1,451 @@
-import os 
+#!/usr/bin/env python3
+"""
+Harvest gamd.log, rmsd.dat and rg.dat from every ParGaMD segment
+
+Segments under traj_segs/<iter>/<seg> are parsed by a pool of worker
+processes and appended to a binary store in <sim_root>/harvest/. A
+manifest records the mtime and size of each harvested file, so later runs
+only parse new or changed segments before the outputs are regenerated in
+the simulation root: gamd.log, rmsd.dat and rg.dat as text, and/or
+harvest.npy / harvest.h5 with one named column per quantity.
+
+With --source west the progress coordinates are instead read from the
+pcoord datasets in west.h5 and joined with the GaMD boosts, taken from the
+auxdata/gamd dataset when runseg.sh stores it and from gamd.log otherwise.
+Progress coordinates beyond RMSD and Rg become the pcoord2, pcoord3, ...
+columns of the binary outputs; a one-dimensional pcoord (RMSD only) gives
+outputs without Rg.
+"""
+
+import json
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 
+SEGMENT_FILES = ('gamd.log', 'rmsd.dat', 'rg.dat')
+STORE_DIR = 'harvest'
+OUTPUT_FORMATS = ('text', 'npy', 'h5')
+SEG_STATUS_COMPLETE = 2  # westpa.core.segment.Segment.SEG_STATUS_COMPLETE
+
+# Column order of the pmemd -gamd log
+GAMD_COLUMNS = ('ntwx', 'total_nstep', 'potential', 'dihedral',
+                'total_force_weight', 'dihedral_force_weight',
+                'boost_potential', 'boost_dihedral')
+
+MANIFEST_DTYPE = np.dtype([
+    ('n_iter', '<i4'), ('seg_id', '<i4'),
+    ('offset', '<i8'), ('nrows', '<i8'),
+    ('mtime_ns', '<i8', (len(SEGMENT_FILES),)),
+    ('size', '<i8', (len(SEGMENT_FILES),)),
+])
+
+
+def record_dtype(ncols):
+    """Per-frame record layout for the given column counts of gamd.log, rmsd.dat and rg.dat
+
+    An optional ncols['pcoord'] adds the west.h5 progress coordinates beyond RMSD and Rg.
+    """
+    return np.dtype([('n_iter', '<i4'), ('seg_id', '<i4')]
+                    + [(name, '<f8', (ncols[name],)) for name in ('gamd', 'rmsd', 'rg')]
+                    + ([('pcoord', '<f8', (ncols['pcoord'],))] if ncols.get('pcoord') else []))
+
+
+def _is_index_dir(entry):
+    """True for the zero-padded iteration/segment directories WESTPA creates"""
+    return len(entry.name) == 6 and entry.name.isdigit() and entry.is_dir()
+
 
-path='/expanse/lustre/scratch/ssonti/temp_project/amber_learn/chignolin_tutorial/westpa_tutorials/tutorial7.3-chignolin/ParGaMD_finer'
-os.chdir(path)
+def list_segments(sim_root):
+    """Return (n_iter, seg_id, path) for every segment directory, in order"""
+    segments = []
+    traj_segs = os.path.join(sim_root, 'traj_segs')
+    with os.scandir(traj_segs) as it:
+        iter_dirs = sorted((e.name, e.path) for e in it if _is_index_dir(e))
+    for iter_name, iter_path in iter_dirs:
+        segments.extend(iteration_segments(iter_path, int(iter_name)))
+    return segments
 
-iters=len(next(os.walk('traj_segs'))[1])
-iter_iters=[]
-print(iters)
-os.chdir('traj_segs')
 
-for i in range(iters):
+def iteration_segments(iter_path, n_iter):
+    """Return (n_iter, seg_id, path) for the segment directories of one iteration, in order"""
+    with os.scandir(iter_path) as it:
+        seg_dirs = sorted((e.name, e.path) for e in it if _is_index_dir(e))
+    return [(n_iter, int(seg_name), seg_path) for seg_name, seg_path in seg_dirs]
 
-    #os.chdir('C:\\Users\\svdnr\\Desktop\\test1\\traj_segs')
 
-    iters_sub=len(next(os.walk('0000{:02d}'.format(i+1)))[1])
+def segment_stats(path):
+    """Return ((mtime_ns, ...), (size, ...)) of the segment files, or None if any is missing"""
+    try:
+        st = [os.stat(os.path.join(path, name)) for name in SEGMENT_FILES]
+    except OSError:
+        return None
+    return tuple(s.st_mtime_ns for s in st), tuple(s.st_size for s in st)
 
-    iter_iters.append(iters_sub)
-print(iter_iters)
-gamd_all=[]
-rmsd_all=[]
-rg_all=[]
-#os.chdir(path)
 
-for i in range(iters):
-    os.chdir(path)
-    os.chdir('traj_segs/00{:04d}'.format(i+1))
+def parse_segment(path):
+    """Parse one segment directory; returns None if any file is missing or unreadable"""
+    stats = segment_stats(path)
+    if stats is None:
+        return None
+    try:
+        gamd = np.loadtxt(os.path.join(path, 'gamd.log'), ndmin=2)
+        # The first pcoord frame is the parent structure, already counted by the parent segment
+        rmsd = np.loadtxt(os.path.join(path, 'rmsd.dat'), ndmin=2)[1:]
+        rg = np.loadtxt(os.path.join(path, 'rg.dat'), ndmin=2)[1:]
+    except (OSError, ValueError):
+        return None
+    return gamd, rmsd, rg, stats
 
-    for j in range(iter_iters[i]):
 
-        try:
-            os.chdir(path)
-            os.chdir('traj_segs/00{:04d}/00{:04d}'.format(i+1,j))
+class HarvestStore:
+    """Append-only frame records plus a manifest of the segments they came from"""
 
-            gamd=np.genfromtxt('gamd.log')
-            rmsd=np.genfromtxt('rmsd.dat')
-            rg=np.genfromtxt('rg.dat')
-            gamd_all.append(gamd)
-            rmsd_all.append(np.delete(rmsd,0,0))
-            rg_all.append(np.delete(rg,0,0))
-            #os.chdir(path)
+    def __init__(self, sim_root):
+        self.path = os.path.join(sim_root, STORE_DIR)
+        self.dtype = None
+        self.n_records = 0
+        self.manifest = np.zeros(0, dtype=MANIFEST_DTYPE)
+        self._index = {}
+        self._new = []
+        self._fh = None
 
-            print(j)
+    def _file(self, name):
+        return os.path.join(self.path, name)
 
-            print(j,i)
+    def open(self, rebuild=False):
+        os.makedirs(self.path, exist_ok=True)
+        if not rebuild and os.path.isfile(self._file('store.json')):
+            with open(self._file('store.json')) as fh:
+                meta = json.load(fh)
+            # No ncols yet: the last harvest found no readable segment
+            self.dtype = record_dtype(meta['ncols']) if meta.get('ncols') else None
+            self.n_records = int(meta['n_records'])
+            self.manifest = np.load(self._file('manifest.npy'))
+        self._index = {(int(m['n_iter']), int(m['seg_id'])): i for i, m in enumerate(self.manifest)}
+        # Drop anything a crashed run appended after the last saved manifest
+        with open(self._file('frames.bin'), 'ab') as fh:
+            fh.truncate(self.n_records * (self.dtype.itemsize if self.dtype else 0))
 
-        except:
+    def is_current(self, key, stats):
+        i = self._index.get(key)
+        if i is None or stats is None:
+            return False
+        m = self.manifest[i]
+        return tuple(m['mtime_ns']) == stats[0] and tuple(m['size']) == stats[1]
 
+    def append(self, n_iter, seg_id, gamd, rmsd, rg, stats):
+        """Append one parsed segment; returns False if its shape does not fit the store"""
+        nrows = len(gamd)
+        if len(rmsd) != nrows or len(rg) != nrows:
+            return False
+        ncols = {'gamd': gamd.shape[1], 'rmsd': rmsd.shape[1], 'rg': rg.shape[1]}
+        if self.dtype is None:
+            self.dtype = record_dtype(ncols)
+        elif any(self.dtype[name].shape != (n,) for name, n in ncols.items()):
+            return False
+        rec = np.empty(nrows, dtype=self.dtype)
+        rec['n_iter'] = n_iter
+        rec['seg_id'] = seg_id
+        rec['gamd'] = gamd
+        rec['rmsd'] = rmsd
+        rec['rg'] = rg
+        if self._fh is None:
+            self._fh = open(self._file('frames.bin'), 'ab')
+        self._fh.write(rec.tobytes())
+        self._new.append((n_iter, seg_id, self.n_records, nrows) + stats)
+        self.n_records += nrows
+        return True
+
+    def save(self, live_keys):
+        """Flush appended frames and rewrite the manifest for the segments in live_keys"""
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._fh = None
+        entries = {key: self.manifest[i].item() for key, i in self._index.items()}
+        for n_iter, seg_id, offset, nrows, mtimes, sizes in self._new:
+            entries[(n_iter, seg_id)] = (n_iter, seg_id, offset, nrows, mtimes, sizes)
+        self._new = []
+        live = [entries[key] for key in sorted(live_keys) if key in entries]
+        self.manifest = np.array(live, dtype=MANIFEST_DTYPE)
+        self._index = {(int(m['n_iter']), int(m['seg_id'])): i for i, m in enumerate(self.manifest)}
+
+        tmp = self._file('manifest.npy.tmp')
+        with open(tmp, 'wb') as fh:
+            np.save(fh, self.manifest)
+        os.replace(tmp, self._file('manifest.npy'))
+        meta = {'n_records': self.n_records}
+        if self.dtype is not None:
+            meta['ncols'] = {name: self.dtype[name].shape[0] for name in ('gamd', 'rmsd', 'rg')}
+        with open(self._file('store.json.tmp'), 'w') as fh:
+            json.dump(meta, fh)
+        os.replace(self._file('store.json.tmp'), self._file('store.json'))
+
+    def records(self):
+        """All frames of the manifest's segments, in (iteration, segment) order"""
+        if self.dtype is None or len(self.manifest) == 0:
+            return np.zeros(0, dtype=self.dtype or record_dtype({'gamd': 0, 'rmsd': 0, 'rg': 0}))
+        frames = np.memmap(self._file('frames.bin'), dtype=self.dtype, mode='r', shape=(self.n_records,))
+        offsets = self.manifest['offset']
+        nrows = self.manifest['nrows']
+        if np.array_equal(offsets[1:], (offsets + nrows)[:-1]):
+            return frames[offsets[0]:offsets[-1] + nrows[-1]]
+        starts = np.repeat(offsets - np.cumsum(nrows) + nrows, nrows)
+        return frames[starts + np.arange(nrows.sum())]
+
+
+def harvest(sim_root, workers=None, chunksize=16, rebuild=False):
+    """Bring the harvest store up to date and return the records of every complete segment"""
+    segments = list_segments(sim_root)
+    print('Found %d segments in %d iterations' % (len(segments), len({s[0] for s in segments})))
+
+    store = HarvestStore(sim_root)
+    store.open(rebuild)
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        stats = list(pool.map(segment_stats, [path for _n_iter, _seg_id, path in segments]))
+    live_keys = set()
+    todo = []
+    for (n_iter, seg_id, path), st in zip(segments, stats):
+        if st is None:
             continue
+        if store.is_current((n_iter, seg_id), st):
+            live_keys.add((n_iter, seg_id))
+        else:
+            todo.append((n_iter, seg_id, path))
+    print('%d segments already harvested, %d to parse' % (len(live_keys), len(todo)))
+
+    n_done = 0
+    n_skipped = 0
+    nbytes = 0
+    start = time.perf_counter()
+
+    paths = [path for _n_iter, _seg_id, path in todo]
+    if workers == 1 or not todo:
+        results = map(parse_segment, paths)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(parse_segment, paths, chunksize=chunksize)
+    try:
+        for (n_iter, seg_id, path), result in zip(todo, results):
+            if result is None:
+                n_skipped += 1
+                continue
+            if not store.append(n_iter, seg_id, *result):
+                print('Skipping %s: unexpected number of frames or columns' % path, file=sys.stderr)
+                n_skipped += 1
+                continue
+            live_keys.add((n_iter, seg_id))
+            n_done += 1
+            nbytes += sum(result[3][1])
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        store.save(live_keys)
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print('Harvested %d segments (%d skipped) in %.1f s: %.1f segments/s, %.1f MB/s'
+          % (n_done, n_skipped, elapsed, n_done / elapsed, nbytes / elapsed / 1e6))
+    records = store.records()
+    if len(records) == 0:
+        raise RuntimeError('no complete segments found under %s' % os.path.join(sim_root, 'traj_segs'))
+    return records
+
+
+def parse_gamd_log(path):
+    try:
+        return np.loadtxt(os.path.join(path, 'gamd.log'), ndmin=2)
+    except (OSError, ValueError):
+        return None
+
+
+def harvest_west(sim_root, west_h5=None, workers=None, chunksize=16):
+    """Build frame records from the pcoords in west.h5 and the GaMD boosts of each segment"""
+    import h5py
+
+    west_h5 = west_h5 or os.path.join(sim_root, 'west.h5')
+    start = time.perf_counter()
+    blocks = []
+    nbytes = 0
+    with h5py.File(west_h5, 'r') as f:
+        iterations = f['iterations']
+        for name in sorted(iterations):
+            group = iterations[name]
+            status = group['seg_index'].fields('status')[:]
+            seg_ids = np.flatnonzero(status == SEG_STATUS_COMPLETE)
+            if len(seg_ids) == 0:
+                continue
+            # One contiguous read per iteration; frame 0 is the parent structure
+            pcoord = group['pcoord'][...][seg_ids, 1:, :]
+            gamd = group['auxdata/gamd'][...][seg_ids] if 'auxdata/gamd' in group else None
+            nbytes += pcoord.nbytes + (gamd.nbytes if gamd is not None else 0)
+            blocks.append([int(name[5:]), seg_ids, pcoord, gamd])
+    if not blocks:
+        raise RuntimeError('no complete segments in %s' % west_h5)
+    # pcoord_ndim 1 runs carry the RMSD only; their records get an empty rg field
+    ndim = blocks[0][2].shape[2]
+
+    # Iterations written before auxdata/gamd was enabled fall back to the per-segment logs
+    missing = [(block, seg_id) for block in blocks if block[3] is None for seg_id in block[1]]
+    if missing:
+        paths = [os.path.join(sim_root, 'traj_segs', '%06d' % block[0], '%06d' % seg_id)
+                 for block, seg_id in missing]
+        print('Reading gamd.log for %d segments without auxdata/gamd' % len(paths))
+        if workers == 1:
+            logs = list(map(parse_gamd_log, paths))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                logs = list(pool.map(parse_gamd_log, paths, chunksize=chunksize))
+        by_iter = {}
+        for (block, seg_id), log in zip(missing, logs):
+            by_iter.setdefault(id(block), []).append(log)
+        for block in blocks:
+            if block[3] is None:
+                block[3] = by_iter[id(block)]
+                nbytes += sum(log.nbytes for log in block[3] if log is not None)
+
+    records = []
+    n_done = 0
+    n_skipped = 0
+    for n_iter, seg_ids, pcoord, gamd in blocks:
+        nrows = pcoord.shape[1]
+        keep = [i for i, log in enumerate(gamd) if log is not None and log.shape[0] == nrows]
+        n_done += len(keep)
+        n_skipped += len(seg_ids) - len(keep)
+        if not keep:
+            continue
+        gamd = np.asarray([gamd[i] for i in keep]) if isinstance(gamd, list) else gamd[keep]
+        if not records:
+            dtype = record_dtype({'gamd': gamd.shape[2], 'rmsd': 2, 'rg': 2 if ndim > 1 else 0,
+                                  'pcoord': max(ndim - 2, 0)})
+        rec = np.empty(len(keep) * nrows, dtype=dtype)
+        rec['n_iter'] = n_iter
+        rec['seg_id'] = np.repeat(seg_ids[keep], nrows)
+        frames = np.tile(np.arange(2, nrows + 2), len(keep))
+        rec['rmsd'][:, 0] = frames
+        rec['rmsd'][:, 1] = pcoord[keep, :, 0].ravel()
+        if ndim > 1:
+            rec['rg'][:, 0] = frames
+            rec['rg'][:, 1] = pcoord[keep, :, 1].ravel()
+        if pcoord.shape[2] > 2:
+            rec['pcoord'] = pcoord[keep, :, 2:].reshape(-1, pcoord.shape[2] - 2)
+        rec['gamd'] = gamd.reshape(-1, gamd.shape[2])
+        records.append(rec)
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print('Read %d segments (%d skipped) from %s in %.1f s: %.1f segments/s, %.1f MB/s'
+          % (n_done, n_skipped, west_h5, elapsed, n_done / elapsed, nbytes / elapsed / 1e6))
+    if not records:
+        raise RuntimeError('no segments in %s with matching GaMD boosts' % west_h5)
+    return np.concatenate(records)
+
+
+def export_columns(dtype):
+    """Named columns of the flat export layout as (name, record field, column index)"""
+    # rmsd and rg sit next to each other so readers can view both as one (N, 2) array
+    cols = [('n_iter', 'n_iter', None), ('seg_id', 'seg_id', None),
+            ('frame', 'rmsd', 0), ('rmsd', 'rmsd', 1)]
+    # no rg column for a one-dimensional (RMSD only) west.h5 harvest
+    if dtype['rg'].shape[0] > 1:
+        cols.append(('rg', 'rg', 1))
+    if dtype['rg'].shape[0] > 2:
+        cols.append(('rg_max', 'rg', 2))
+    # further west.h5 progress coordinates, named by their pcoord dimension
+    if 'pcoord' in dtype.names:
+        cols.extend(('pcoord%d' % (i + 2), 'pcoord', i) for i in range(dtype['pcoord'].shape[0]))
+    ngamd = dtype['gamd'].shape[0]
+    names = GAMD_COLUMNS if ngamd == len(GAMD_COLUMNS) else ['gamd_%d' % i for i in range(ngamd)]
+    cols.extend((name, 'gamd', i) for i, name in enumerate(names))
+    return cols
+
+
+def _export_blocks(records, chunk=1 << 20):
+    """Yield (start, stop, {column: values}) for the records in bounded-size blocks"""
+    cols = export_columns(records.dtype)
+    for start in range(0, len(records), chunk):
+        block = records[start:start + chunk]
+        yield start, start + len(block), {
+            name: block[field] if i is None else block[field][:, i] for name, field, i in cols}
+
+
+def write_npy(path, records):
+    """Write records as a structured .npy that np.load(..., mmap_mode='r') can map"""
+    cols = export_columns(records.dtype)
+    dtype = np.dtype([(name, '<i4' if i is None else '<f8') for name, _field, i in cols])
+    tmp = path + '.tmp'
+    out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(len(records),))
+    for start, stop, block in _export_blocks(records):
+        for name, values in block.items():
+            out[name][start:stop] = values
+    out.flush()
+    del out
+    os.replace(tmp, path)
+
+
+def write_h5(path, records):
+    """Write records as one 1-D HDF5 dataset per named column"""
+    import h5py
+
+    cols = export_columns(records.dtype)
+    tmp = path + '.tmp'
+    with h5py.File(tmp, 'w') as f:
+        dsets = {name: f.create_dataset(name, shape=(len(records),), dtype='<i4' if i is None else '<f8')
+                 for name, _field, i in cols}
+        for start, stop, block in _export_blocks(records):
+            for name, values in block.items():
+                dsets[name][start:stop] = values
+        f.attrs['columns'] = [name for name, _field, _i in cols]
+    os.replace(tmp, path)
+
+
+def write_text(sim_root, records):
+    np.savetxt(os.path.join(sim_root, 'gamd.log'), records['gamd'])
+    np.savetxt(os.path.join(sim_root, 'rmsd.dat'), records['rmsd'])
+    if records['rg'].shape[1]:
+        np.savetxt(os.path.join(sim_root, 'rg.dat'), records['rg'])
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Collect per-segment GaMD boosts and progress coordinates")
+    parser.add_argument("sim_root", nargs="?", default=os.environ.get("WEST_SIM_ROOT", "."),
+                        help="simulation root containing traj_segs/ (default: $WEST_SIM_ROOT or .)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="number of parser processes (default: all CPUs, 1 = serial)")
+    parser.add_argument("--chunksize", type=int, default=16,
+                        help="segments handed to a worker at a time")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="discard the harvest store and parse every segment again")
+    parser.add_argument("--source", choices=("segments", "west"), default="segments",
+                        help="take progress coordinates from per-segment rmsd.dat/rg.dat files (default) "
+                             "or from the pcoord datasets in west.h5")
+    parser.add_argument("--west-h5", dest="west_h5", default=None,
+                        help="WESTPA data file for --source west (default: <sim_root>/west.h5)")
+    parser.add_argument("--format", nargs="+", choices=OUTPUT_FORMATS, default=["text"],
+                        help="outputs to write: text (gamd.log, rmsd.dat, rg.dat), npy (harvest.npy), "
+                             "h5 (harvest.h5)")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    if args.source == 'west':
+        records = harvest_west(args.sim_root, args.west_h5, args.workers, args.chunksize)
+    else:
+        records = harvest(args.sim_root, args.workers, args.chunksize, args.rebuild)
 
-dims1=np.shape(gamd_all)
-print(dims1)
-dims2=np.shape(rmsd_all)
-dims3=np.shape(rg_all)
+    if 'text' in args.format:
+        write_text(args.sim_root, records)
+    if 'npy' in args.format:
+        write_npy(os.path.join(args.sim_root, 'harvest.npy'), records)
+    if 'h5' in args.format:
+        write_h5(os.path.join(args.sim_root, 'harvest.h5'), records)
+    print('%d frames written to %s (%s)' % (len(records), args.sim_root, ', '.join(args.format)))
 
-gamd_write=np.reshape(gamd_all,(dims1[0]*dims1[1],dims1[2]))
-rmsd_write=np.reshape(rmsd_all,(dims2[0]*dims2[1],dims2[2]))
-rg_write=np.reshape(rg_all,(dims3[0]*dims3[1],dims3[2]))
 
-os.chdir(path)
-log_gamd=np.savetxt('gamd.log',gamd_write)
-log_rmsd=np.savetxt('rmsd.dat',rmsd_write)
-log_rg=np.savetxt('rg.dat',rg_write)
+if __name__ == '__main__':
+    main()
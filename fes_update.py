@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Fold new WE iterations into a stored free energy surface
+
+The per-bin sums of pyreweighting.BinAccumulator (counts, weight sums and
+dV moments) are kept in <sim_root>/fes/state.npz together with the list of
+iterations already folded in. Each run parses only the segments of the
+iterations that are not in the state yet, adds them, and rewrites the
+PMFs in <sim_root>/fes/, so the surface can be watched while WESTPA runs.
+
+Create the state once with the grid to use:
+
+    python fes_update.py $WEST_SIM_ROOT --init -Xdim 0 20 -Ydim 0 20 -disc 0.1
+
+after which westpa_scripts/post_iter.sh calls
+
+    python fes_update.py $WEST_SIM_ROOT --iter $WEST_CURRENT_ITER
+
+at the end of every iteration. Frames are read exactly as data_extract.py
+harvests them (RMSD and Rg from the second column of rmsd.dat/rg.dat, the
+first frame of each segment dropped; dV from the gamd.log boosts).
+
+Only finished iterations are folded: those older than the newest
+traj_segs directory, and the one the post_iteration hook has just
+completed ($WEST_CURRENT_ITER, or --finished). west.h5 is not read, as
+w_run holds it open for writing. An iteration with a segment that cannot
+be parsed is left out of the state and tried again on the next run.
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_extract import GAMD_COLUMNS, iteration_segments, parse_segment
+from pyreweighting import BinAccumulator, assignbins, output_pmf2D
+
+FES_DIR = 'fes'
+STATE_FILE = 'state.npz'
+BOOST_COLUMNS = [GAMD_COLUMNS.index('boost_potential'), GAMD_COLUMNS.index('boost_dihedral')]
+
+
+def segment_frames(result):
+    """(data, dV) of one parsed segment, or None if its files disagree on the number of frames"""
+    gamd, rmsd, rg, _stats = result
+    if not len(gamd) == len(rmsd) == len(rg):
+        return None
+    return np.column_stack((rmsd[:, 1], rg[:, 1])), gamd[:, BOOST_COLUMNS].sum(axis=1)
+
+
+def iteration_frames(sim_root, n_iter, pool=None):
+    """(data, dV, n_parsed, n_segments) of one iteration; data and dV cover the segments that parsed"""
+    iter_path = os.path.join(sim_root, 'traj_segs', '%06d' % n_iter)
+    if not os.path.isdir(iter_path):
+        return None
+    paths = [path for _n_iter, _seg_id, path in iteration_segments(iter_path, n_iter)]
+    results = pool.map(parse_segment, paths) if pool is not None else map(parse_segment, paths)
+    frames = [f for f in (segment_frames(r) for r in results if r is not None) if f is not None]
+    if not frames:
+        return np.zeros((0, 2)), np.zeros(0), 0, len(paths)
+    return (np.concatenate([d for d, _dV in frames]), np.concatenate([dV for _d, dV in frames]),
+            len(frames), len(paths))
+
+
+def pending_iterations(sim_root, folded, last, finished=None):
+    """Finished iterations up to last that have segment directories and are not folded in yet
+
+    Finished means older than the newest iteration directory, which may still
+    be running, or equal to finished, the iteration WESTPA has just completed.
+    """
+    traj_segs = os.path.join(sim_root, 'traj_segs')
+    with os.scandir(traj_segs) as it:
+        iters = sorted(int(e.name) for e in it if len(e.name) == 6 and e.name.isdigit() and e.is_dir())
+    iters = [n for n in iters if n < iters[-1] or n == finished] if iters else []
+    return [n for n in iters if n not in folded and (last is None or n <= last)]
+
+
+def write_fes(acc, outdir, jobs):
+    """Regenerate the PMF files of the given jobs from the accumulator"""
+    names = {'pmf': 'pmf-%s.xvg', 'c1': 'pmf-c1.xvg', 'c2': 'pmf-c2.xvg', 'c3': 'pmf-c3.xvg'}
+    written = []
+    for job in jobs:
+        for term, grid in acc.run(job).items():
+            path = os.path.join(outdir, names[term] % job if term == 'pmf' else names[term])
+            output_pmf2D(path, grid, acc.binsX, acc.binsY)
+            written.append(path)
+    return written
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Fold new WE iterations into the stored free energy surface")
+    parser.add_argument("sim_root", nargs="?", default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help="simulation root containing traj_segs/ (default: $WEST_SIM_ROOT or .)")
+    parser.add_argument("--iter", type=int, default=None,
+                        help="fold iterations up to this one (post_iter.sh passes $WEST_CURRENT_ITER; default: all)")
+    parser.add_argument("--init", action="store_true", help="create a new, empty state with the grid below")
+    parser.add_argument("--force", action="store_true", help="let --init replace an existing state")
+    parser.add_argument("--finished", type=int, default=int(os.environ.get('WEST_CURRENT_ITER', 0)) or None,
+                        help="iteration known to be complete, although no newer one has started "
+                             "(default: $WEST_CURRENT_ITER, set by WESTPA for the post_iteration hook)")
+    parser.add_argument("-Xdim", nargs=2, type=float, metavar=("Xmin", "Xmax"), help="RMSD range (with --init)")
+    parser.add_argument("-Ydim", nargs=2, type=float, metavar=("Ymin", "Ymax"), help="Rg range (with --init)")
+    parser.add_argument("-disc", type=float, default=0.1, help="bin size in X (with --init)")
+    parser.add_argument("-discY", type=float, default=None, help="bin size in Y (with --init; default: -disc)")
+    parser.add_argument("-T", type=float, default=300.0, help="temperature (with --init)")
+    parser.add_argument("-cutoff", type=int, default=10, help="histogram cutoff (with --init)")
+    parser.add_argument("-Emax", type=float, default=8.0, help="maximum free energy (with --init)")
+    parser.add_argument("-order", type=int, default=10, help="Maclaurin order for amdweight_MC (with --init)")
+    parser.add_argument("-job", nargs="+", default=["amdweight_CE", "noweight"],
+                        choices=("noweight", "amdweight", "amdweight_MC", "amdweight_CE"), help="PMFs to write")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes parsing segments (default: all CPUs; 1 parses inline)")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    outdir = os.path.join(args.sim_root, FES_DIR)
+    state = os.path.join(outdir, STATE_FILE)
+
+    if args.init:
+        if not (args.Xdim and args.Ydim):
+            raise SystemExit('ERROR: --init needs -Xdim and -Ydim')
+        if os.path.exists(state) and not args.force:
+            raise SystemExit('ERROR: %s exists; pass --force to replace it' % state)
+        os.makedirs(outdir, exist_ok=True)
+        discY = args.discY or args.disc
+        acc = BinAccumulator(assignbins(args.Xdim, args.disc), assignbins(args.Ydim, discY), args.disc, discY,
+                             args.T, args.cutoff, args.Emax, args.order)
+        folded = np.zeros(0, dtype=np.int64)
+    elif os.path.exists(state):
+        acc, extra = BinAccumulator.load(state)
+        folded = extra['iterations']
+    else:
+        raise SystemExit('ERROR: no %s; create it with --init' % state)
+
+    start = time.perf_counter()
+    nfolded = len(folded)
+    todo = pending_iterations(args.sim_root, set(folded.tolist()), args.iter, args.finished)
+    pool = ProcessPoolExecutor(max_workers=args.workers) if args.workers != 1 and todo else None
+    try:
+        for n_iter in todo:
+            data, dV, nsegs, ndirs = iteration_frames(args.sim_root, n_iter, pool)
+            if nsegs < ndirs or not nsegs:
+                ## folded only as a whole, so a later run picks up the missing segments
+                print('Iteration %d: %d of %d segments readable, not folded yet' % (n_iter, nsegs, ndirs))
+                continue
+            acc.add(data, dV / (0.001987 * acc.T), dV)
+            folded = np.append(folded, n_iter)
+            print('Iteration %d: %d segments, %d frames' % (n_iter, nsegs, len(data)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    t_fold = time.perf_counter() - start
+
+    acc.save(state, iterations=folded)
+    start = time.perf_counter()
+    written = write_fes(acc, outdir, args.job) if acc.frames else []
+    print('Folded %d of %d iterations in %.3f s (%d frames total); wrote %d PMFs in %.3f s to %s'
+          % (len(folded) - nfolded, len(todo), t_fold, acc.frames, len(written), time.perf_counter() - start, outdir))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
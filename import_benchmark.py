@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Startup cost of PyReweighting-2D.py with and without -plot
+
+Runs the command line front end on a small synthetic data set in fresh
+interpreters and reports the best wall time of each mode and whether
+matplotlib was imported. Numeric-only runs must never load matplotlib;
+the script exits non-zero if one does.
+
+    python import_benchmark.py -repeat 5
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, 'PyReweighting-2D.py')
+
+## run the front end in-process so sys.modules can be inspected afterwards
+PROBE = ("import runpy, sys; sys.argv = %r; sys.path.insert(0, %r); "
+         "runpy.run_path(%r, run_name='__main__'); "
+         "sys.stderr.write('matplotlib loaded: %%s\\n' %% ('matplotlib' in sys.modules))")
+
+
+def run(argv, cwd):
+    """Wall time of one fresh interpreter and whether it imported matplotlib"""
+    code = PROBE % ([SCRIPT] + argv, HERE, SCRIPT) if argv is not None else 'pass'
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', code], cwd=cwd, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return time.perf_counter() - start, 'matplotlib loaded: True' in proc.stderr
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Time PyReweighting-2D.py startup with and without plotting")
+    parser.add_argument("-repeat", type=int, default=5, help="runs per mode (best time is reported)")
+    parser.add_argument("-frames", type=int, default=2000, help="frames of the synthetic input")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        np.savetxt(os.path.join(tmpdir, 'input.dat'),
+                   np.column_stack([rng.normal(3, 1, args.frames), rng.normal(7, 1, args.frames)]))
+        dV = rng.gamma(2.0, 2.0, args.frames)
+        np.savetxt(os.path.join(tmpdir, 'weights.dat'), np.column_stack([dV / 0.5961, np.zeros(args.frames), dV]))
+        numeric = ['-input', 'input.dat', '-weight', 'weights.dat', '-job', 'noweight', 'amdweight_CE', '-discX', '0.2', '-discY', '0.2']
+        modes = [('python -c pass', None), ('numeric', numeric), ('numeric -plot', numeric + ['-plot'])]
+
+        ok = True
+        print('%-16s %10s %12s' % ('mode', 'best (s)', 'matplotlib'))
+        for name, argv in modes:
+            runs = [run(argv, tmpdir) for _ in range(args.repeat)]
+            loaded = any(mpl for _t, mpl in runs)
+            if argv is not None and '-plot' not in argv and loaded:
+                ok = False
+            print('%-16s %10.3f %12s' % (name, min(t for t, _mpl in runs), 'yes' if loaded else 'no'))
+    if not ok:
+        sys.exit('ERROR: a numeric-only run imported matplotlib')
+
+
+if __name__ == '__main__':
+    main()
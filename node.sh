@@ -16,5 +16,12 @@ echo "environment is: "
 env | sort
 
 echo "CUDA_VISIBLE_DEVICES = " $CUDA_VISIBLE_DEVICES
+# Per-node pcoord daemon (PCOORD_DAEMON=1 in env.sh); runseg.sh computes pcoords itself when it is not running
+if [ -n "$PCOORD_DAEMON" ]; then
+  export PCOORD_SOCKET=${PCOORD_SOCKET:-${TMPDIR:-/tmp}/pcoord-$WEST_JOBID-$SLURM_NODENAME.sock}
+  python $WEST_SIM_ROOT/westpa_scripts/pcoord_daemon.py serve --socket $PCOORD_SOCKET &> pcoord-$SLURM_NODENAME.log &
+  PCOORD_PID=$!
+fi
 w_run "$@" &> west-$SLURM_NODENAME-node.log
+[ -n "$PCOORD_PID" ] && kill $PCOORD_PID
 echo "Shutting down.  Hopefully this was on purpose?"
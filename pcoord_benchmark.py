@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Per-segment pcoord cost: one pcoord.py process per segment vs the node daemon
+
+Writes synthetic seg.nc segments of the chignolin system (the basis state
+plus noise) into a simulation root laid out like runseg.sh's (traj_segs
+with the topology and parent.rst linked into every segment directory),
+then runs the pcoord command of the ui_app.py runseg.sh template in each
+of them, once as a fresh westpa_scripts/pcoord.py process per segment and
+once as pcoord_daemon.py client processes talking to one running daemon,
+and with cpptraj when $CPPTRAJ or cpptraj is available. Reports the mean
+wall time per segment of each mode. The script exits non-zero unless the
+pcoord, rmsd.dat and rg.dat files of the two Python modes are identical,
+the daemon loaded the topology once and no client fell back to computing
+locally.
+
+    python pcoord_benchmark.py -segments 50 -frames 101
+"""
+
+import filecmp
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = os.path.join(HERE, 'westpa_scripts')
+sys.path.insert(0, SCRIPTS)
+
+from cat_trajectory import write_netcdf
+from pcoord import read_frames
+
+PROTEIN = 'chignolin'
+PRMTOP = os.path.join(HERE, 'common_files', PROTEIN + '.prmtop')
+REFERENCE = os.path.join(HERE, 'common_files', PROTEIN + '.pdb')
+BSTATE = os.path.join(HERE, 'bstates', 'bstate.rst')
+OUTPUTS = ('pcoord.dat', 'rmsd.dat', 'rg.dat')
+CPPTRAJ_INPUT = ("parm %s\ntrajin %s\ntrajin seg.nc\nreference %s\n"
+                 "rms ca-rmsd @CA reference out rmsd.dat mass\nradgyr ca-rg @CA out rg.dat mass\ngo\n")
+
+
+def runseg_command(daemon):
+    """The pcoord command runseg.sh runs with the Python pcoord option, rendered from ui_app.py"""
+    from jinja2 import Template
+    with open(os.path.join(HERE, 'ui_app.py')) as f:
+        source = f.read()
+    match = re.search(r'python \$WEST_SIM_ROOT/westpa_scripts/\{% if pcoord_daemon %\}.*?parent\.rst seg\.nc',
+                      source, re.S)
+    command = Template(match.group(0).replace('\\\\', '\\')).render(pcoord_daemon=daemon, protein_name=PROTEIN,
+                                                                     pcoord_ndim=2)
+    return shlex.quote(sys.executable) + command[len('python'):]
+
+
+def make_segments(root, nsegs, nframes):
+    """Simulation root with common_files, westpa_scripts and one iteration of runseg.sh-style segments"""
+    os.makedirs(os.path.join(root, 'common_files'))
+    for path in (PRMTOP, REFERENCE):
+        os.symlink(path, os.path.join(root, 'common_files', os.path.basename(path)))
+    os.symlink(SCRIPTS, os.path.join(root, 'westpa_scripts'))
+    rng = np.random.default_rng(0)
+    start = read_frames(BSTATE)[0]
+    dirs = []
+    for seg_id in range(nsegs):
+        path = os.path.join(root, 'traj_segs', '000001', '%06d' % seg_id)
+        os.makedirs(path)
+        os.symlink(os.path.join(root, 'common_files', PROTEIN + '.prmtop'), os.path.join(path, PROTEIN + '.prmtop'))
+        os.symlink(BSTATE, os.path.join(path, 'parent.rst'))
+        write_netcdf(os.path.join(path, 'seg.nc'),
+                     (start + rng.normal(0, 0.5, (nframes,) + start.shape)).astype(np.float32))
+        dirs.append(path)
+    return dirs
+
+
+def timed(command, dirs, env):
+    """Mean wall time of running the command in every segment directory, and the stderr of all runs"""
+    errors = []
+    start = time.perf_counter()
+    for cwd in dirs:
+        run = subprocess.run(['bash', '-c', command], cwd=cwd, env=env, check=True, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+        errors.append(run.stderr)
+    return (time.perf_counter() - start) / len(dirs), ''.join(errors)
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Time per-segment pcoord processes against the per-node daemon")
+    parser.add_argument("-segments", type=int, default=50, help="synthetic segments (default: 50)")
+    parser.add_argument("-frames", type=int, default=101, help="frames per segment (default: 101)")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    cpptraj = os.environ.get('CPPTRAJ') or shutil.which('cpptraj')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        modes = {name: make_segments(os.path.join(tmpdir, name), args.segments, args.frames)
+                 for name in ('process', 'daemon')}
+        sock = os.path.join(tmpdir, 'pcoord.sock')
+        env = dict(os.environ, WEST_PCOORD_RETURN='pcoord.dat', PCOORD_SOCKET=sock)
+        times = {}
+        times['process'], _ = timed(runseg_command(False), modes['process'],
+                                    dict(env, WEST_SIM_ROOT=os.path.join(tmpdir, 'process')))
+
+        log = os.path.join(tmpdir, 'daemon.log')
+        with open(log, 'w') as out:
+            daemon = subprocess.Popen([sys.executable, os.path.join(SCRIPTS, 'pcoord_daemon.py'), 'serve',
+                                       '--socket', sock], stdout=out)
+        try:
+            while not os.path.exists(sock):
+                time.sleep(0.05)
+            times['daemon'], fallbacks = timed(runseg_command(True), modes['daemon'],
+                                               dict(env, WEST_SIM_ROOT=os.path.join(tmpdir, 'daemon')))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+        with open(log) as f:
+            loads = sum(1 for line in f if line.startswith('pcoord daemon: loaded'))
+
+        if cpptraj:
+            modes['cpptraj'] = make_segments(os.path.join(tmpdir, 'cpptraj'), args.segments, args.frames)
+            script = CPPTRAJ_INPUT % (PRMTOP, BSTATE, REFERENCE)
+            start = time.perf_counter()
+            for cwd in modes['cpptraj']:
+                subprocess.run([cpptraj], input=script, universal_newlines=True, cwd=cwd, check=True,
+                               stdout=subprocess.DEVNULL)
+            times['cpptraj'] = (time.perf_counter() - start) / args.segments
+
+        same = all(filecmp.cmp(os.path.join(a, name), os.path.join(b, name), shallow=False)
+                   for a, b in zip(modes['process'], modes['daemon']) for name in OUTPUTS)
+
+    print('%d segments of %d frames' % (args.segments, args.frames))
+    print('%-10s %14s %10s' % ('mode', 'ms/segment', 'speedup'))
+    for name, t in sorted(times.items(), key=lambda item: -item[1]):
+        print('%-10s %14.1f %10.1f' % (name, 1000 * t, times['process'] / t))
+    if not cpptraj:
+        print('cpptraj not found ($CPPTRAJ), skipped')
+    print('daemon outputs identical to pcoord.py: %s' % same)
+    print('daemon topology loads: %d' % loads)
+    if fallbacks:
+        print('clients that did not use the daemon:\n' + fallbacks, end='')
+    if not same or loads != 1 or fallbacks:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1309 @@
+"""
+PyReweighting engine for 2D GaMD/aMD free energy surfaces
+
+Importable counterpart of PyReweighting-2D.py: file loaders, binning,
+histogram/PMF transforms, per-bin dV statistics, the xvg writers and the
+Reweighter class, which loads and bins a data set once and then serves
+every reweighting job from the cached binning.
+
+    rw = Reweighter.fromfiles('input.dat', 'weights.dat', discX=0.1, discY=0.1)
+    pmf = rw.noweight()
+    pmf_c1, pmf_c2, pmf_c3 = rw.amdweight_CE()
+
+BinAccumulatorND bins any number of columns the way np.histogramdd does and
+derives lower dimensional surfaces from its per-bin sums (marginal()).
+
+Based on PyReweighting by Yinglong Miao and Bill Sinko, Copyright <2014-2019>.
+Please cite: Miao Y, Sinko W, Pierce L, Bucher D, Walker RC, McCammon JA (2014)
+Improved reweighting of accelerated molecular dynamics simulations for free
+energy calculation. J Chemical Theory and Computation. 10(7): 2677-2689.
+"""
+
+import hashlib
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+trapezoid = getattr(np, 'trapezoid', None) or np.trapz  ## np.trapz was removed in NumPy 2
+
+BANNER = ("============================================================\n"
+          "PyReweighting: Python scripts used to reweight accelerated molecular dynamics simulations.\n"
+          "  \n"
+          "Authors: Yinglong Miao <yinglong.miao@gmail.com>\n"
+          "         Bill Sinko <wsinko@gmail.com>\n"
+          "\n"
+          "Copyright <2014-2019> <Yinglong Miao and William Sinko> \n"
+          "\n"
+          "Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the \"PyReweighting\"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following citation: \n"
+          "\n"
+          "Miao Y, Sinko W, Pierce L, Bucher D, Walker RC, McCammon JA (2014) Improved reweighting of accelerated molecular dynamics simulations for free energy calculation. J Chemical Theory and Computation. 10(7): 2677-2689.\n")
+
+## Binary harvest files (data_extract.py --format npy/h5) carry named columns
+HARVEST_COLUMNS = ['rmsd', 'rg']
+
+## Jobs that need the dV/weights file
+WEIGHTED_JOBS = ("weighthist", "amd_time", "amd_dV", "amdweight", "amdweight_MC", "amdweight_CE")
+JOBS = ("noweight", "histo") + WEIGHTED_JOBS
+
+## Jobs BinAccumulator can serve from per-bin sums (amd_dV needs every dV of a bin)
+STREAM_JOBS = ("noweight", "histo", "weighthist", "amd_time", "amdweight", "amdweight_MC", "amdweight_CE")
+
+## Frames per block when streaming the input
+CHUNK_FRAMES = 1 << 20
+
+## Size cap of a bin index cache directory; the least recently used indices are removed beyond it
+BINCACHE_MAX_BYTES = 2 << 30
+
+## Bootstrap blocks taken from the n_iter/seg_id columns of a harvest file
+BLOCK_KINDS = ("iteration", "segment")
+
+## Most bootstrap blocks a BlockAccumulator takes; every replicate draws this many block indices
+MAX_BLOCKS = 1 << 20
+
+def loadharvest(file, columns):
+    if file.endswith('.npy'):
+        from numpy.lib.recfunctions import structured_to_unstructured
+        harvest = np.load(file, mmap_mode='r')
+        ## a view into the memory map when the columns are adjacent, so nothing is copied
+        return structured_to_unstructured(harvest[columns], copy=False)
+    import h5py
+    with h5py.File(file, 'r') as f:
+        return np.column_stack([f[name][:] for name in columns])
+
+def isharvest(file):
+    return str(file).endswith(('.npy', '.h5', '.hdf5'))
+
+## Columns of the progress coordinates: indices of a text file or names of a harvest file (default the first two /
+## HARVEST_COLUMNS); digit strings from the command line are taken as indices
+def inputcolumns(file, columns=None):
+    if columns is None:
+        return HARVEST_COLUMNS if isharvest(file) else [0,1]
+    columns = [int(c) if str(c).isdigit() else c for c in columns]
+    if isharvest(file):
+        return [c if isinstance(c, str) else HARVEST_COLUMNS[c] for c in columns]
+    return columns
+
+def loadfiletoarray(file, columns=None):
+    columns = inputcolumns(file, columns)
+    if isharvest(file):
+        loaded=loadharvest(file, columns)
+    else:
+        loaded=np.loadtxt(file, usecols=columns, ndmin=2)
+    return loaded
+
+def loaddV(file, T):
+    ## returns (beta*dV, dV), the first and third columns of a weights.dat file
+    if isharvest(file):
+        boost = loadharvest(file, ['boost_potential', 'boost_dihedral'])
+        dV = boost[:,0] + boost[:,1]
+        return dV/(0.001987*T), dV
+    data=np.loadtxt(file)
+    return data[:,0], data[:,2]
+
+def _textblocks(file, usecols, chunk):
+    with open(file) as f:
+        ## comment and blank lines are dropped first so blocks of different files stay aligned
+        rows = (line for line in f if line.strip() and not line.lstrip().startswith('#'))
+        while True:
+            lines = list(itertools.islice(rows, chunk))
+            if not lines:
+                return
+            yield np.loadtxt(lines, usecols=usecols, ndmin=2)
+
+def _harvestblocks(file, columns, chunk):
+    if file.endswith('.npy'):
+        loaded = loadharvest(file, columns)
+        for start in range(0, len(loaded), chunk):
+            yield np.array(loaded[start:start+chunk], dtype=np.float64)
+        return
+    import h5py
+    with h5py.File(file, 'r') as f:
+        for start in range(0, len(f[columns[0]]), chunk):
+            yield np.column_stack([f[name][start:start+chunk] for name in columns])
+
+def iterframes(input, weight=None, T=300, chunk=CHUNK_FRAMES, columns=None):
+    """Yield (data, beta*dV, dV) blocks of at most chunk frames; the last two are None without a weight file"""
+    if isharvest(input):
+        datablocks = _harvestblocks(input, inputcolumns(input, columns), chunk)
+    else:
+        datablocks = _textblocks(input, inputcolumns(input, columns), chunk)
+    if not weight:
+        for data in datablocks:
+            yield data, None, None
+        return
+    if isharvest(weight):
+        weightblocks = (np.column_stack((b.sum(axis=1)/(0.001987*T), b.sum(axis=1)))
+                        for b in _harvestblocks(weight, ['boost_potential', 'boost_dihedral'], chunk))
+    else:
+        weightblocks = _textblocks(weight, [0,2], chunk)
+    for data, w in itertools.zip_longest(datablocks, weightblocks):
+        if data is None or w is None or len(data) != len(w):
+            raise ValueError("%s and %s have different numbers of frames" % (input, weight))
+        yield data, w[:,0], w[:,1]
+
+def iterlabels(input, by, chunk=CHUNK_FRAMES):
+    """Yield the bootstrap block label of every frame of a harvest file, in the blocks iterframes yields"""
+    if not isharvest(input):
+        raise ValueError("blocks by %s need a harvest.npy/harvest.h5 input" % by)
+    for block in _harvestblocks(input, ['n_iter', 'seg_id'], chunk):
+        block = block.astype(np.int64)
+        yield block[:,0] if by == "iteration" else (block[:,0] << 32) | block[:,1]
+
+def weightparse(rows, args):
+    if args.job == "weighthist":
+        data=np.loadtxt(args.weight)
+        weights=data[:,0]
+        dV = np.zeros(rows)
+    elif args.job == "amd_time" or args.job == "amd_dV" or args.job == "amdweight" or args.job == "amdweight_MC" or args.job == "amdweight_CE" :
+        if args.T:
+            T=float(args.T)
+        else :
+            T = 300
+        beta_dV, dV = loaddV(args.weight, T)
+        weights = np.exp(beta_dV)
+    elif args.job == "noweight" or args.job == "histo":
+        weights = np.zeros(rows)
+        weights = weights + 1
+        dV = np.zeros(rows)
+    else:
+        raise ValueError("ERROR JOBTYPE "+ args.job+ " NOT RECOGNIZED")
+    return weights,dV
+
+def histo(data,hist_min,binsX,discX,binsY,discY=None):
+    hist2, newedgesX, newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=None)
+    return hist2,newedgesX,newedgesY
+
+def assignbins(dim, disc):
+    minimum=float(dim[0])
+    maximum=float(dim[1])
+    bins =np.arange(minimum,(maximum+disc),disc)
+    return bins
+
+## Default grid: whole multiples of disc with one empty bin below the data
+def defaultbins(values, disc):
+    max_data = disc * (int(np.amax(values)/disc) + 1)
+    min_data = disc * (int(np.amin(values)/disc) - 1)
+    return assignbins([min_data,max_data], disc)
+
+## Flattened bin index of every frame exactly as np.histogram2d bins it; -1 outside the grid
+def histindex(data,binsX,binsY):
+    nbinsX = len(binsX)-1
+    nbinsY = len(binsY)-1
+    jx = np.searchsorted(binsX, data[:,0], side='right')
+    jy = np.searchsorted(binsY, data[:,1], side='right')
+    ## the last edge is closed, as in np.histogram2d
+    jx[data[:,0] == binsX[-1]] -= 1
+    jy[data[:,1] == binsY[-1]] -= 1
+    inside = (jx >= 1) & (jx <= nbinsX) & (jy >= 1) & (jy <= nbinsY)
+    return np.where(inside, (jx-1)*nbinsY+(jy-1), -1)
+
+## Flattened (C order) bin index of every frame exactly as np.histogramdd bins it; -1 outside the grid
+def histindexdd(data,bins):
+    flat = np.zeros(len(data), dtype=np.int64)
+    inside = np.ones(len(data), dtype=bool)
+    for axis, edges in enumerate(bins):
+        j = np.searchsorted(edges, data[:,axis], side='right')
+        j[data[:,axis] == edges[-1]] -= 1    ## the last edge is closed
+        inside &= (j >= 1) & (j < len(edges))
+        flat = flat*(len(edges)-1) + (j-1)
+    return np.where(inside, flat, -1)
+
+## assignframes for any number of dimensions: int() truncation of (x-edge0)/disc along every axis
+def assignframesdd(data,bins,discs):
+    flat = np.zeros(len(data), dtype=np.int64)
+    inside = np.ones(len(data), dtype=bool)
+    for axis, (edges, disc) in enumerate(zip(bins, discs)):
+        j = ((data[:,axis]-edges[0])/disc).astype(np.int64)
+        inside &= (j >= 0) & (j < len(edges)-1)
+        flat = flat*(len(edges)-1) + j
+    return np.where(inside, flat, -1)
+
+## PMF grids keep the floating dtype of their input (float32 or float64); anything else becomes float64
+def floattype(a):
+    return a.dtype if np.issubdtype(a.dtype, np.floating) else np.dtype(np.float64)
+
+def normalize2D(pmf,cb_max):
+    pmf=pmf-np.min(pmf)  ## zero value to lowest energy state
+    #set infinity free energy values to is cb_max
+    pmf[np.isinf(pmf)]=cb_max
+    return pmf
+
+## prephist of a histogram given as log(hist), without ever exponentiating the bin sums
+def preplog(loghist,T,cb_max):
+    hist2=(0.001987*T)*np.logaddexp(loghist,float(np.log(0.000000000000000001)))
+    hist2=np.max(hist2)-hist2  ## zero value to lowest energy state
+    hist2[np.isinf(hist2)]=cb_max
+    return hist2
+
+def prephist(hist2,T,cb_max):
+    hist2=np.asarray(hist2, dtype=floattype(np.asarray(hist2)))
+    hist2=np.add(hist2,0.000000000000000001)  ###so that distrib
+    hist2=(0.001987*T)*np.log(hist2) ####Convert to free energy in Kcal/mol
+    hist2=np.max(hist2)-hist2  ## zero value to lowest energy state
+    #set infinity free energy values to is cb_max
+    hist2[np.isinf(hist2)]=cb_max
+    return hist2
+
+## Flattened bin index jx*nbinsY+jy of every frame (same truncation as int()); -1 outside the grid
+def assignframes(data,binsX,discX,binsY,discY,nbinsX,nbinsY):
+    jx = ((data[:,0]-binsX[0])/discX).astype(np.int64)
+    jy = ((data[:,1]-binsY[0])/discY).astype(np.int64)
+    inside = (jx >= 0) & (jx < nbinsX) & (jy >= 0) & (jy < nbinsY)
+    binf = np.where(inside, jx*nbinsY+jy, -1)
+    return binf
+
+## Per-bin count and sums of dV, dV^2 and dV^3 in one pass each with np.bincount
+def binmoments(binf,dV,nbins):
+    inside = binf >= 0
+    b = binf[inside]
+    v = np.asarray(dV, dtype=np.float64)[inside]
+    v2 = v*v
+    nA = np.bincount(b, minlength=nbins)
+    s1 = np.bincount(b, weights=v, minlength=nbins)
+    s2 = np.bincount(b, weights=v2, minlength=nbins)
+    s3 = np.bincount(b, weights=v2*v, minlength=nbins)
+    return nA,s1,s2,s3
+
+## Per-bin average, standard deviation and average of dV^2, dV^3 for bins holding >= hist_min frames
+def dVstats(nA,s1,s2,s3,hist_min):
+    sel = (nA >= hist_min) & (nA > 0)
+    n = np.where(sel, nA, 1)
+    dV_avg = np.where(sel, s1/n, 0.0)
+    dV_avg2 = np.where(sel, s2/n, 0.0)
+    dV_avg3 = np.where(sel, s3/n, 0.0)
+    dV_std = np.sqrt(np.maximum(dV_avg2-dV_avg**2, 0.0))
+    return sel,dV_avg,dV_std,dV_avg2,dV_avg3
+
+## c1, c2, c3 cumulant expansion terms (in units of kT) from the per-bin dV moments
+def cumulants(nA,s1,s2,s3,hist_min,beta):
+    sel,dV_avg,dV_std,dV_avg2,dV_avg3 = dVstats(nA,s1,s2,s3,hist_min)
+    c1 = beta*dV_avg
+    c2 = 0.5*beta**2*dV_std**2
+    c3 = np.where(sel, (1.0/6.0)*beta**3*(dV_avg3-3.0*dV_avg2*dV_avg+2.0*dV_avg**3), 0.0)
+    return c1,c2,c3
+
+def reweight_CE(data,hist_min,binsX,discX,binsY,discY,dV,T,fit):
+    hist2, newedgesX, newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=None)
+
+    beta = 1.0/(0.001987*T)
+    nbinsX = len(hist2[:,0])
+    nbinsY = len(hist2[0,:])
+
+    binf = assignframes(data,binsX,discX,binsY,discY,nbinsX,nbinsY)
+    nA,s1,s2,s3 = binmoments(binf,dV,nbinsX*nbinsY)
+    c1,c2,c3 = cumulants(nA,s1,s2,s3,hist_min,beta)
+    return hist2,newedgesX,newedgesY,c1.reshape(nbinsX,nbinsY),c2.reshape(nbinsX,nbinsY),c3.reshape(nbinsX,nbinsY)
+
+## binfX, binfY, dV_avg, dV_std, dV_anharm and the ragged per-bin dV (offsets, values) from a precomputed frame assignment
+def dVdetail(binf,dV,nA,s1,s2,s3,hist_min,nbinsX,nbinsY):
+    binfX = np.where(binf >= 0, binf // nbinsY, 0).astype(float) # assigned bin of each frame
+    binfY = np.where(binf >= 0, binf % nbinsY, 0).astype(float) # assigned bin of each frame
+    sel,dV_avg,dV_std,_dV_avg2,_dV_avg3 = dVstats(nA,s1,s2,s3,hist_min)
+
+    ## group the dV of each bin contiguously: frames sorted by bin, bin j at offsets[j]:offsets[j+1]
+    inside = binf >= 0
+    order = np.argsort(binf[inside], kind='stable')
+    dV_sorted = np.asarray(dV)[inside][order]
+    offsets = np.concatenate(([0], np.cumsum(nA)))
+
+    dV_anharm = np.full(nbinsX*nbinsY, 100.0)
+    for j in np.flatnonzero(sel):
+        dV_anharm[j] = anharm(dV_sorted[offsets[j]:offsets[j+1]])
+    return binfX,binfY,dV_avg.reshape(nbinsX,nbinsY),dV_std.reshape(nbinsX,nbinsY),dV_anharm.reshape(nbinsX,nbinsY),(offsets,dV_sorted)
+
+## Nested dV_mat[jx][jy] lists of the original reweight_dV (an empty list, then the dV of the bin) from the ragged form
+def raggedlists(ragged,nbinsX,nbinsY):
+    offsets, values = ragged
+    return [[[[]] + values[offsets[jx*nbinsY+jy]:offsets[jx*nbinsY+jy+1]].tolist() for jy in range(nbinsY)] for jx in range(nbinsX)]
+
+def reweight_dV(data,hist_min,binsX,binsY,discX,discY,dV,T):
+    hist2, newedgesX, newedgesY = np.histogram2d(data[:,0], data[:,1], bins = (binsX, binsY), weights=None)
+
+    nbinsX = len(hist2[:,0])
+    nbinsY = len(hist2[0,:])
+
+    binf = assignframes(data,binsX,discX,binsY,discY,nbinsX,nbinsY)
+    nA,s1,s2,s3 = binmoments(binf,dV,nbinsX*nbinsY)
+    binfX,binfY,dV_avg,dV_std,dV_anharm,dV_ragged = dVdetail(binf,dV,nA,s1,s2,s3,hist_min,nbinsX,nbinsY)
+    return hist2,newedgesX,newedgesY,binfX,binfY,dV_avg,dV_std,dV_anharm,raggedlists(dV_ragged,nbinsX,nbinsY)
+
+## log of the per-bin sum of exp(x), shifted by the per-bin maximum; -inf for empty bins
+def binlogsumexp(b,x,nbins):
+    m = np.full(nbins, -np.inf)
+    np.maximum.at(m, b, x)
+    s = np.bincount(b, weights=np.exp(x-m[b]), minlength=nbins)
+    with np.errstate(divide='ignore'):
+        return m+np.log(s)
+
+## Maclaurin series of exp(beta*dV) truncated after the given order, by Horner's scheme in place on one buffer:
+## 1 + x(1 + x/2(1 + x/3(... (1 + x/order))))
+def mcweights(beta_dV,order):
+    x = np.asarray(beta_dV, dtype=np.float64)
+    MCweight = np.ones_like(x)
+    for k in range(order, 0, -1):
+        MCweight *= x
+        MCweight /= k
+        MCweight += 1.0
+    return MCweight
+
+## Maclaurin weights of several truncation orders from one pass: the term x^k/k! is updated in place and
+## the running sum is copied out at every requested order. Returns {order: weights}.
+def mcseries(beta_dV,orders):
+    orders = sorted(set(int(o) for o in orders))
+    if len(orders) == 1:
+        return {orders[0]: mcweights(beta_dV,orders[0])}
+    x = np.asarray(beta_dV, dtype=np.float64)
+    term = np.ones_like(x)
+    MCweight = np.ones_like(x)
+    series = {}
+    for k in range(0, orders[-1]+1):
+        if k > 0:
+            term *= x
+            term /= k
+            MCweight += term
+        if k in orders:
+            series[k] = MCweight.copy()
+    return series
+
+##  Convert histogram to free energy in Kcal/mol; bins below hist_min are left at 0
+def hist2pmf2D(hist,hist_min,T):
+        hist = np.asarray(hist)
+        pmf = np.zeros(hist.shape, dtype=floattype(hist))
+        sel = hist >= hist_min
+        pmf[sel] = -(0.001987*T)*np.log(hist[sel])
+##        pmf=pmf-pmf.min()  ## zero value to lowest energy state
+        return pmf
+
+## Format of a float column: shortest round-trip repr (as str() of the original writers), 9 digits for float32
+def floatfmt(a):
+    return '%.9g' if np.asarray(a).dtype == np.float32 else '%r'
+
+## X and Y left bin edge of every grid cell, in the jx-major order of the xvg files
+def gridcolumns(binsX,binsY,nbinsX,nbinsY):
+    return np.repeat(np.asarray(binsX)[:nbinsX], nbinsY), np.tile(np.asarray(binsY)[:nbinsY], nbinsX)
+
+## Write equal-length columns as ' \t'-separated rows, formatting a block of rows per write() call
+def writecolumns(fpmf,columns,fmts,end='\n',chunk=1 << 16):
+    rowfmt = ' \t'.join(fmts) + end
+    table = np.column_stack([np.ravel(c) for c in columns])
+    for start in range(0, len(table), chunk):
+        block = table[start:start+chunk]
+        fpmf.write((rowfmt*len(block)) % tuple(block.ravel().tolist()))
+
+def output_pmf2D(pmffile,hist,binsX,binsY):
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#RC1\tRC2\tPMF(kcal/mol)\n\n@    xaxis  label \"RC1\"\n@    yaxis  label \"RC2\"\n@TYPE xy\n')
+            x, y = gridcolumns(binsX,binsY,*hist.shape)
+            writecolumns(fpmf,(x,y,hist),('%r','%r',floatfmt(hist)))
+        return fpmf
+
+## Any number of dimensions: the left bin edge along every axis (C order, last axis fastest) and the value
+def output_pmfND(pmffile,hist,bins):
+        names = ['RC%d' % (axis+1) for axis in range(len(bins))]
+        edges = np.meshgrid(*[np.asarray(b)[:n] for b, n in zip(bins, hist.shape)], indexing='ij')
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#'+'\t'.join(names)+'\tPMF(kcal/mol)\n\n@    xaxis  label \"RC1\"\n@    yaxis  label \"%s\"\n@TYPE xy\n'
+                       % (names[1] if len(names) > 1 else 'PMF(kcal/mol)'))
+            writecolumns(fpmf,list(edges)+[hist],('%r',)*len(bins)+(floatfmt(hist),))
+        return fpmf
+
+## Rows of the occupied bins only (cells: flattened indices jx*nbinsY+jy, see SparseReweighter), in output_pmf2D order
+def output_pmf2D_sparse(pmffile,values,cells,binsX,binsY):
+        jx, jy = np.divmod(np.asarray(cells), len(binsY)-1)
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#RC1\tRC2\tPMF(kcal/mol)\n\n@    xaxis  label \"RC1\"\n@    yaxis  label \"RC2\"\n@TYPE xy\n')
+            writecolumns(fpmf,(np.asarray(binsX)[jx],np.asarray(binsY)[jy],values),('%r','%r',floatfmt(values)))
+        return fpmf
+
+def output_pmf2D_err(pmffile,hist,mean,std,binsX,binsY):
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#RC1\tRC2\tPMF(kcal/mol)\tmean\tstd\n\n@    xaxis  label \"RC1\"\n@    yaxis  label \"RC2\"\n@TYPE xydy\n')
+            x, y = gridcolumns(binsX,binsY,*hist.shape)
+            writecolumns(fpmf,(x,y,hist,mean,std),('%r','%r')+(floatfmt(hist),)*3)
+        return fpmf
+
+def output_dV(pmffile,dV):
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#dV \tp(dV) \n\n@    xaxis  label \"dV\"\n@    yaxis  label \"p(dV)\"\n@TYPE xy\n')
+            hist_dV, bin_dV = np.histogram(dV, bins=50)
+            writecolumns(fpmf,(bin_dV[:-1],hist_dV),('%r','%d'),end=' \n')
+        return fpmf
+
+def output_dV_anharm2D(pmffile,binsX,binsY,dV_anharm):
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#RC \tdV_anharm \tError\n\n@    xaxis  label \"RC\"\n@    yaxis  label \"dV_anmarm\"\n@TYPE xy\n')
+            x, y = gridcolumns(binsX,binsY,*dV_anharm.shape)
+            writecolumns(fpmf,(x,y,dV_anharm),('%r','%r',floatfmt(dV_anharm)))
+        return fpmf
+
+def output_dV_stat2D(pmffile,binsX,binsY,dV_avg,dV_std,dV_anharm):
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#RC \tdV_avg(kcal/mol) \tError\n\n@    xaxis  label \"RC\"\n@    yaxis  label \"dV(kcal/mol)\"\n@TYPE xydy\n')
+            x, y = gridcolumns(binsX,binsY,*dV_anharm.shape)
+            writecolumns(fpmf,(x,y,dV_avg,dV_std,dV_anharm),('%r',)*5)
+        return fpmf
+
+## dV_mat is the ragged (offsets, values) pair of Reweighter.amd_dV or the nested lists of reweight_dV.
+## With a sidecar .npz path the samples go there (binsX, binsY, offsets, values) and the xvg only has the per-bin columns.
+def output_dV_mat2D(pmffile,binsX,binsY,hist,dV_avg,dV_std,dV_anharm,dV_mat,sidecar=None):
+        nbinsX, nbinsY = hist.shape
+        with open(pmffile, 'w') as fpmf:
+            fpmf.write('#RC \tNf \tdV_avg \tdV_std \tdV_ij \n\n@    xaxis  label \"RC\"\n@    yaxis  label \"dV(kcal/mol)\"\n@TYPE xy\n')
+            x, y = gridcolumns(binsX,binsY,nbinsX,nbinsY)
+            if sidecar:
+                offsets, values = dV_mat if isinstance(dV_mat, tuple) else raggedarrays(dV_mat)
+                np.savez(sidecar, binsX=binsX, binsY=binsY, offsets=offsets, values=values)
+                writecolumns(fpmf,(x,y,hist,dV_avg,dV_std,dV_anharm),('%r',)*6)
+                return fpmf
+            ## the per-bin lists are printed as Python lists of the first Nf samples, one bin per line
+            lines = []
+            for j, nf_j in enumerate(np.asarray(hist, dtype=int).ravel().tolist()):
+                jx, jy = divmod(j, nbinsY)
+                if isinstance(dV_mat, tuple):
+                    offsets, values = dV_mat
+                    samples = values[offsets[j]:min(offsets[j]+nf_j, offsets[j+1])].tolist()
+                else:
+                    samples = dV_mat[jx][jy][1:nf_j+1]
+                lines.append('%r \t%r \t%r \t%r \t%r \t%r \t%s\n' % (float(x[j]), float(y[j]), float(hist[jx,jy]), float(dV_avg[jx,jy]),
+                                                                float(dV_std[jx,jy]), float(dV_anharm[jx,jy]), samples))
+                if len(lines) >= 4096:
+                    fpmf.write(''.join(lines))
+                    lines = []
+            fpmf.write(''.join(lines))
+        return fpmf
+
+## (offsets, values) from the nested dV_mat lists of reweight_dV
+def raggedarrays(dV_mat):
+    samples = [cell[1:] for row in dV_mat for cell in row]
+    offsets = np.concatenate(([0], np.cumsum([len(cell) for cell in samples])))
+    values = np.array([v for cell in samples for v in cell], dtype=np.float64)
+    return offsets, values
+
+def anharm(data):
+    var=np.var(data)
+    hist, edges=np.histogram(data, 50, density=True)
+    hist=np.add(hist,0.000000000000000001)  ###so that distrib
+    dx=edges[1]-edges[0]
+    S1=-1*trapezoid(np.multiply(hist, np.log(hist)),dx=dx)
+    S2=0.5*np.log(2.00*np.pi*np.exp(1.0)*var+0.000000000000000001)
+    alpha=S2-S1
+    if np.isinf(alpha):
+       alpha = 100
+    return alpha
+
+class BinIndexCache(object):
+    """Per-frame flattened bin indices persisted as int32 .npy files, keyed by a content hash of the data and grid
+
+    A later run on the same data and bins (another reweight-2d.sh call with a
+    different cutoff or Emax, or a sweep) memory-maps the stored index instead
+    of binning the frames again. Every new input adds its indices, so the
+    directory is pruned to max_bytes, least recently used first.
+    """
+
+    def __init__(self,directory,max_bytes=BINCACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(data,binsX,binsY,discX,discY,chunk=CHUNK_FRAMES):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((data.shape, discX, discY)).encode())
+        h.update(np.ascontiguousarray(binsX, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(binsY, dtype=np.float64).tobytes())
+        ## the data may be a strided view into a memory-mapped harvest file, so it is hashed a block at a time
+        for start in range(0, len(data), chunk):
+            h.update(np.ascontiguousarray(data[start:start+chunk], dtype=np.float64).data)
+        return h.hexdigest()
+
+    def get(self,key,name,compute):
+        """The stored <key>-<name>.npy index, or compute(), store and return it"""
+        path = os.path.join(self.directory, key+'-'+name+'.npy')
+        if os.path.exists(path):
+            try:
+                os.utime(path)    ## the mtime orders the pruning
+                return np.load(path, mmap_mode='r')
+            except FileNotFoundError:
+                pass    ## pruned by a concurrent run
+        index = compute()
+        if index.size and index.max() >= np.iinfo(np.int32).max:
+            return index
+        index = index.astype(np.int32)
+        tmp = path+'.tmp%d' % os.getpid()
+        with open(tmp, 'wb') as f:
+            np.save(f, index)
+        os.replace(tmp, path)
+        self.prune(keep=key)
+        return index
+
+    def prune(self,keep=None):
+        """Remove the least recently used indices until the directory fits in max_bytes; never those of keep"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path, entry.name))
+        total = sum(e[1] for e in entries)
+        for _mtime, size, path, fname in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and fname.startswith(keep+'-'):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class Reweighter(object):
+    """Reweighting of one 2D data set; frames are binned once and every job reuses the binning"""
+
+    def __init__(self,data,logw=None,dV=None,binsX=None,binsY=None,discX=6,discY=6,T=300,hist_min=10,cb_max=8,dtype=np.float64,bincache=None):
+        self.data = data
+        self.logw = logw    ## first column of weights.dat: beta*dV for GaMD, the raw weight for weighthist
+        self.dV = dV
+        self.discX = float(discX)
+        self.discY = float(discY)
+        self.binsX = defaultbins(data[:,0], self.discX) if binsX is None else np.asarray(binsX, dtype=float)
+        self.binsY = defaultbins(data[:,1], self.discY) if binsY is None else np.asarray(binsY, dtype=float)
+        self.nbinsX = len(self.binsX)-1
+        self.nbinsY = len(self.binsY)-1
+        self.T = float(T)
+        self.beta = 1.0/(0.001987*self.T)
+        self.hist_min = hist_min
+        self.cb_max = cb_max
+        self.dtype = np.dtype(dtype)    ## of the histograms and PMF grids; float32 halves their memory
+        self._hbin = None
+        self._binf = None
+        self._moments = None
+        self._mc = {}
+        self.bincache = BinIndexCache(bincache) if isinstance(bincache, str) else bincache
+        self._cachekey = None
+
+    @classmethod
+    def fromfiles(cls,input,weight=None,Xdim=None,Ydim=None,discX=6,discY=6,T=300,**kwargs):
+        """Load the 2D input (and the weights/dV file if given) and set up the grid"""
+        data = loadfiletoarray(input)
+        logw, dV = loaddV(weight, float(T)) if weight else (None, None)
+        binsX = assignbins(Xdim, float(discX)) if Xdim else None
+        binsY = assignbins(Ydim, float(discY)) if Ydim else None
+        return cls(data,logw,dV,binsX,binsY,discX,discY,T,**kwargs)
+
+    def _needdV(self):
+        if self.dV is None:
+            raise ValueError("this job needs a weight file with dV")
+
+    def edges(self):
+        """Bin edges along every axis"""
+        return [self.binsX, self.binsY]
+
+    @property
+    def hbin(self):
+        """np.histogram2d bin of each frame (flattened, -1 outside the grid)"""
+        if self._hbin is None:
+            hbin = self._index('hist', lambda: histindex(self.data,self.binsX,self.binsY))
+            self._hinside = np.flatnonzero(hbin >= 0)
+            self._hbin = hbin[self._hinside]
+        return self._hbin
+
+    @property
+    def binf(self):
+        """Frame assignment used for the per-bin dV statistics (flattened, -1 outside the grid)"""
+        if self._binf is None:
+            self._binf = self._index('frames', lambda: assignframes(self.data,self.binsX,self.discX,self.binsY,self.discY,self.nbinsX,self.nbinsY))
+        return self._binf
+
+    def _index(self,name,compute):
+        ## a per-frame bin index, through the on-disk cache when one is configured
+        if self.bincache is None:
+            return compute()
+        if self._cachekey is None:
+            self._cachekey = BinIndexCache.key(self.data,self.binsX,self.binsY,self.discX,self.discY)
+        return self.bincache.get(self._cachekey,name,compute)
+
+    @property
+    def moments(self):
+        """Per-bin count, sum dV, sum dV^2 and sum dV^3"""
+        if self._moments is None:
+            self._needdV()
+            self._moments = binmoments(self.binf,self.dV,self.nbinsX*self.nbinsY)
+        return self._moments
+
+    def histogram(self,weights=None):
+        """Same result as np.histogram2d(..., bins=(binsX, binsY), weights=weights)"""
+        hbin = self.hbin
+        if weights is not None:
+            weights = np.asarray(weights)[self._hinside]
+        return self._grid(np.bincount(hbin, weights=weights, minlength=self.nbinsX*self.nbinsY))
+
+    def maclaurin(self,orders):
+        """Maclaurin weights of each order; the orders not cached yet are computed together in one pass"""
+        missing = [order for order in orders if order not in self._mc]
+        if missing:
+            self._needdV()
+            self._mc.update(mcseries(np.multiply(self.dV,self.beta),missing))
+        return [self._mc[order] for order in orders]
+
+    def weights(self,job,order=10):
+        """Per-frame weights a job histograms with"""
+        if job in ("noweight", "histo"):
+            return np.ones(len(self.data))
+        self._needdV()
+        if job == "weighthist":
+            return self.logw
+        if job == "amdweight_MC":
+            return self.maclaurin([order])[0]
+        return np.exp(self.logw)
+
+    def dVaverage(self):
+        """Average and standard deviation of dV over all frames"""
+        self._needdV()
+        return np.average(self.dV), np.std(self.dV)
+
+    def noweight(self):
+        return prephist(self.histogram(),self.T,self.cb_max)
+
+    def weighthist(self):
+        return prephist(self.histogram(self.weights("weighthist")),self.T,self.cb_max)
+
+    def amdweight(self):
+        return prephist(self.histogram(self.weights("amdweight")),self.T,self.cb_max)
+
+    def amdweight_MC(self,order=10):
+        return prephist(self.histogram(self.weights("amdweight_MC",order)),self.T,self.cb_max)
+
+    def histo(self):
+        return self.histogram()
+
+    def _grid(self,flat):
+        ## a per-bin array in the shape and dtype of the results
+        return np.asarray(flat).reshape(self.nbinsX,self.nbinsY).astype(self.dtype)
+
+    def _pmf0(self):
+        ## uncorrected PMF of the cumulant expansion, 0 in bins below hist_min
+        return hist2pmf2D(self.histogram(),self.hist_min,self.T)
+
+    def _normalize(self,pmf):
+        return normalize2D(pmf,self.cb_max)
+
+    def amdweight_CE(self,normalize=True):
+        """PMFs corrected to first, second and third order of the cumulant expansion"""
+        pmf = self._pmf0()
+        c1,c2,c3 = cumulants(*self.moments,self.hist_min,self.beta)
+        c1 = self._grid(-np.multiply(1.0/self.beta,c1))
+        c2 = self._grid(-np.multiply(1.0/self.beta,c2))
+        c3 = self._grid(-np.multiply(1.0/self.beta,c3))
+        pmfs = (np.add(pmf,c1), np.add(np.add(pmf,c1),c2), np.add(np.add(np.add(pmf,c1),c2),c3))
+        if normalize:
+            pmfs = tuple(self._normalize(p) for p in pmfs)
+        return pmfs
+
+    def amd_dV(self):
+        """hist, binfX, binfY, dV_avg, dV_std, dV_anharm and the dV of each bin as a ragged (offsets, values) pair"""
+        binfX,binfY,dV_avg,dV_std,dV_anharm,dV_ragged = dVdetail(self.binf,self.dV,*self.moments,self.hist_min,self.nbinsX,self.nbinsY)
+        return self.histogram(),binfX,binfY,dV_avg,dV_std,dV_anharm,dV_ragged
+
+    def run(self,job,order=10):
+        """Result arrays of one job by name, e.g. {'c1': ..., 'c2': ..., 'c3': ...} for amdweight_CE"""
+        if job == "amdweight_CE":
+            return dict(zip(("c1", "c2", "c3"), self.amdweight_CE()))
+        if job == "amd_dV":
+            hist2,_binfX,_binfY,dV_avg,dV_std,dV_anharm,_dV_ragged = self.amd_dV()
+            return {"hist": hist2, "dV_avg": dV_avg, "dV_std": dV_std, "dV_anharm": dV_anharm}
+        if job == "histo":
+            return {"hist": self.histo()}
+        if job == "amdweight_MC":
+            return {"pmf": self.amdweight_MC(order)}
+        if job in ("noweight", "amd_time"):
+            return {"pmf": self.noweight()}
+        if job in ("amdweight", "weighthist"):
+            return {"pmf": getattr(self, job)()}
+        raise ValueError("ERROR JOBTYPE "+ job+ " NOT RECOGNIZED")
+
+
+
+## Region of every occupied bin (cells: sorted flattened indices jx*nbinsY+jy, counts: frames per cell). While a
+## region holds fewer than hist_min frames its bins move to the enclosing 2x2 block one level up, so underpopulated
+## bins merge with their underpopulated neighbours; at most levels times
+def mergebins(cells,counts,nbinsX,nbinsY,hist_min,levels):
+    jx, jy = np.divmod(np.asarray(cells, dtype=np.int64), nbinsY)
+    level = np.zeros(len(jx), dtype=np.int64)
+    region = np.arange(len(jx))
+    for L in range(1, int(levels)+1):
+        small = np.bincount(region, weights=counts)[region] < hist_min
+        if not small.any():
+            break
+        level[small] = L
+        _keys, region = np.unique((level*nbinsX + (jx >> level))*nbinsY + (jy >> level), return_inverse=True)
+        region = region.ravel()
+    return region
+
+class SparseReweighter(Reweighter):
+    """Reweighter keeping only the occupied bins, optionally merging underpopulated ones
+
+    Results are 1-D arrays over self.cells, the sorted flattened indices jx*nbinsY+jy of the bins holding frames;
+    every other bin is empty. Inside the occupied bins the values equal those of Reweighter. With adaptive=L the
+    bins below hist_min are merged with their neighbours (mergebins) and every bin of a merged region gets the
+    region's PMF, from its frames per bin. amd_dV needs the dense grid.
+    """
+
+    def __init__(self,*args,adaptive=0,**kwargs):
+        super(SparseReweighter,self).__init__(*args,**kwargs)
+        self.adaptive = int(adaptive)
+        self._layouts = {}
+        self._regionmoments = {}
+
+    def _key(self):
+        return self.hist_min if self.adaptive else None    ## merged regions depend on the cutoff
+
+    @property
+    def layout(self):
+        """cells, region of every cell, bins per region and the region of every histogram / dV-statistics frame"""
+        key = self._key()
+        if key not in self._layouts:
+            hbin = self.hbin
+            fbin = self.binf[self.binf >= 0]
+            cells = np.unique(np.concatenate((hbin, fbin)))
+            hcell = np.searchsorted(cells, hbin)
+            region = np.arange(len(cells))
+            if self.adaptive:
+                counts = np.bincount(hcell, minlength=len(cells))
+                region = mergebins(cells,counts,self.nbinsX,self.nbinsY,self.hist_min,self.adaptive)
+            self._layouts[key] = (cells, region, np.bincount(region), region[hcell], region[np.searchsorted(cells, fbin)])
+        return self._layouts[key]
+
+    @property
+    def cells(self):
+        return self.layout[0]
+
+    @property
+    def moments(self):
+        """Per-bin count, sum dV, sum dV^2 and sum dV^3 of the region of every cell"""
+        _cells, region, size, _hregion, fregion = self.layout
+        key = self._key()
+        if key not in self._regionmoments:
+            self._needdV()
+            dV = np.asarray(self.dV)[self.binf >= 0]
+            self._regionmoments[key] = tuple(m[region] for m in binmoments(fregion,dV,len(size)))
+        return self._regionmoments[key]
+
+    def _grid(self,flat):
+        return np.asarray(flat).astype(self.dtype)
+
+    def histogram(self,weights=None):
+        """Frames (or weights) per bin of every cell; a merged region's sum is spread evenly over its bins"""
+        _cells, region, size, hregion, _fregion = self.layout
+        if weights is not None:
+            weights = np.asarray(weights)[self._hinside]
+        hist = np.bincount(hregion, weights=weights, minlength=len(size))
+        if self.adaptive:
+            hist = np.divide(hist, size)
+        return self._grid(hist[region])
+
+    def histo(self):
+        """Frames in every cell, never merged"""
+        return self._grid(np.bincount(np.searchsorted(self.cells, self.hbin), minlength=len(self.cells)))
+
+    def _pmf0(self):
+        ## a merged region passes the cutoff on its total frames, its PMF is that of the frames per bin
+        _cells, region, size, hregion, _fregion = self.layout
+        count = np.bincount(hregion, minlength=len(size)).astype(self.dtype)
+        pmf = hist2pmf2D(count,self.hist_min,self.T)
+        if self.adaptive:
+            pmf = np.where(count >= self.hist_min, pmf+(0.001987*self.T)*np.log(size), pmf)
+        return self._grid(pmf[region])
+
+    def _normalize(self,pmf):
+        ## the empty bins of the dense grid hold 0 and take part in its minimum
+        if len(self.cells) < self.nbinsX*self.nbinsY:
+            return normalize2D(np.append(pmf, pmf.dtype.type(0)),self.cb_max)[:-1]
+        return normalize2D(pmf,self.cb_max)
+
+    def amd_dV(self):
+        raise ValueError("amd_dV needs the dense grid; run it with Reweighter")
+
+    def dense(self,values,fill=0):
+        """nbinsX x nbinsY grid of a per-cell result, fill in the empty bins"""
+        values = np.asarray(values)
+        grid = np.full(self.nbinsX*self.nbinsY, fill, dtype=values.dtype)
+        grid[self.cells] = values
+        return grid.reshape(self.nbinsX,self.nbinsY)
+
+
+def streamgrid(input,Xdim=None,Ydim=None,discX=6,discY=6,chunk=CHUNK_FRAMES):
+    """binsX, binsY of a streamed input; without Xdim/Ydim a first pass finds the range for defaultbins"""
+    return tuple(streambins(input,[Xdim,Ydim],[discX,discY],chunk))
+
+def streambins(input,dims,discs,chunk=CHUNK_FRAMES,columns=None):
+    """Bin edges of every column of a streamed input; a first pass finds the range of the columns without dims"""
+    discs = [float(d) for d in discs]
+    if not all(dims):
+        lo = np.full(len(discs), np.inf)
+        hi = np.full(len(discs), -np.inf)
+        for data, _logw, _dV in iterframes(input, None, chunk=chunk, columns=columns):
+            lo = np.minimum(lo, data.min(axis=0))
+            hi = np.maximum(hi, data.max(axis=0))
+    return [assignbins(dim, disc) if dim else defaultbins(np.array([lo[axis],hi[axis]]), disc)
+            for axis, (dim, disc) in enumerate(zip(dims, discs))]
+
+
+class BinAccumulator(object):
+    """Per-bin sums of a 2D data set fed block by block, so the frames never have to fit in memory
+
+    Holds the histogram, the sums of the raw and Maclaurin weights, log(sum exp(beta*dV))
+    and the dV moments of every bin; PMFs match Reweighter for every job in STREAM_JOBS.
+
+        acc = BinAccumulator.fromfiles('input.dat', 'weights.dat', Xdim=[0, 10], Ydim=[0, 10], discX=0.1, discY=0.1)
+        pmf_c1, pmf_c2, pmf_c3 = acc.amdweight_CE()
+    """
+
+    SUMS = ('count', 'wsum', 'mcsum', 'logsum', 'nA', 's1', 's2', 's3', 'dVsums')
+
+    def __init__(self,binsX,binsY,discX=6,discY=6,T=300,hist_min=10,cb_max=8,order=10,dtype=np.float64):
+        self.binsX = np.asarray(binsX, dtype=float)
+        self.binsY = np.asarray(binsY, dtype=float)
+        self.discX = float(discX)
+        self.discY = float(discY)
+        self.nbinsX = len(self.binsX)-1
+        self.nbinsY = len(self.binsY)-1
+        self._setup((self.nbinsX,self.nbinsY),T,hist_min,cb_max,order,dtype)
+
+    def _setup(self,shape,T,hist_min,cb_max,order,dtype):
+        ## settings and empty sums for a grid of the given shape
+        self.shape = tuple(shape)
+        self.T = float(T)
+        self.beta = 1.0/(0.001987*self.T)
+        self.hist_min = hist_min
+        self.cb_max = cb_max
+        self.order = order
+        self.orders = tuple(sorted(set(np.atleast_1d(order).tolist())))    ## Maclaurin orders accumulated
+        self.dtype = np.dtype(dtype)    ## of the PMF grids; the sums are always float64
+        nbins = int(np.prod(self.shape))
+        self.frames = 0
+        self.count = np.zeros(nbins)                 ## np.histogram2d binning
+        self.wsum = np.zeros(nbins)                  ## raw weights (weighthist)
+        self.mcsum = np.zeros((len(self.orders),nbins))  ## Maclaurin weights of each order (amdweight_MC)
+        self.logsum = np.full(nbins, -np.inf)        ## log sum exp(beta*dV) (amdweight)
+        self.nA = np.zeros(nbins, dtype=np.int64)    ## assignframes binning (amdweight_CE)
+        self.s1 = np.zeros(nbins)
+        self.s2 = np.zeros(nbins)
+        self.s3 = np.zeros(nbins)
+        self.dVsums = np.zeros(3)                    ## frames with dV, sum dV, sum dV^2
+        self.weighted = False
+
+    @classmethod
+    def fromfiles(cls,input,weight=None,Xdim=None,Ydim=None,discX=6,discY=6,T=300,chunk=CHUNK_FRAMES,**kwargs):
+        """Stream the input (and weight file) through a new accumulator; without Xdim/Ydim a first pass finds the range"""
+        binsX, binsY = streamgrid(input,Xdim,Ydim,discX,discY,chunk)
+        acc = cls(binsX,binsY,discX,discY,T,**kwargs)
+        for data, logw, dV in iterframes(input, weight, T, chunk):
+            acc.add(data, logw, dV)
+        return acc
+
+    def empty(self):
+        """New accumulator with the same grid and settings and no frames"""
+        return BinAccumulator(self.binsX,self.binsY,self.discX,self.discY,self.T,self.hist_min,self.cb_max,self.order,self.dtype)
+
+    def edges(self):
+        """Bin edges along every axis"""
+        return [self.binsX, self.binsY]
+
+    def _hbin(self,data):
+        return histindex(data,self.binsX,self.binsY)
+
+    def _binf(self,data):
+        return assignframes(data,self.binsX,self.discX,self.binsY,self.discY,self.nbinsX,self.nbinsY)
+
+    def blocksums(self,data,logw,dV,local,nblocks):
+        """Sums of one batch of frames split by block (local index 0..nblocks-1), as {name: (nblocks, ...) array}"""
+        nbins = int(np.prod(self.shape))
+        size = nblocks*nbins
+        sums = {'frames': np.bincount(local, minlength=nblocks)}
+        hbin = self._hbin(data)
+        hinside = hbin >= 0
+        key = local[hinside]*nbins+hbin[hinside]
+        sums['count'] = np.bincount(key, minlength=size).reshape(nblocks,nbins).astype(float)
+        if dV is None:
+            return sums
+        logw = np.asarray(logw, dtype=np.float64)
+        dV = np.asarray(dV, dtype=np.float64)
+        sums['wsum'] = np.bincount(key, weights=logw[hinside], minlength=size).reshape(nblocks,nbins)
+        mc = mcseries(np.multiply(dV,self.beta),self.orders)
+        sums['mcsum'] = np.stack([np.bincount(key, weights=mc[order][hinside], minlength=size).reshape(nblocks,nbins)
+                                  for order in self.orders], axis=1)
+        sums['logsum'] = binlogsumexp(key,logw[hinside],size).reshape(nblocks,nbins)
+        binf = self._binf(data)
+        binf = np.where(binf >= 0, local*nbins+binf, -1)
+        for name, moment in zip(('nA', 's1', 's2', 's3'), binmoments(binf,dV,size)):
+            sums[name] = moment.reshape(nblocks,nbins)
+        sums['dVsums'] = np.column_stack((sums['frames'], np.bincount(local, weights=dV, minlength=nblocks),
+                                          np.bincount(local, weights=dV*dV, minlength=nblocks)))
+        return sums
+
+    def blockentries(self,data,logw,dV,local):
+        """Sums of one batch of frames over its occupied (block, bin) pairs only, blocks by local index 0..n-1
+
+        'hist' and 'assign' are (block, bin, {name: values}) for the np.histogram2d binning (count, wsum,
+        mcsum, logsum) and the assignframes binning (nA, s1, s2, s3); 'frames' and 'dVsums' are per block.
+        """
+        nbins = int(np.prod(self.shape))
+        local = np.asarray(local, dtype=np.int64)
+        nblocks = int(local.max())+1 if len(local) else 0
+        entries = {'frames': np.bincount(local, minlength=nblocks)}
+        hbin = self._hbin(data)
+        hinside = hbin >= 0
+        keys, inv = np.unique(local[hinside]*nbins+hbin[hinside], return_inverse=True)
+        inv = inv.ravel()
+        hist = {'count': np.bincount(inv, minlength=len(keys)).astype(float)}
+        entries['hist'] = (keys//nbins, keys%nbins, hist)
+        if dV is None:
+            return entries
+        logw = np.asarray(logw, dtype=np.float64)
+        dV = np.asarray(dV, dtype=np.float64)
+        hist['wsum'] = np.bincount(inv, weights=logw[hinside], minlength=len(keys))
+        mc = mcseries(np.multiply(dV[hinside],self.beta),self.orders)
+        hist['mcsum'] = np.stack([np.bincount(inv, weights=mc[order], minlength=len(keys)) for order in self.orders])
+        hist['logsum'] = binlogsumexp(inv,logw[hinside],len(keys))
+        binf = self._binf(data)
+        finside = binf >= 0
+        fkeys, finv = np.unique(local[finside]*nbins+binf[finside], return_inverse=True)
+        nA, s1, s2, s3 = binmoments(finv.ravel(),dV[finside],len(fkeys))
+        entries['assign'] = (fkeys//nbins, fkeys%nbins, {'nA': nA, 's1': s1, 's2': s2, 's3': s3})
+        entries['dVsums'] = np.column_stack((entries['frames'], np.bincount(local, weights=dV, minlength=nblocks),
+                                             np.bincount(local, weights=dV*dV, minlength=nblocks)))
+        return entries
+
+    def add(self,data,logw=None,dV=None):
+        """Accumulate one block of frames"""
+        sums = self.blocksums(data,logw,dV,np.zeros(len(data), dtype=np.intp),1)
+        self.weighted = self.weighted or dV is not None
+        for name, value in sums.items():
+            if name == 'logsum':
+                self.logsum = np.logaddexp(self.logsum, value[0])
+            else:
+                setattr(self, name, getattr(self, name)+value[0])
+
+    def __iadd__(self,other):
+        """Merge the sums of another accumulator on the same grid"""
+        mine, theirs = self.edges(), other.edges()
+        if len(mine) != len(theirs) or not all(np.array_equal(a, b) for a, b in zip(mine, theirs)):
+            raise ValueError("accumulators are on different grids")
+        self.frames += other.frames
+        self.logsum = np.logaddexp(self.logsum, other.logsum)
+        for name in self.SUMS:
+            if name != 'logsum':
+                setattr(self, name, getattr(self, name)+getattr(other, name))
+        self.weighted = self.weighted or other.weighted
+        return self
+
+    def save(self,path,**extra):
+        """Write grid, settings and sums to an .npz file, replacing it atomically; extra arrays are stored alongside"""
+        arrays = self._gridarrays()
+        arrays.update({'orders': np.array(self.orders), 'dtype': np.array(self.dtype.str),
+                       'frames': np.array(self.frames), 'weighted': np.array(self.weighted)})
+        for name in self.SUMS:
+            arrays[name] = getattr(self, name)
+        for name, value in extra.items():
+            arrays['extra_'+name] = value
+        tmp = '%s.tmp%d' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    def _gridarrays(self):
+        return {'binsX': self.binsX, 'binsY': self.binsY,
+                'settings': np.array([self.discX, self.discY, self.T, self.hist_min, self.cb_max])}
+
+    @classmethod
+    def _fromarrays(cls,f):
+        ## an empty accumulator on the grid and settings of a saved one
+        discX, discY, T, hist_min, cb_max = f['settings'].tolist()
+        return cls(f['binsX'],f['binsY'],discX,discY,T,int(hist_min),cb_max,f['orders'].tolist(),str(f['dtype']))
+
+    @classmethod
+    def load(cls,path):
+        """(accumulator, {name: extra array}) as written by save()"""
+        with np.load(path) as f:
+            acc = cls._fromarrays(f)
+            acc.frames = int(f['frames'])
+            acc.weighted = bool(f['weighted'])
+            for name in cls.SUMS:
+                setattr(acc, name, f[name])
+            extra = {name[len('extra_'):]: f[name] for name in f.files if name.startswith('extra_')}
+        return acc, extra
+
+    def _needdV(self):
+        if not self.weighted:
+            raise ValueError("this job needs a weight file with dV")
+
+    def _grid(self,flat):
+        return flat.reshape(self.shape).astype(self.dtype)
+
+    def dVaverage(self):
+        """Average and standard deviation of dV over all frames"""
+        self._needdV()
+        n, s1, s2 = self.dVsums
+        return s1/n, np.sqrt(max(s2/n-(s1/n)**2, 0.0))
+
+    def noweight(self):
+        return prephist(self._grid(self.count),self.T,self.cb_max)
+
+    def weighthist(self):
+        self._needdV()
+        return prephist(self._grid(self.wsum),self.T,self.cb_max)
+
+    def amdweight(self):
+        self._needdV()
+        return preplog(self._grid(self.logsum),self.T,self.cb_max)
+
+    def amdweight_MC(self,order=None):
+        self._needdV()
+        order = self.orders[0] if order is None else order
+        if order not in self.orders:
+            raise ValueError("Maclaurin order %d was not accumulated (have %s)" % (order, list(self.orders)))
+        return prephist(self._grid(self.mcsum[self.orders.index(order)]),self.T,self.cb_max)
+
+    def histo(self):
+        return self._grid(self.count)
+
+    def amdweight_CE(self,normalize=True):
+        """PMFs corrected to first, second and third order of the cumulant expansion"""
+        self._needdV()
+        pmf = hist2pmf2D(self._grid(self.count),self.hist_min,self.T)
+        c1,c2,c3 = cumulants(self.nA,self.s1,self.s2,self.s3,self.hist_min,self.beta)
+        c1 = -self._grid(c1)/self.beta
+        c2 = -self._grid(c2)/self.beta
+        c3 = -self._grid(c3)/self.beta
+        pmfs = (pmf+c1, pmf+c1+c2, pmf+c1+c2+c3)
+        if normalize:
+            pmfs = tuple(normalize2D(p,self.cb_max) for p in pmfs)
+        return pmfs
+
+    def run(self,job,order=None):
+        """Result arrays of one job by name, as Reweighter.run"""
+        if job == "amdweight_CE":
+            return dict(zip(("c1", "c2", "c3"), self.amdweight_CE()))
+        if job == "histo":
+            return {"hist": self.histo()}
+        if job == "amdweight_MC":
+            return {"pmf": self.amdweight_MC(order)}
+        if job in ("noweight", "amd_time"):
+            return {"pmf": self.noweight()}
+        if job in ("amdweight", "weighthist"):
+            return {"pmf": getattr(self, job)()}
+        raise ValueError("ERROR JOBTYPE "+ job+ " CANNOT BE STREAMED")
+
+
+class BinAccumulatorND(BinAccumulator):
+    """BinAccumulator over any number of progress coordinates, binned like np.histogramdd
+
+    bins and discs hold one entry per column of the data and the PMFs have shape self.shape.
+    marginal() sums the per-bin accumulators over the other axes, giving the lower dimensional
+    surfaces without reading or binning the frames again.
+
+        acc = BinAccumulatorND.fromfiles('harvest.npy', 'harvest.npy', columns=['rmsd', 'rg', 'rg_max'], discs=[0.1]*3)
+        pmf_3d = acc.noweight()
+        pmf_rmsd = acc.marginal([0]).noweight()
+    """
+
+    def __init__(self,bins,discs=6,T=300,hist_min=10,cb_max=8,order=10,dtype=np.float64):
+        self.bins = [np.asarray(b, dtype=float) for b in bins]
+        self.discs = [float(d) for d in np.broadcast_to(discs, len(self.bins))]
+        self._setup([len(b)-1 for b in self.bins],T,hist_min,cb_max,order,dtype)
+
+    @classmethod
+    def fromfiles(cls,input,weight=None,columns=None,dims=None,discs=6,T=300,chunk=CHUNK_FRAMES,**kwargs):
+        """Stream the given columns of the input (and the weight file) through a new accumulator"""
+        ndim = len(inputcolumns(input, columns))
+        discs = [float(d) for d in np.broadcast_to(discs, ndim)]
+        bins = streambins(input,dims or [None]*ndim,discs,chunk,columns)
+        acc = cls(bins,discs,T,**kwargs)
+        for data, logw, dV in iterframes(input, weight, T, chunk, columns):
+            acc.add(data, logw, dV)
+        return acc
+
+    def empty(self):
+        return BinAccumulatorND(self.bins,self.discs,self.T,self.hist_min,self.cb_max,self.order,self.dtype)
+
+    def edges(self):
+        return self.bins
+
+    def _hbin(self,data):
+        return histindexdd(data,self.bins)
+
+    def _binf(self,data):
+        return assignframesdd(data,self.bins,self.discs)
+
+    def _gridarrays(self):
+        arrays = {'bins%d' % axis: edges for axis, edges in enumerate(self.bins)}
+        arrays.update({'discs': np.array(self.discs), 'settings': np.array([self.T, self.hist_min, self.cb_max])})
+        return arrays
+
+    @classmethod
+    def _fromarrays(cls,f):
+        T, hist_min, cb_max = f['settings'].tolist()
+        bins = [f['bins%d' % axis] for axis in range(len(f['discs']))]
+        return cls(bins,f['discs'],T,int(hist_min),cb_max,f['orders'].tolist(),str(f['dtype']))
+
+    def marginal(self,axes):
+        """Accumulator of the given axes, with every sum reduced over the others"""
+        axes = sorted(set(int(a) for a in axes))
+        drop = tuple(a for a in range(len(self.shape)) if a not in axes)
+        acc = BinAccumulatorND([self.bins[a] for a in axes],[self.discs[a] for a in axes],
+                               self.T,self.hist_min,self.cb_max,self.order,self.dtype)
+        for name in ('count', 'wsum', 'nA', 's1', 's2', 's3'):
+            setattr(acc, name, getattr(self, name).reshape(self.shape).sum(axis=drop).ravel())
+        acc.mcsum = self.mcsum.reshape((-1,)+self.shape).sum(axis=tuple(a+1 for a in drop)).reshape(len(self.orders),-1)
+        acc.logsum = np.logaddexp.reduce(self.logsum.reshape(self.shape), axis=drop).ravel()
+        acc.frames = self.frames
+        acc.dVsums = self.dVsums.copy()
+        acc.weighted = self.weighted
+        return acc
+
+
+class BlockAccumulator(object):
+    """BinAccumulator sums kept per block (WE iteration, segment or run of frames) for block-bootstrap error bars
+
+    Frames are binned once while the blocks are accumulated. Only the occupied
+    (block, bin) pairs are stored, so memory grows with the frames rather than
+    with blocks x bins; every bootstrap replicate is a weighted sum of them.
+
+        blocks = BlockAccumulator.fromfiles('harvest.npy', 'harvest.npy', by='iteration', discX=0.1, discY=0.1)
+        errors = blocks.bootstrap('amdweight_CE', 200)    # {'c1': (mean, std), ...}
+    """
+
+    def __init__(self,binsX,binsY,discX=6,discY=6,T=300,hist_min=10,cb_max=8,order=10,dtype=np.float64,max_blocks=MAX_BLOCKS):
+        self.grid = BinAccumulator(binsX,binsY,discX,discY,T,hist_min,cb_max,order,dtype)
+        self.binsX = self.grid.binsX
+        self.binsY = self.grid.binsY
+        self.max_blocks = max_blocks
+        self.labels = []
+        self._rowof = {}
+        ## per-batch (block rows, ...) pieces, concatenated on first use by _merged()
+        self._parts = {'frames': [], 'dVsums': [], 'hist': [], 'assign': []}
+        self.weighted = False
+
+    @classmethod
+    def fromfiles(cls,input,weight=None,by="iteration",Xdim=None,Ydim=None,discX=6,discY=6,T=300,chunk=CHUNK_FRAMES,**kwargs):
+        """Stream the input into per-block sums; by is 'iteration', 'segment' or a number of consecutive frames"""
+        binsX, binsY = streamgrid(input,Xdim,Ydim,discX,discY,chunk)
+        blocks = cls(binsX,binsY,discX,discY,T,**kwargs)
+        labels = iterlabels(input, by, chunk) if by in BLOCK_KINDS else None
+        start = 0
+        for data, logw, dV in iterframes(input, weight, T, chunk):
+            if labels is None:
+                label = (start+np.arange(len(data)))//int(by)
+            else:
+                label = next(labels)
+            start += len(data)
+            blocks.add(data, logw, dV, label)
+        return blocks
+
+    def _rows(self,labels):
+        """Rows of the given block labels, appending rows for new ones"""
+        for label in labels.tolist():
+            if label not in self._rowof:
+                if len(self.labels) >= self.max_blocks:
+                    raise ValueError("more than %d bootstrap blocks; use larger blocks (by iteration or more frames each)"
+                                     % self.max_blocks)
+                self._rowof[label] = len(self.labels)
+                self.labels.append(label)
+        return np.array([self._rowof[label] for label in labels.tolist()], dtype=np.intp)
+
+    def add(self,data,logw,dV,labels):
+        """Accumulate a batch of frames with the block label of each frame"""
+        ulabels, local = np.unique(np.asarray(labels), return_inverse=True)
+        entries = self.grid.blockentries(data,logw,dV,local.ravel())
+        rows = self._rows(ulabels)
+        self.weighted = self.weighted or dV is not None
+        self._parts['frames'].append((rows, entries['frames']))
+        if 'dVsums' in entries:
+            self._parts['dVsums'].append((rows, entries['dVsums']))
+        for kind in ('hist', 'assign'):
+            if kind in entries:
+                block, bins, sums = entries[kind]
+                self._parts[kind].append((rows[block], bins, sums))
+
+    def _merged(self,kind):
+        ## one (rows, values) or (rows, bins, {name: values}) piece of the given kind, or None
+        parts = self._parts[kind]
+        if not parts:
+            return None
+        if len(parts) > 1:
+            merged = tuple(np.concatenate([p[i] for p in parts]) for i in range(len(parts[0])-1))
+            last = [p[-1] for p in parts]
+            if isinstance(last[0], dict):
+                merged += ({name: np.concatenate([d[name] for d in last], axis=-1) for name in last[0]},)
+            else:
+                merged += (np.concatenate(last),)
+            self._parts[kind] = [merged]
+        return self._parts[kind][0]
+
+    def combine(self,k,scaled=None):
+        """BinAccumulator holding the sums of block b taken k[b] times"""
+        k = np.asarray(k)
+        acc = self.grid.empty()
+        nbins = int(np.prod(self.grid.shape))
+        rows, frames = self._merged('frames')
+        acc.frames = np.dot(k[rows], frames)
+        if self._merged('dVsums') is not None:
+            rows, dVsums = self._merged('dVsums')
+            acc.dVsums = np.dot(k[rows], dVsums)
+        rows, bins, sums = self._merged('hist')
+        w = k[rows]
+        for name, value in sums.items():
+            if name == 'mcsum':
+                acc.mcsum = np.stack([np.bincount(bins, weights=w*v, minlength=nbins) for v in value])
+            elif name != 'logsum':
+                setattr(acc, name, np.bincount(bins, weights=w*value, minlength=nbins))
+        if 'logsum' in sums:
+            shift, scaled = scaled if scaled is not None else self._scaled()
+            with np.errstate(divide='ignore'):
+                acc.logsum = shift+np.log(np.bincount(bins, weights=w*scaled, minlength=nbins))
+        if self._merged('assign') is not None:
+            rows, bins, sums = self._merged('assign')
+            w = k[rows]
+            acc.nA = np.rint(np.bincount(bins, weights=w*sums['nA'], minlength=nbins)).astype(np.int64)
+            for name in ('s1', 's2', 's3'):
+                setattr(acc, name, np.bincount(bins, weights=w*sums[name], minlength=nbins))
+        acc.weighted = self.weighted
+        return acc
+
+    def _scaled(self):
+        ## exp(logsum) of every (block, bin) pair shifted by the per-bin maximum, so the weighted sums of combine()
+        ## cannot overflow
+        _rows, bins, sums = self._merged('hist')
+        shift = np.full(int(np.prod(self.grid.shape)), -np.inf)
+        np.maximum.at(shift, bins, sums['logsum'])
+        shift = np.where(np.isfinite(shift), shift, 0.0)
+        return shift, np.exp(sums['logsum']-shift[bins])
+
+    def total(self):
+        """BinAccumulator of all frames"""
+        return self.combine(np.ones(len(self.labels), dtype=np.int64))
+
+    def bootstrap(self,job,nrep=100,seed=None,workers=None,order=None):
+        """Per-bin mean and standard deviation of a job's results over nrep block-bootstrap replicates"""
+        nblocks = len(self.labels)
+        if nblocks < 2:
+            raise ValueError("bootstrap needs at least two blocks, got %d" % nblocks)
+        picks = np.random.default_rng(seed).integers(nblocks, size=(nrep, nblocks))
+        scaled = self._scaled() if self.weighted else None
+
+        def replicate(r):
+            return self.combine(np.bincount(picks[r], minlength=nblocks), scaled).run(job, order)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(replicate, range(nrep)))
+        errors = {}
+        for term in results[0]:
+            stack = np.array([result[term] for result in results])
+            errors[term] = (stack.mean(axis=0), stack.std(axis=0, ddof=1))
+        return errors
@@ -9,52 +9,49 @@ T=$6
 
 echo "Usage: reweight-2d.sh $Emax $cutoff $binx $biny $data $T"
 
+# All jobs run in one PyReweighting-2D.py process that loads and bins $data once;
+# the bin indices are kept in .bincache so later calls with other cutoffs/Emax skip the binning
 if [ -f weights.dat ]; then
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amdweight_CE -weight weights.dat" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amdweight_CE -weight weights.dat | tee -a reweight_variable.log
-mv -v pmf-c1-$data.xvg pmf-2D-c1-$data-reweight-discx$binx-discy$biny.xvg
-mv -v pmf-c2-$data.xvg pmf-2D-c2-$data-reweight-discx$binx-discy$biny.xvg
-mv -v pmf-c3-$data.xvg pmf-2D-c3-$data-reweight-discx$binx-discy$biny.xvg
-mv -v 2D_Free_energy_surface.png pmf-2D-$data-reweight-CE2-discx$binx-discy$biny.png
-
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amdweight_MC -order 10 -weight weights.dat" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amdweight_MC -order 10 -weight weights.dat | tee -a reweight_variable.log
-mv -v pmf-$data.xvg pmf-2D-$data-reweight-MC-order10-discx$binx-discy$biny.xvg
-mv -v 2D_Free_energy_surface.png pmf-2D-$data-reweight-MC-order10-discx$binx-discy$biny.png
-
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job noweight" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job noweight | tee -a reweight_variable.log
-mv -v pmf-$data.xvg pmf-2D-$data-noweight-discx$binx-discy$biny.xvg
-mv -v 2D_Free_energy_surface.png pmf-2D-$data-noweight-discx$binx-discy$biny.png
-
+JOBS="amdweight_CE amdweight_MC noweight"
+WEIGHT="-weight weights.dat"
 else
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job noweight" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job noweight | tee -a reweight_variable.log
-mv -v pmf-$data.xvg pmf-2D-$data-noweight-discx$binx-discy$biny.xvg
-mv -v 2D_Free_energy_surface.png pmf-2D-$data-noweight-discx$binx-discy$biny.png
+JOBS="noweight"
+WEIGHT=""
 fi # weights.dat
 
 if [ -f exist.dat ]; then
 echo "exist.dat"
+JOBS="$JOBS amdweight histo amd_dV"
+WEIGHT="-weight weights.dat"
+fi
+
+# With more than one job every output file is prefixed by "<job>-"
+NJOBS=$(echo $JOBS | wc -w)
+pre() { [ $NJOBS -gt 1 ] && echo "$1-"; }
+
+echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -order 10 -plot -bincache .bincache -job $JOBS $WEIGHT" | tee -a reweight_variable.log
+python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -order 10 -plot -bincache .bincache -job $JOBS $WEIGHT | tee -a reweight_variable.log
 
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amdweight -weight weights.dat" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amdweight -weight weights.dat | tee -a reweight_variable.log
-mv -v pmf-$data.xvg pmf-2D-$data-reweight-exp-discx$binx-discy$biny.xvg
-mv -v 2D_Free_energy_surface.png pmf-2D-$data-reweight-exp-discx$binx-discy$biny.png
+if [ -f weights.dat ]; then
+mv -v $(pre amdweight_CE)pmf-c1-$data.xvg pmf-2D-c1-$data-reweight-discx$binx-discy$biny.xvg
+mv -v $(pre amdweight_CE)pmf-c2-$data.xvg pmf-2D-c2-$data-reweight-discx$binx-discy$biny.xvg
+mv -v $(pre amdweight_CE)pmf-c3-$data.xvg pmf-2D-c3-$data-reweight-discx$binx-discy$biny.xvg
+mv -v $(pre amdweight_CE)2D_Free_energy_surface.png pmf-2D-$data-reweight-CE2-discx$binx-discy$biny.png
+
+mv -v $(pre amdweight_MC)pmf-$data.xvg pmf-2D-$data-reweight-MC-order10-discx$binx-discy$biny.xvg
+mv -v $(pre amdweight_MC)2D_Free_energy_surface.png pmf-2D-$data-reweight-MC-order10-discx$binx-discy$biny.png
+fi # weights.dat
 
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job histo -weight weights.dat" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job histo -weight weights.dat | tee -a reweight_variable.log
-mv -v histo-$data.xvg histo-2D-$data-discx$binx-discy$biny.dat.xvg
+mv -v $(pre noweight)pmf-$data.xvg pmf-2D-$data-noweight-discx$binx-discy$biny.xvg
+mv -v $(pre noweight)2D_Free_energy_surface.png pmf-2D-$data-noweight-discx$binx-discy$biny.png
 
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job noweight" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job noweight | tee -a reweight_variable.log
-mv -v pmf-$data.xvg pmf-2D-$data-noweight-discx$binx-discy$biny.xvg
-mv -v 2D_Free_energy_surface.png pmf-2D-$data-noweight-discx$binx-discy$biny.png
+if [ -f exist.dat ]; then
+mv -v $(pre amdweight)pmf-$data.xvg pmf-2D-$data-reweight-exp-discx$binx-discy$biny.xvg
+mv -v $(pre amdweight)2D_Free_energy_surface.png pmf-2D-$data-reweight-exp-discx$binx-discy$biny.png
 
-echo "python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amd_dV -weight weights.dat" | tee -a reweight_variable.log
-python $dir_codes/PyReweighting-2D.py -input $data -T $T -Emax $Emax -cutoff $cutoff -discX $binx -discY $biny -job amd_dV -weight weights.dat | tee -a reweight_variable.log
-mv -v dV-stat-2D-$data.xvg dV-stat-2D-$data-reweight-discx$binx-discy$biny.xvg
-mv -v dV-anharm-2D-$data.xvg dV-anharm-2D-$data-reweight-discx$binx-discy$biny.xvg
+mv -v $(pre histo)histo-$data.xvg histo-2D-$data-discx$binx-discy$biny.dat.xvg
 
+mv -v $(pre amd_dV)dV-stat-2D-$data.xvg dV-stat-2D-$data-reweight-discx$binx-discy$biny.xvg
+mv -v $(pre amd_dV)dV-anharm-2D-$data.xvg dV-anharm-2D-$data-reweight-discx$binx-discy$biny.xvg
 fi
 
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Benchmark the vectorized reweighting engine against the original per-frame loops
+
+Generates a synthetic RMSD/Rg + dV data set, runs reweight_CE and reweight_dV
+from pyreweighting.py and the loop implementations they replaced, checks
+that both produce the same per-bin statistics and prints the timings. With
+-chunk the data is also fed block by block through a BinAccumulator and its
+PMFs are compared with the in-memory Reweighter. The histogram-to-PMF
+transforms (prephist, normalize2D, hist2pmf2D) are checked against their
+original per-bin loops in float64 and float32, and the bulk output_pmf2D
+writer against the original line-by-line writer. The Horner-scheme
+Maclaurin weights (one order, and orders 5/10/15 in one pass) are compared
+with the original term-by-term loop. The SparseReweighter results must
+equal the dense grids in every occupied bin. BinAccumulatorND must match
+BinAccumulator on the same two columns, and its 1D marginals the surfaces
+binned directly from one column. The script exits non-zero if any float64
+result or written file differs.
+
+    python reweight_benchmark.py -frames 1000000 -disc 0.1 -chunk 100000
+"""
+
+import math
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+
+import pyreweighting as rw
+
+
+def synthetic_data(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    data = np.column_stack([np.abs(rng.normal(3.0, 1.5, frames)), np.abs(rng.normal(7.0, 1.0, frames))])
+    dV = rng.gamma(2.0, 2.0, frames)
+    return data, dV
+
+
+def loop_moments(data, hist_min, binsX, discX, binsY, discY, dV, anharm=None):
+    """The per-frame assignment and per-bin averaging loop of the original reweight_CE/reweight_dV"""
+    nbinsX = len(binsX) - 1
+    nbinsY = len(binsY) - 1
+    nA = np.zeros((nbinsX, nbinsY), dtype=int)
+    dV_avg = np.zeros((nbinsX, nbinsY))
+    dV_avg2 = np.zeros((nbinsX, nbinsY))
+    dV_avg3 = np.zeros((nbinsX, nbinsY))
+    dV_std = np.zeros((nbinsX, nbinsY))
+    dV_mat = [[[[] for i in range(1)] for i in range(nbinsY)] for i in range(nbinsX)]
+    for i in range(len(data[:, 0])):
+        jx = int((data[i, 0] - binsX[0]) / discX)
+        jy = int((data[i, 1] - binsY[0]) / discY)
+        if jx < nbinsX and jy < nbinsY:
+            dV_mat[jx][jy].append(dV[i])
+            nA[jx, jy] = nA[jx, jy] + 1
+    for jx in range(nbinsX):
+        for jy in range(nbinsY):
+            if nA[jx, jy] >= hist_min:
+                num = int(nA[jx, jy])
+                atemp = np.asarray(dV_mat[jx][jy][1:num + 1])
+                dV_avg[jx, jy] = np.average(atemp)
+                dV_std[jx, jy] = np.std(atemp)
+                dV_avg2[jx, jy] = np.average(np.power(atemp, 2))
+                dV_avg3[jx, jy] = np.average(np.power(atemp, 3))
+                if anharm is not None:
+                    anharm(atemp)
+    return dV_avg, dV_std, dV_avg2, dV_avg3
+
+
+def loop_reweight_CE(data, hist_min, binsX, discX, binsY, discY, dV, T):
+    beta = 1.0 / (0.001987 * T)
+    dV_avg, dV_std, dV_avg2, dV_avg3 = loop_moments(data, hist_min, binsX, discX, binsY, discY, dV)
+    c1 = beta * dV_avg
+    c2 = 0.5 * beta ** 2 * dV_std ** 2
+    c3 = (1.0 / 6.0) * beta ** 3 * (dV_avg3 - 3.0 * dV_avg2 * dV_avg + 2.0 * dV_avg ** 3)
+    return c1, c2, c3
+
+
+def loop_normalize2D(pmf, cb_max):
+    pmf = pmf - np.min(pmf)
+    temphist = pmf
+    for jy in range(len(temphist[0, :])):
+        for jx in range(len(temphist[:, 0])):
+            if np.isinf(temphist[jx, jy]):
+                temphist[jx, jy] = cb_max
+    return temphist
+
+
+def loop_prephist(hist2, T, cb_max):
+    hist2 = np.add(hist2, 0.000000000000000001)
+    hist2 = (0.001987 * T) * np.log(hist2)
+    hist2 = np.max(hist2) - hist2
+    temphist2 = hist2
+    for jy in range(len(temphist2[0, :])):
+        for jx in range(len(temphist2[:, 0])):
+            if np.isinf(temphist2[jx, jy]):
+                temphist2[jx, jy] = cb_max
+    return temphist2
+
+
+def loop_hist2pmf2D(hist, hist_min, T):
+    pmf = np.zeros((len(hist[:, 0]), len(hist[0, :])))
+    for jx in range(len(hist[:, 0])):
+        for jy in range(len(hist[0, :])):
+            if hist[jx, jy] >= hist_min:
+                pmf[jx, jy] = -(0.001987 * T) * np.log(hist[jx, jy])
+    return pmf
+
+
+def check_transforms(hist, args):
+    """Vectorized histogram-to-PMF transforms against the original loops; returns False on a float64 mismatch"""
+    pmf = rw.hist2pmf2D(hist, args.cutoff, args.T)
+    pmf[hist == 0] = np.inf    ## exercise the infinity replacement of normalize2D
+    cases = [('prephist', rw.prephist, loop_prephist, (hist, args.T, 8.0)),
+             ('normalize2D', rw.normalize2D, loop_normalize2D, (pmf, 8.0)),
+             ('hist2pmf2D', rw.hist2pmf2D, loop_hist2pmf2D, (hist, args.cutoff, args.T))]
+    ok = True
+    rows = []
+    for name, new, old, fargs in cases:
+        t_new, result = timed(new, *fargs)
+        t_old, expected = timed(old, *fargs)
+        same = np.array_equal(result, expected)
+        ok = ok and same
+        single = new(*(a.astype(np.float32) if isinstance(a, np.ndarray) else a for a in fargs))
+        print('%-11s float64 %s, float32 max |diff| = %.1e (%s)'
+              % (name, 'identical' if same else 'DIFFERENT', np.max(np.abs(single - expected)), single.dtype))
+        rows.append((name, t_new, t_old))
+    return ok, rows
+
+
+def loop_output_pmf2D(pmffile, hist, binsX, binsY):
+    fpmf = open(pmffile, 'w')
+    fpmf.write('#RC1\tRC2\tPMF(kcal/mol)\n\n@    xaxis  label \"RC1\"\n@    yaxis  label \"RC2\"\n@TYPE xy\n')
+    for jx in range(len(hist[:, 0])):
+        for jy in range(len(hist[0, :])):
+            fpmf.write(str(binsX[jx]) + ' \t' + str(binsY[jy]) + ' \t' + str(hist[jx, jy]) + '\n')
+    fpmf.close()
+
+
+def check_writers(pmf, binsX, binsY):
+    """Bulk output_pmf2D against the original per-line writer; returns False if the files differ"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        new, old = os.path.join(tmpdir, 'new.xvg'), os.path.join(tmpdir, 'old.xvg')
+        t_new, _ = timed(rw.output_pmf2D, new, pmf, binsX, binsY)
+        t_old, _ = timed(loop_output_pmf2D, old, pmf, binsX, binsY)
+        with open(new) as fnew, open(old) as fold:
+            same = fnew.read() == fold.read()
+    print('%-11s %s' % ('output_pmf2D', 'identical file' if same else 'DIFFERENT FILE'))
+    return same, [('output_pmf2D', t_new, t_old)]
+
+
+def loop_mcweights(beta_dV, order):
+    """The original amdweight_MC loop: one np.power and factorial per order"""
+    MCweight = np.zeros(len(beta_dV))
+    for x in range(0, order + 1):
+        MCweight = np.add(MCweight, (np.divide(np.power(beta_dV, x), float(math.factorial(x)))))
+    return MCweight
+
+
+def check_maclaurin(beta_dV, orders=(5, 10, 15)):
+    """Horner and one-pass multi-order Maclaurin weights against the original loop"""
+    t_old, expected = timed(lambda: {order: loop_mcweights(beta_dV, order) for order in orders})
+    t_new, horner = timed(lambda: {order: rw.mcweights(beta_dV, order) for order in orders})
+    t_series, series = timed(rw.mcseries, beta_dV, orders)
+    ok = True
+    for order in orders:
+        rel = max(np.max(np.abs(result[order] / expected[order] - 1)) for result in (horner, series))
+        ok = ok and rel < 1e-12
+        print('%-11s order %2d max relative diff = %.1e' % ('mcweights', order, rel))
+    return ok, [('mcweights', t_new, t_old), ('mcseries', t_series, t_old)]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def compare_stream(data, dV, binsX, binsY, args):
+    """PMFs of a block-fed BinAccumulator against the in-memory Reweighter; returns False beyond 1e-9"""
+    beta_dV = dV / (0.001987 * args.T)
+    kwargs = dict(discX=args.disc, discY=args.disc, T=args.T, hist_min=args.cutoff)
+    memory = rw.Reweighter(data, beta_dV, dV, binsX, binsY, **kwargs)
+    acc = rw.BinAccumulator(binsX, binsY, **kwargs)
+    start = time.perf_counter()
+    for i in range(0, len(data), args.chunk):
+        acc.add(data[i:i + args.chunk], beta_dV[i:i + args.chunk], dV[i:i + args.chunk])
+    print('streamed %d blocks of %d frames in %.3f s' % (-(-len(data) // args.chunk), args.chunk, time.perf_counter() - start))
+    worst = 0.0
+    for job in ('noweight', 'amdweight', 'amdweight_MC', 'amdweight_CE'):
+        expected = memory.run(job)
+        result = acc.run(job)
+        for term in expected:
+            diff = np.max(np.abs(result[term] - expected[term]))
+            worst = max(worst, diff) if diff == diff else float('nan')
+            print('%-7s max |diff| = %.3e (streamed %s)' % (term, diff, job))
+    ## summation order differs between blocks, so not bit-identical; a NaN difference fails too
+    return worst < 1e-9
+
+
+def check_sparse(data, dV, binsX, binsY, args):
+    """SparseReweighter against the dense Reweighter in the occupied bins, and the size of both outputs"""
+    beta_dV = dV / (0.001987 * args.T)
+    kwargs = dict(discX=args.disc, discY=args.disc, T=args.T, hist_min=args.cutoff)
+    dense = rw.Reweighter(data, beta_dV, dV, binsX, binsY, **kwargs)
+    sparse = rw.SparseReweighter(data, beta_dV, dV, binsX, binsY, **kwargs)
+    t_old, expected = timed(lambda: {job: dense.run(job) for job in ('noweight', 'amdweight', 'amdweight_MC', 'amdweight_CE')})
+    t_new, result = timed(lambda: {job: sparse.run(job) for job in expected})
+    ok = True
+    for job in expected:
+        for term in expected[job]:
+            ok = ok and np.array_equal(expected[job][term].ravel()[sparse.cells], result[job][term])
+    with tempfile.TemporaryDirectory() as tmpdir:
+        new, old = os.path.join(tmpdir, 'sparse.xvg'), os.path.join(tmpdir, 'dense.xvg')
+        rw.output_pmf2D_sparse(new, result['noweight']['pmf'], sparse.cells, binsX, binsY)
+        rw.output_pmf2D(old, expected['noweight']['pmf'], binsX, binsY)
+        sizes = os.path.getsize(new), os.path.getsize(old)
+    print('%-11s %d of %d bins occupied, %s, pmf file %d of %d bytes'
+          % ('sparse', len(sparse.cells), dense.nbinsX * dense.nbinsY, 'identical' if ok else 'DIFFERENT', sizes[0], sizes[1]))
+    return ok, [('sparse jobs', t_new, t_old)]
+
+
+def check_nd(data, dV, binsX, binsY, args):
+    """BinAccumulatorND against the 2D BinAccumulator, and its marginals against direct 1D binning"""
+    beta_dV = dV / (0.001987 * args.T)
+    kwargs = dict(T=args.T, hist_min=args.cutoff)
+    acc = rw.BinAccumulator(binsX, binsY, args.disc, args.disc, **kwargs)
+    t_2d, _ = timed(acc.add, data, beta_dV, dV)
+    nd = rw.BinAccumulatorND([binsX, binsY], args.disc, **kwargs)
+    t_nd, _ = timed(nd.add, data, beta_dV, dV)
+    jobs = ('noweight', 'amdweight', 'amdweight_MC', 'amdweight_CE')
+    ok = all(np.array_equal(acc.run(job)[term], nd.run(job)[term]) for job in jobs for term in acc.run(job))
+    worst = 0.0
+    for axis, bins in enumerate((binsX, binsY)):
+        marginal = nd.marginal([axis])
+        direct = rw.BinAccumulatorND([bins], args.disc, **kwargs)
+        direct.add(data[:, [axis]], beta_dV, dV)
+        for job in jobs:
+            expected = direct.run(job)
+            worst = max([worst] + [np.max(np.abs(marginal.run(job)[term] - expected[term])) for term in expected])
+    ok = ok and worst < 1e-9
+    print('%-11s 2D %s, 1D marginals max |diff| = %.1e' % ('N-D', 'identical' if ok else 'DIFFERENT', worst))
+    return ok, [('BinAccumulatorND', t_nd, t_2d)]
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Compare vectorized and loop-based reweighting")
+    parser.add_argument("-frames", type=int, default=200000, help="number of synthetic frames")
+    parser.add_argument("-disc", type=float, default=0.1, help="bin size in both dimensions")
+    parser.add_argument("-cutoff", type=int, default=10, help="histogram cutoff")
+    parser.add_argument("-T", type=float, default=300.0, help="temperature")
+    parser.add_argument("-noloop", action="store_true", help="time the vectorized engine only")
+    parser.add_argument("-chunk", type=int, default=None, help="also compare a BinAccumulator fed in blocks of this many frames")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    data, dV = synthetic_data(args.frames)
+    binsX = rw.assignbins([0, args.disc * (int(data[:, 0].max() / args.disc) + 1)], args.disc)
+    binsY = rw.assignbins([0, args.disc * (int(data[:, 1].max() / args.disc) + 1)], args.disc)
+    print('%d frames, %d x %d bins' % (args.frames, len(binsX) - 1, len(binsY) - 1))
+
+    t_ce, ce = timed(rw.reweight_CE, data, args.cutoff, binsX, args.disc, binsY, args.disc, dV, args.T, False)
+    t_dv, dv = timed(rw.reweight_dV, data, args.cutoff, binsX, binsY, args.disc, args.disc, dV, args.T)
+    if args.noloop:
+        rows = [('reweight_CE', t_ce, None), ('reweight_dV', t_dv, None)]
+    else:
+        t_loop_ce, loop_ce = timed(loop_reweight_CE, data, args.cutoff, binsX, args.disc, binsY, args.disc, dV, args.T)
+        t_loop_dv, loop = timed(loop_moments, data, args.cutoff, binsX, args.disc, binsY, args.disc, dV, rw.anharm)
+        for name, new, old in zip(('c1', 'c2', 'c3'), ce[3:6], loop_ce):
+            print('%-7s max |diff| = %.3e' % (name, np.max(np.abs(new - old))))
+        for name, new, old in (('dV_avg', dv[5], loop[0]), ('dV_std', dv[6], loop[1])):
+            print('%-7s max |diff| = %.3e' % (name, np.max(np.abs(new - old))))
+        rows = [('reweight_CE', t_ce, t_loop_ce), ('reweight_dV', t_dv, t_loop_dv)]
+
+    streamed = compare_stream(data, dV, binsX, binsY, args) if args.chunk else True
+    hist = np.histogram2d(data[:, 0], data[:, 1], bins=(binsX, binsY))[0]
+    ok, transform_rows = check_transforms(hist, args)
+    written, writer_rows = check_writers(rw.prephist(hist, args.T, 8.0), binsX, binsY)
+    maclaurin, mc_rows = check_maclaurin(dV / (0.001987 * args.T))
+    sparse, sparse_rows = check_sparse(data, dV, binsX, binsY, args)
+    nd, nd_rows = check_nd(data, dV, binsX, binsY, args)
+    ok = ok and written and maclaurin and sparse and nd and streamed
+    rows += transform_rows + writer_rows + mc_rows + sparse_rows + nd_rows
+
+    print('%-12s %12s %12s %9s' % ('job', 'numpy (s)', 'loop (s)', 'speedup'))
+    for name, t_new, t_old in rows:
+        if t_old is None:
+            print('%-12s %12.3f %12s %9s' % (name, t_new, '-', '-'))
+        else:
+            print('%-12s %12.3f %12.3f %8.1fx' % (name, t_new, t_old, t_old / t_new))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
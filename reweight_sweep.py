@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Convergence sweep over reweighting jobs, bin sizes, cutoffs and Emax
+
+The input is parsed once and written to memory-mappable .npy files that a
+pool of worker processes share through the page cache. Every combination
+of (job, discX, discY, cutoff, Emax) is computed by pyreweighting.Reweighter,
+each worker reusing its binning for repeated grids, and all results are
+stored in a single .npz archive with an index table:
+
+    python reweight_sweep.py -input input.dat -weight weights.dat \\
+        -job amdweight_CE amdweight_MC noweight -disc 0.05 0.1 0.2 -cutoff 5 10 -o sweep.npz
+
+    archive = np.load('sweep.npz')
+    for row in archive['index']:
+        pmf = archive['%s_pmf' % row['key']]
+"""
+
+import itertools
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pyreweighting import JOBS, WEIGHTED_JOBS, Reweighter, assignbins, loadfiletoarray, loaddV
+
+INDEX_DTYPE = np.dtype([('key', 'U16'), ('job', 'U16'), ('term', 'U16'), ('discX', 'f8'), ('discY', 'f8'),
+                        ('cutoff', 'i8'), ('Emax', 'f8'), ('seconds', 'f8')])
+
+## per-worker state: the shared arrays and one Reweighter per grid
+_shared = {}
+_reweighters = {}
+
+
+def _init_worker(paths, T, Xdim, Ydim, dtype, bincache):
+    for name, path in paths.items():
+        _shared[name] = np.load(path, mmap_mode='r')
+    _shared['T'] = T
+    _shared['dtype'] = dtype
+    _shared['bincache'] = bincache
+    _shared['Xdim'] = Xdim
+    _shared['Ydim'] = Ydim
+
+
+def _reweighter(discX, discY):
+    key = (discX, discY)
+    if key not in _reweighters:
+        binsX = assignbins(_shared['Xdim'], discX) if _shared['Xdim'] else None
+        binsY = assignbins(_shared['Ydim'], discY) if _shared['Ydim'] else None
+        _reweighters[key] = Reweighter(_shared['data'], _shared.get('logw'), _shared.get('dV'),
+                                       binsX, binsY, discX, discY, _shared['T'], dtype=_shared['dtype'],
+                                       bincache=_shared['bincache'])
+    return _reweighters[key]
+
+
+def run_point(point):
+    """Compute one grid point; returns (point, seconds, binsX, binsY, {term: array})"""
+    job, discX, discY, cutoff, Emax, order = point
+    start = time.perf_counter()
+    rw = _reweighter(discX, discY)
+    rw.hist_min = cutoff
+    rw.cb_max = Emax
+    result = rw.run(job, order)
+    return point, time.perf_counter() - start, rw.binsX, rw.binsY, result
+
+
+def share_input(input, weight, T, tmpdir):
+    """Parse the input once and save the arrays the workers map"""
+    arrays = {'data': np.ascontiguousarray(loadfiletoarray(input), dtype=np.float64)}
+    if weight:
+        logw, dV = loaddV(weight, T)
+        arrays['logw'] = np.ascontiguousarray(logw, dtype=np.float64)
+        arrays['dV'] = np.ascontiguousarray(dV, dtype=np.float64)
+    paths = {}
+    for name, array in arrays.items():
+        paths[name] = os.path.join(tmpdir, name + '.npy')
+        np.save(paths[name], array)
+    return paths
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Run a grid of reweighting jobs over shared input data")
+    parser.add_argument("-input", required=True, help="2D input file (text, or harvest.npy/harvest.h5)")
+    parser.add_argument("-weight", required=False, help="weights.dat or harvest file with the GaMD boosts")
+    parser.add_argument("-job", nargs="+", choices=JOBS, default=["noweight"], help="reweighting jobs")
+    parser.add_argument("-disc", nargs="+", type=float, default=[6.0],
+                        help="bin sizes; used for both dimensions unless -discY is given")
+    parser.add_argument("-discY", nargs="+", type=float, default=None,
+                        help="bin sizes in Y (every combination with -disc is run)")
+    parser.add_argument("-cutoff", nargs="+", type=int, default=[10], help="histogram cutoffs")
+    parser.add_argument("-Emax", nargs="+", type=float, default=[8.0], help="maximum free energies")
+    parser.add_argument("-Xdim", nargs=2, default=None, metavar=("Xmin", "Xmax"))
+    parser.add_argument("-Ydim", nargs=2, default=None, metavar=("Ymin", "Ymax"))
+    parser.add_argument("-T", type=float, default=300.0, help="temperature")
+    parser.add_argument("-order", type=int, default=10, help="order of the Maclaurin series for amdweight_MC")
+    parser.add_argument("-float32", action="store_true", help="compute and store the PMF grids in single precision")
+    parser.add_argument("-bincache", default=None, help="directory caching the per-frame bin indices across runs")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all CPUs)")
+    parser.add_argument("-o", "--output", default="sweep.npz", help="output archive")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    weighted = [job for job in args.job if job in WEIGHTED_JOBS]
+    if weighted and not args.weight:
+        raise SystemExit("ERROR: -weight is required for " + ", ".join(weighted))
+
+    if args.discY:
+        discs = list(itertools.product(args.disc, args.discY))
+    else:
+        discs = [(d, d) for d in args.disc]
+    # Points sharing a grid are adjacent so a worker is likely to reuse its binning
+    points = [(job, dX, dY, cutoff, Emax, args.order)
+              for (dX, dY), job, cutoff, Emax in itertools.product(discs, args.job, args.cutoff, args.Emax)]
+    print('%d grid points: %d jobs x %d grids x %d cutoffs x %d Emax'
+          % (len(points), len(args.job), len(discs), len(args.cutoff), len(args.Emax)))
+
+    start = time.perf_counter()
+    tmpdir = tempfile.mkdtemp(prefix='reweight_sweep_', dir=os.path.dirname(os.path.abspath(args.output)))
+    try:
+        paths = share_input(args.input, args.weight if weighted else None, args.T, tmpdir)
+        t_load = time.perf_counter() - start
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                 initargs=(paths, args.T, args.Xdim, args.Ydim,
+                                           np.float32 if args.float32 else np.float64, args.bincache)) as pool:
+            results = list(pool.map(run_point, points))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    arrays = {}
+    index = []
+    for i, (point, seconds, binsX, binsY, result) in enumerate(results):
+        job, discX, discY, cutoff, Emax, _order = point
+        key = 'r%04d' % i
+        arrays[key + '_binsX'] = binsX
+        arrays[key + '_binsY'] = binsY
+        for term, array in result.items():
+            arrays['%s_%s' % (key, term)] = array
+            index.append((key, job, term, discX, discY, cutoff, Emax, seconds))
+    arrays['index'] = np.array(index, dtype=INDEX_DTYPE)
+    np.savez(args.output, **arrays)
+
+    print('%-14s %8s %8s %7s %6s %10s' % ('job', 'discX', 'discY', 'cutoff', 'Emax', 'time (s)'))
+    for point, seconds, _binsX, _binsY, _result in results:
+        job, discX, discY, cutoff, Emax, _order = point
+        print('%-14s %8g %8g %7d %6g %10.3f' % (job, discX, discY, cutoff, Emax, seconds))
+    print('load %.3f s, total %.3f s, results in %s' % (t_load, time.perf_counter() - start, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -49,4 +49,4 @@ export PYTHONPATH=/home/ssonti/miniconda3/bin/python
 #w_truncate -n 11
 #rm -rf traj_segs/000011
 #rm -rf seg_logs/000011*
-python3 data_extract.py
+python3 data_extract.py $SLURM_SUBMIT_DIR
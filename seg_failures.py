@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Which segments pmemd failed on, why, and where, from the runseg.sh retry records
+
+With the "Bounded pmemd retries" generator option every failed pmemd
+attempt appends one JSON line to seg_failures/<iter>-<host>-<worker>.jsonl:
+
+    {"n_iter": 12, "seg_id": 3, "host": "exp-7-58", "worker": 0, "gpu": "0", "attempt": 1, "max_attempts": 3,
+     "class": "vlimit", "exit_code": 1, "final": false, "time": ..., "message": "vlimit exceeded for step 1234"}
+
+"final" marks the attempt after which the segment gave up. WESTPA then
+runs the segment again, its attempts starting over at 1, so a segment's
+records are split into runs, each ending with a "final" record or a
+success, and the segment counts as given up only when its last run did.
+The failure
+classes come from seg.log and pmemd's stderr: cuda, nan, vlimit, box
+(periodic box changed too much), no_output and other. This script counts
+the failed attempts per iteration and class, the segments that recovered
+on a retry and the ones that gave up, and the failures per node and GPU,
+where CUDA errors piling up on one device point at the hardware rather
+than the walker:
+
+    python seg_failures.py
+    python seg_failures.py --iter 100 200
+    python seg_failures.py --format json -o seg_failures.json
+    python seg_failures.py --format csv -o failures.csv
+"""
+
+import csv
+import glob
+import json
+import os
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+
+FAILURE_DIR = 'seg_failures'
+CLASSES = ('cuda', 'nan', 'vlimit', 'box', 'no_output', 'other')
+FIELDS = ('n_iter', 'seg_id', 'host', 'worker', 'gpu', 'attempt', 'max_attempts', 'class', 'exit_code', 'final',
+          'time', 'message')
+
+
+def load(paths, first=None, last=None):
+    """Failed attempts ordered by iteration, segment and time; unreadable lines are skipped"""
+    records = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    rec['n_iter'], rec['seg_id'], rec['attempt'] = int(rec['n_iter']), int(rec['seg_id']), int(rec['attempt'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if (first is not None and rec['n_iter'] < first) or (last is not None and rec['n_iter'] > last):
+                    continue
+                rec['class'] = rec.get('class') if rec.get('class') in CLASSES else 'other'
+                rec['final'] = bool(rec.get('final', False))
+                records.append(dict((name, rec.get(name, '')) for name in FIELDS))
+    records.sort(key=lambda r: (r['n_iter'], r['seg_id'], _seconds(r['time'])))
+    return records
+
+
+def _seconds(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def segments(records):
+    """One row per segment with failures: attempts and classes in order, runs, and whether its last run gave up"""
+    rows = {}
+    for rec in records:
+        key = (rec['n_iter'], rec['seg_id'])
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {'n_iter': rec['n_iter'], 'seg_id': rec['seg_id'], 'host': rec['host'], 'gpu': rec['gpu'],
+                               'failed_attempts': 0, 'runs': 1, 'classes': [], 'gave_up': False, 'message': '',
+                               'attempt': 0}
+        ## a rerun of the segment starts after a final attempt, or over at a lower attempt after a success
+        elif row['gave_up'] or rec['attempt'] <= row['attempt']:
+            row['runs'] += 1
+        row['failed_attempts'] += 1
+        row['classes'].append(rec['class'])
+        row['gave_up'], row['attempt'] = rec['final'], rec['attempt']
+        row['host'], row['gpu'], row['message'] = rec['host'], rec['gpu'], rec['message']
+    for row in rows.values():
+        del row['attempt']
+    return list(rows.values())
+
+
+def counts(records, segs):
+    row = {'failed_attempts': len(records), 'segments_retried': len(segs),
+           'recovered': sum(1 for s in segs if not s['gave_up']), 'gave_up': sum(1 for s in segs if s['gave_up'])}
+    classes = Counter(rec['class'] for rec in records)
+    row.update((name, classes.get(name, 0)) for name in CLASSES)
+    return row
+
+
+def by_iteration(records, segs):
+    rows = []
+    for n_iter in sorted(set(rec['n_iter'] for rec in records)):
+        row = {'n_iter': n_iter}
+        row.update(counts([r for r in records if r['n_iter'] == n_iter], [s for s in segs if s['n_iter'] == n_iter]))
+        rows.append(row)
+    return rows
+
+
+def by_device(records):
+    """Failed attempts per host and GPU, most failures first"""
+    rows = []
+    for host, gpu in set((rec['host'], rec['gpu']) for rec in records):
+        group = [rec for rec in records if rec['host'] == host and rec['gpu'] == gpu]
+        classes = Counter(rec['class'] for rec in group)
+        row = {'host': host, 'gpu': gpu, 'failed_attempts': len(group),
+               'segments': len(set((rec['n_iter'], rec['seg_id']) for rec in group))}
+        row.update((name, classes.get(name, 0)) for name in CLASSES)
+        rows.append(row)
+    rows.sort(key=lambda r: (-r['failed_attempts'], r['host'], r['gpu']))
+    return rows
+
+
+def write_text(out, records, segs, iters, devices):
+    overall = counts(records, segs)
+    out.write('%d failed pmemd attempts in %d segments over %d iterations: %d recovered on a retry, %d gave up\n'
+              % (overall['failed_attempts'], overall['segments_retried'], len(iters), overall['recovered'],
+                 overall['gave_up']))
+    out.write('classes: %s\n\n' % ', '.join('%s %d' % (name, overall[name]) for name in CLASSES if overall[name]))
+    head = ''.join(' %9s' % name for name in CLASSES)
+    out.write('%6s %8s %8s %9s %7s%s\n' % ('iter', 'attempts', 'segments', 'recovered', 'gave up', head))
+    for r in iters:
+        out.write('%6d %8d %8d %9d %7d%s\n' % (r['n_iter'], r['failed_attempts'], r['segments_retried'], r['recovered'],
+                                               r['gave_up'], ''.join(' %9d' % r[name] for name in CLASSES)))
+    out.write('\n%-20s %5s %8s %8s%s\n' % ('host', 'gpu', 'attempts', 'segments', head))
+    for r in devices:
+        out.write('%-20s %5s %8d %8d%s\n' % (r['host'][:20], r['gpu'] or '-', r['failed_attempts'], r['segments'],
+                                            ''.join(' %9d' % r[name] for name in CLASSES)))
+    gave_up = [s for s in segs if s['gave_up']]
+    if gave_up:
+        out.write('\nsegments that gave up\n')
+        out.write('%6s %6s %-20s %5s %4s %8s %s\n' % ('iter', 'seg', 'host', 'gpu', 'runs', 'attempts', 'last failure'))
+        for s in gave_up:
+            out.write('%6d %6d %-20s %5s %4d %8d %s: %s\n' % (s['n_iter'], s['seg_id'], s['host'][:20], s['gpu'] or '-',
+                                                              s['runs'], s['failed_attempts'], s['classes'][-1],
+                                                              s['message']))
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Summarize the failed pmemd attempts recorded by runseg.sh")
+    parser.add_argument("files", nargs="*",
+                        help="failure files (default: <sim_root>/seg_failures/*.jsonl)")
+    parser.add_argument("--sim-root", dest="sim_root", default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help="simulation root (default: $WEST_SIM_ROOT or .)")
+    parser.add_argument("--iter", nargs=2, type=int, default=None, metavar=("FIRST", "LAST"),
+                        help="only iterations FIRST to LAST")
+    parser.add_argument("--format", choices=("text", "json", "csv"), default="text",
+                        help="text report, JSON with all tables, or CSV with one row per failed attempt (default: text)")
+    parser.add_argument("-o", "--output", default=None, help="report file (default: stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    paths = args.files or sorted(glob.glob(os.path.join(args.sim_root, FAILURE_DIR, '*.jsonl')))
+    first, last = args.iter if args.iter else (None, None)
+    records = load(paths, first, last)
+    segs = segments(records)
+    iters, devices = by_iteration(records, segs), by_device(records)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        elif args.format == 'json':
+            json.dump({'overall': counts(records, segs), 'iterations': iters, 'devices': devices, 'segments': segs},
+                      out, indent=1)
+            out.write('\n')
+        elif records:
+            write_text(out, records, segs, iters, devices)
+        else:
+            out.write('no failed pmemd attempts recorded\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Where the wallclock of the segments goes, from the runseg.sh timing probes
+
+With the "Segment timing probes" generator option every runseg.sh appends
+one JSON line per segment to seg_timing/<iter>-<host>-<worker>.jsonl:
+
+    {"n_iter": 12, "seg_id": 3, "host": "exp-7-58", "worker": 0, "gpu": "0", "md_runs": 1,
+     "start": ..., "end": ..., "phases": {"setup": [start, end], "md": [...], "pcoord": [...], ...}}
+
+This script rolls the lines up per iteration and per node: segment time
+percentiles, the mean time and share of every phase (setup, md, pcoord,
+auxdata, cleanup, ...), how busy each node's workers were over the span
+of its segments, and the slowest segments relative to their iteration's
+median:
+
+    python seg_timing.py
+    python seg_timing.py --iter 100 200 --top 20
+    python seg_timing.py --format json -o seg_timing.json
+    python seg_timing.py --format csv -o segments.csv
+"""
+
+import csv
+import glob
+import json
+import os
+import sys
+from argparse import ArgumentParser
+
+import numpy as np
+
+TIMING_DIR = 'seg_timing'
+PERCENTILES = (50, 90, 99)
+
+
+def load(paths, first=None, last=None):
+    """Per-segment records and the phase names in order of appearance; unreadable lines are skipped"""
+    records, phases = [], []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    n_iter = int(rec['n_iter'])
+                    total = float(rec['end']) - float(rec['start'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if (first is not None and n_iter < first) or (last is not None and n_iter > last):
+                    continue
+                durations = {}
+                for name, (start, end) in rec.get('phases', {}).items():
+                    durations[name] = durations.get(name, 0.0) + float(end) - float(start)
+                    if name not in phases:
+                        phases.append(name)
+                records.append((n_iter, int(rec.get('seg_id', -1)), str(rec.get('host', '')), int(rec.get('worker', 0)),
+                                int(rec.get('md_runs', 1)), float(rec['start']), float(rec['end']), total, durations))
+    return records, phases
+
+
+def table(records, phases):
+    """Structured array with one row per segment and one column per phase"""
+    dtype = [('n_iter', 'i8'), ('seg_id', 'i8'), ('host', 'U64'), ('worker', 'i8'), ('md_runs', 'i8'),
+             ('start', 'f8'), ('end', 'f8'), ('total', 'f8')] + [(name, 'f8') for name in phases]
+    segs = np.zeros(len(records), dtype=dtype)
+    for i, (n_iter, seg_id, host, worker, md_runs, start, end, total, durations) in enumerate(records):
+        segs[i] = (n_iter, seg_id, host, worker, md_runs, start, end, total) + tuple(durations.get(p, 0.0) for p in phases)
+    return segs
+
+
+def summarize(segs, phases):
+    """Counts, total-time percentiles, mean phase times and phase shares of a group of segments"""
+    total = segs['total'].sum()
+    row = {'segments': len(segs), 'segment_s_mean': float(segs['total'].mean()),
+           'segment_s_max': float(segs['total'].max()), 'md_restarts': int((segs['md_runs'] - 1).clip(0).sum())}
+    for q, value in zip(PERCENTILES, np.percentile(segs['total'], PERCENTILES)):
+        row['segment_s_p%d' % q] = float(value)
+    for name in phases:
+        row[name + '_s_mean'] = float(segs[name].mean())
+        row[name + '_share'] = float(segs[name].sum() / total) if total > 0 else float('nan')
+    ## time inside runseg.sh but outside any probed phase
+    row['unaccounted_share'] = float(1.0 - sum(segs[name].sum() for name in phases) / total) if total > 0 else float('nan')
+    return row
+
+
+def by_iteration(segs, phases):
+    rows = []
+    for n_iter in np.unique(segs['n_iter']):
+        group = segs[segs['n_iter'] == n_iter]
+        row = {'n_iter': int(n_iter)}
+        row.update(summarize(group, phases))
+        row['span_s'] = float(group['end'].max() - group['start'].min())
+        rows.append(row)
+    return rows
+
+
+def by_node(segs, phases):
+    rows = []
+    for host in np.unique(segs['host']):
+        group = segs[segs['host'] == host]
+        workers = len(np.unique(group['worker']))
+        span = group['end'].max() - group['start'].min()
+        row = {'host': str(host), 'workers': workers}
+        row.update(summarize(group, phases))
+        ## fraction of the node's worker time spent inside runseg.sh
+        row['occupancy'] = float(group['total'].sum() / (workers * span)) if span > 0 else float('nan')
+        rows.append(row)
+    return rows
+
+
+def stragglers(segs, phases, top):
+    """Slowest segments relative to the median segment of their iteration, with their longest phase"""
+    medians = {n: np.median(segs['total'][segs['n_iter'] == n]) for n in np.unique(segs['n_iter'])}
+    ratio = segs['total'] / np.array([medians[n] for n in segs['n_iter']])
+    rows = []
+    for i in np.argsort(-ratio, kind='stable')[:top]:
+        seg = segs[i]
+        longest = max(phases, key=lambda name: seg[name]) if phases else ''
+        rows.append({'n_iter': int(seg['n_iter']), 'seg_id': int(seg['seg_id']), 'host': str(seg['host']),
+                     'worker': int(seg['worker']), 'segment_s': float(seg['total']), 'ratio_to_median': float(ratio[i]),
+                     'md_runs': int(seg['md_runs']), 'longest_phase': longest,
+                     'longest_phase_s': float(seg[longest]) if longest else float('nan')})
+    return rows
+
+
+def write_text(out, segs, phases, iters, nodes, slow):
+    overall = summarize(segs, phases)
+    out.write('%d segments, %d iterations, %d nodes\n' % (len(segs), len(iters), len(nodes)))
+    out.write('segment time: mean %.1f s, p50 %.1f s, p90 %.1f s, p99 %.1f s, max %.1f s; %d md restarts\n'
+              % (overall['segment_s_mean'], overall['segment_s_p50'], overall['segment_s_p90'],
+                 overall['segment_s_p99'], overall['segment_s_max'], overall['md_restarts']))
+    out.write('phases: %s, unaccounted %.1f%%\n\n' % (', '.join('%s %.1f%%' % (name, 100 * overall[name + '_share'])
+                                                         for name in phases), 100 * overall['unaccounted_share']))
+    head = ''.join(' %8s' % name[:8] for name in phases)
+    out.write('%6s %6s %9s %9s %9s %9s %9s%s\n' % ('iter', 'segs', 'span(s)', 'p50(s)', 'p90(s)', 'p99(s)', 'max(s)', head))
+    for r in iters:
+        out.write('%6d %6d %9.1f %9.1f %9.1f %9.1f %9.1f%s\n'
+                  % (r['n_iter'], r['segments'], r['span_s'], r['segment_s_p50'], r['segment_s_p90'], r['segment_s_p99'],
+                     r['segment_s_max'], ''.join(' %7.1f%%' % (100 * r[name + '_share']) for name in phases)))
+    out.write('\n%-20s %7s %6s %9s %9s %9s %9s\n' % ('host', 'workers', 'segs', 'mean(s)', 'p90(s)', 'max(s)', 'occupancy'))
+    for r in nodes:
+        out.write('%-20s %7d %6d %9.1f %9.1f %9.1f %8.1f%%\n'
+                  % (r['host'][:20], r['workers'], r['segments'], r['segment_s_mean'], r['segment_s_p90'],
+                     r['segment_s_max'], 100 * r['occupancy']))
+    out.write('\nslowest segments (relative to their iteration median)\n')
+    out.write('%6s %6s %-20s %9s %7s %7s %s\n' % ('iter', 'seg', 'host', 'time(s)', 'x med', 'md runs', 'longest phase'))
+    for r in slow:
+        out.write('%6d %6d %-20s %9.1f %7.2f %7d %s (%.1f s)\n'
+                  % (r['n_iter'], r['seg_id'], r['host'][:20], r['segment_s'], r['ratio_to_median'], r['md_runs'],
+                     r['longest_phase'], r['longest_phase_s']))
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Summarize the runseg.sh segment timing probes per iteration and per node")
+    parser.add_argument("files", nargs="*",
+                        help="timing files (default: <sim_root>/seg_timing/*.jsonl)")
+    parser.add_argument("--sim-root", dest="sim_root", default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help="simulation root (default: $WEST_SIM_ROOT or .)")
+    parser.add_argument("--iter", nargs=2, type=int, default=None, metavar=("FIRST", "LAST"),
+                        help="only iterations FIRST to LAST")
+    parser.add_argument("--top", type=int, default=10, help="stragglers to list (default: 10)")
+    parser.add_argument("--format", choices=("text", "json", "csv"), default="text",
+                        help="text report, JSON with all tables, or CSV with one row per segment (default: text)")
+    parser.add_argument("-o", "--output", default=None, help="report file (default: stdout)")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    paths = args.files or sorted(glob.glob(os.path.join(args.sim_root, TIMING_DIR, '*.jsonl')))
+    first, last = args.iter if args.iter else (None, None)
+    records, phases = load(paths, first, last)
+    if not records:
+        raise SystemExit('ERROR: no segment timings found (enable the segment timing probes in the generator)')
+    segs = table(records, phases)
+    iters, nodes, slow = by_iteration(segs, phases), by_node(segs, phases), stragglers(segs, phases, args.top)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(segs.dtype.names)
+            writer.writerows(row.tolist() for row in segs)
+        elif args.format == 'json':
+            json.dump({'phases': phases, 'overall': summarize(segs, phases), 'iterations': iters, 'nodes': nodes,
+                       'stragglers': slow}, out, indent=1)
+            out.write('\n')
+        else:
+            write_text(out, segs, phases, iters, nodes, slow)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,180 @@
-import h5py
+#!/usr/bin/env python3
+"""
+Performance accounting of a WESTPA run from west.h5
+
+The simulated time of a segment is nstlim x dt from the md.in the
+segments run with (common_files/md.in). For every iteration the report
+gives the simulated ns and ns/day, the spread of the per-segment walltime
+and cputime stored in seg_index (stragglers are segments slower than
+--straggler x the median), and a GPU utilization estimate: the GPU time
+used by the segments over the GPU time available during the iteration
+(--gpus x iteration walltime). west.h5 is opened read-only in SWMR mode,
+so the report can run while w_run is writing:
+
+    python simtime.py
+    python simtime.py --west west.h5 --gpus 4 --format csv -o simtime.csv
+    python simtime.py --format json -o simtime.json
+"""
+
+import csv
+import json
+import os
+import re
+import sys
+from argparse import ArgumentParser
 
+import h5py
 import numpy as np
 
+## seg_index status of a completed segment
+SEG_STATUS_COMPLETE = 2
+COLUMNS = ['n_iter', 'segments', 'complete', 'simulated_ns', 'walltime_s', 'ns_per_day',
+           'seg_wall_mean_s', 'seg_wall_median_s', 'seg_wall_p95_s', 'seg_wall_max_s',
+           'stragglers', 'straggler_ratio', 'cpu_wall_ratio', 'gpu_utilization']
+
+
+def segment_ns(mdin):
+    """Simulated ns per segment, nstlim x dt (ps) of an AMBER md.in"""
+    with open(mdin) as f:
+        text = re.sub(r'!.*', '', f.read())
+    values = {}
+    for k, v in re.findall(r'\b(nstlim|dt)\s*=\s*([0-9.eEdD+-]+)', text, re.I):
+        ## Fortran double precision exponents: 2.0d-3
+        try:
+            values[k.lower()] = float(v.replace('d', 'e').replace('D', 'e'))
+        except ValueError:
+            raise SystemExit('ERROR: cannot read %s = %s in %s' % (k, v, mdin))
+    if 'nstlim' not in values:
+        raise SystemExit('ERROR: no nstlim in %s' % mdin)
+    ## sander/pmemd default time step is 1 fs
+    return values['nstlim'] * values.get('dt', 0.001) / 1000.0
+
+
+def open_west(path):
+    """west.h5 read-only, in SWMR mode when the file allows it"""
+    try:
+        return h5py.File(path, 'r', libver='latest', swmr=True)
+    except (OSError, ValueError):
+        return h5py.File(path, 'r')
+
+
+def default_gpus(nodefile='nodefilelist.txt'):
+    """One GPU per host of nodefilelist.txt, as run_WE.sh launches the workers"""
+    if os.path.exists(nodefile):
+        with open(nodefile) as f:
+            hosts = [line for line in f if line.strip()]
+        if hosts:
+            return len(hosts)
+    return 1
+
+
+def iteration_stats(west, seg_ns, gpus, straggler, first=1, last=None):
+    """One row of COLUMNS per iteration in west.h5"""
+    summary = west['summary'][...] if 'summary' in west else None
+    iters = sorted(int(name[5:]) for name in west['iterations'])
+    rows = []
+    for n_iter in iters:
+        if n_iter < first or (last is not None and n_iter > last):
+            continue
+        ## one read of the three seg_index fields
+        index = west['iterations']['iter_{0:08d}'.format(n_iter)]['seg_index'].fields(['walltime', 'cputime', 'status'])[:]
+        done = index['status'] == SEG_STATUS_COMPLETE
+        wall, cpu = index['walltime'][done], index['cputime'][done]
+        ns = done.sum() * seg_ns
+        if summary is not None and n_iter <= len(summary) and summary['walltime'][n_iter - 1] > 0:
+            walltime = float(summary['walltime'][n_iter - 1])
+        else:
+            ## no summary yet: the slowest segment bounds the iteration from below
+            walltime = float(wall.max()) if len(wall) else 0.0
+        row = dict.fromkeys(COLUMNS, float('nan'))
+        row.update(n_iter=n_iter, segments=len(index), complete=int(done.sum()), simulated_ns=ns,
+                   walltime_s=walltime, stragglers=0)
+        if walltime > 0:
+            row['ns_per_day'] = ns / walltime * 86400.0
+            row['gpu_utilization'] = wall.sum() / (gpus * walltime)
+        if len(wall):
+            median = float(np.median(wall))
+            row.update(seg_wall_mean_s=float(wall.mean()), seg_wall_median_s=median,
+                       seg_wall_p95_s=float(np.percentile(wall, 95)), seg_wall_max_s=float(wall.max()))
+            if median > 0:
+                row['stragglers'] = int((wall > straggler * median).sum())
+                row['straggler_ratio'] = float(wall.max()) / median
+            if wall.sum() > 0:
+                row['cpu_wall_ratio'] = float(cpu.sum() / wall.sum())
+        rows.append(row)
+    return rows
+
 
+def totals(rows, gpus):
+    ns = sum(r['simulated_ns'] for r in rows)
+    walltime = sum(r['walltime_s'] for r in rows)
+    segwall = sum(r['seg_wall_mean_s'] * r['complete'] for r in rows if r['complete'])
+    return {'iterations': len(rows), 'segments': sum(r['complete'] for r in rows), 'simulated_ns': ns,
+            'walltime_h': walltime / 3600.0, 'ns_per_day': ns / walltime * 86400.0 if walltime else float('nan'),
+            'stragglers': sum(r['stragglers'] for r in rows),
+            'gpu_utilization': segwall / (gpus * walltime) if walltime else float('nan')}
 
-simtime = 0.1 # in ns
 
-f = h5py.File('west_now.h5','r')
+def write_text(out, rows, total, settings):
+    out.write('segment length %.4g ns, %d GPU(s), stragglers > %.3g x median segment walltime\n'
+              % (settings['segment_ns'], settings['gpus'], settings['straggler']))
+    out.write('%6s %6s %9s %9s %9s %9s %9s %6s %7s %6s\n' % ('iter', 'segs', 'ns', 'wall(s)', 'ns/day', 'med(s)',
+                                                         'max(s)', 'strag', 'cpu/wall', 'gpu%'))
+    for r in rows:
+        out.write('%6d %6d %9.3f %9.1f %9.2f %9.1f %9.1f %6d %7.2f %6.1f\n'
+                  % (r['n_iter'], r['complete'], r['simulated_ns'], r['walltime_s'], r['ns_per_day'],
+                     r['seg_wall_median_s'], r['seg_wall_max_s'], r['stragglers'], r['cpu_wall_ratio'],
+                     100.0 * r['gpu_utilization']))
+    out.write('total simtime = %.3f nanoseconds\n' % total['simulated_ns'])
+    out.write('total walltime = %.3f hours\n' % total['walltime_h'])
+    out.write('Speed = %.2f ns/hr = %.2f ns/day\n' % (total['ns_per_day'] / 24.0, total['ns_per_day']))
+    out.write('Stragglers = %d, GPU utilization = %.1f%%\n' % (total['stragglers'], 100.0 * total['gpu_utilization']))
 
-total_simtime = np.sum(f['summary']['n_particles'])*simtime
 
-total_walltime = np.sum(f['summary']['walltime'])/3600.0 # in hours
+def cmdlineparse():
+    parser = ArgumentParser(description="Performance accounting of a WESTPA run from west.h5")
+    parser.add_argument("--west", default="west.h5", help="WESTPA data file, opened read-only (default: west.h5)")
+    parser.add_argument("--md-in", dest="mdin", default=os.path.join("common_files", "md.in"),
+                        help="md.in of the segments, for nstlim x dt (default: common_files/md.in)")
+    parser.add_argument("--segment-ns", dest="segment_ns", type=float, default=None,
+                        help="simulated ns per segment (overrides --md-in)")
+    parser.add_argument("--gpus", type=int, default=None,
+                        help="GPUs running segments (default: one per host in nodefilelist.txt)")
+    parser.add_argument("--straggler", type=float, default=1.5,
+                        help="segments slower than this multiple of the median walltime are stragglers (default: 1.5)")
+    parser.add_argument("--first", type=int, default=1, help="first iteration to report")
+    parser.add_argument("--last", type=int, default=None, help="last iteration to report")
+    parser.add_argument("--format", choices=("text", "csv", "json"), default="text", help="report format (default: text)")
+    parser.add_argument("-o", "--output", default=None, help="report file (default: stdout)")
+    return parser.parse_args()
 
-speed=total_simtime/total_walltime
 
-print('total simtime = '+str(total_simtime)+' nanoseconds')
+def main():
+    args = cmdlineparse()
+    seg_ns = args.segment_ns if args.segment_ns is not None else segment_ns(args.mdin)
+    gpus = args.gpus or default_gpus()
+    with open_west(args.west) as west:
+        rows = iteration_stats(west, seg_ns, gpus, args.straggler, args.first, args.last)
+    total = totals(rows, gpus)
+    settings = {'west': args.west, 'segment_ns': seg_ns, 'gpus': gpus, 'straggler': args.straggler}
 
-print('total walltime = '+str(total_walltime)+' hours')
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            writer = csv.DictWriter(out, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+        elif args.format == 'json':
+            ## NaN (iterations still running) becomes null
+            clean = lambda d: dict((k, None if isinstance(v, float) and v != v else v) for k, v in d.items())
+            json.dump({'settings': settings, 'totals': clean(total), 'iterations': [clean(r) for r in rows]}, out, indent=1)
+            out.write('\n')
+        else:
+            write_text(out, rows, total, settings)
+    finally:
+        if out is not sys.stdout:
+            out.close()
 
-print('Speed = %.2f ns/hr = %.2f ns/day'%(speed,speed*24))
 
-print(f['summary']['walltime'])
-print(f['summary']['n_particles'])
+if __name__ == '__main__':
+    sys.exit(main())
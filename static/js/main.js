@@ -285,12 +285,22 @@ class ParGaMDUIController {
                         <li><strong>Max Iterations:</strong> ${formData.max_total_iterations}</li>
                         <li><strong>PC1 (RMSD):</strong> ${formData.pc1_min} to ${formData.pc1_max} (step: ${formData.pc1_step})</li>
                         <li><strong>PC2 (Rg):</strong> ${formData.pc2_min} to ${formData.pc2_max} (step: ${formData.pc2_step})</li>
+                        <li><strong>Progress Coordinate Dimensions:</strong> ${formData.pcoord_ndim}</li>
                     </ul>
                     
                     <h6>GPU Options</h6>
                     <ul class="list-unstyled">
                         <li><strong>Multi-GPU Parallelization:</strong> ${formData.enable_gpu_parallelization ? 'Enabled' : 'Disabled'}</li>
                     </ul>
+                    
+                    <h6>Segment Script Options</h6>
+                    <ul class="list-unstyled">
+                        <li><strong>GaMD Boosts in west.h5:</strong> ${formData.store_gamd_auxdata ? 'Enabled' : 'Disabled'}</li>
+                        <li><strong>Pcoord Engine:</strong> ${formData.pcoord_daemon ? 'Python (per-node daemon)' : formData.python_pcoord ? 'Python (pcoord.py)' : 'cpptraj'}</li>
+                        <li><strong>Segment Timing Probes:</strong> ${formData.segment_timing ? 'Enabled' : 'Disabled'}</li>
+                        <li><strong>Local Scratch:</strong> ${formData.local_scratch ? 'Enabled (cleanup: ' + formData.scratch_cleanup + ')' : 'Disabled'}</li>
+                        <li><strong>pmemd Retries:</strong> ${formData.md_retry ? formData.md_max_attempts + ' attempts, ' + formData.md_retry_backoff + ' s backoff' : 'Disabled (retry until success)'}</li>
+                    </ul>
                 </div>
             </div>
         `;
@@ -570,6 +580,12 @@ class ParGaMDUIController {
         
         // Handle checkbox
         data.enable_gpu_parallelization = document.getElementById('enable_gpu_parallelization').checked;
+        data.store_gamd_auxdata = document.getElementById('store_gamd_auxdata').checked;
+        data.python_pcoord = document.getElementById('python_pcoord').checked;
+        data.pcoord_daemon = document.getElementById('pcoord_daemon').checked;
+        data.segment_timing = document.getElementById('segment_timing').checked;
+        data.local_scratch = document.getElementById('local_scratch').checked;
+        data.md_retry = document.getElementById('md_retry').checked;
         
         // Handle file inputs
         const pdbFile = document.getElementById('pdb_file').files[0];
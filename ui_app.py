@@ -47,7 +47,8 @@ class ParGaMDConfigGenerator:
             'env_sh': self._get_env_sh_template(),
             'runseg_sh': self._get_runseg_sh_template(),
             'run_cmd_sh': self._get_run_cmd_sh_template(),
-            'run_we_sh': self._get_run_we_sh_template()
+            'run_we_sh': self._get_run_we_sh_template(),
+            'get_pcoord_sh': self._get_get_pcoord_sh_template()
         }
     
     def _get_west_cfg_template(self):
@@ -59,7 +60,7 @@ west:
     driver: westpa.core.systems.WESTSystem
     system_options:
       # Dimensionality of your progress coordinate
-      pcoord_ndim: 2
+      pcoord_ndim: {{ pcoord_ndim }}
       # Number of data points per iteration
       # Needs to be pcoord_len >= 2 (minimum of parent, last frame) to work with most analysis tools
       pcoord_len: {{ pcoord_len }}
@@ -68,9 +69,8 @@ west:
       bins:
         type: RectilinearBinMapper
         # The edges of the bins 
-        boundaries:         
-          - {{ pc1_bins }}
-          - {{ pc2_bins }}
+        boundaries:         {% for dim_bins in boundaries %}
+          - {{ dim_bins }}{% endfor %}
       # Number walkers per bin
       bin_target_counts: {{ bin_target_counts }}
   propagation:
@@ -97,6 +97,10 @@ west:
     datasets:
       - name:    coord
         enabled: false
+{%- if store_gamd_auxdata %}
+      - name:    gamd
+        enabled: true
+{%- endif %}
     propagator:
       executable: $WEST_SIM_ROOT/westpa_scripts/runseg.sh
       stdout:     $WEST_SIM_ROOT/seg_logs/{segment.n_iter:06d}-{segment.seg_id:06d}.log
@@ -158,7 +162,9 @@ export USE_LOCAL_SCRATCH=1
 export WM_ZMQ_MASTER_HEARTBEAT=100
 export WM_ZMQ_WORKER_HEARTBEAT=100
 export WM_ZMQ_TIMEOUT_FACTOR=300
-export BASH=$SWROOT/bin/bash
+{% if pcoord_daemon %}# node.sh starts a per-node pcoord daemon (westpa_scripts/pcoord_daemon.py) for runseg.sh
+export PCOORD_DAEMON=1
+{% endif %}export BASH=$SWROOT/bin/bash
 export PERL=$SWROOT/usr/bin/perl
 export ZSH=$SWROOT/bin/zsh
 export IFCONFIG=$SWROOT/bin/ifconfig
@@ -193,19 +199,49 @@ if [ -n "$SEG_DEBUG" ] ; then
   env | sort
 fi
 
-cd $WEST_SIM_ROOT
+{% if segment_timing %}# Phase timings: one JSON line per segment in $WEST_SIM_ROOT/seg_timing/, summarized by seg_timing.py
+seg_phase() {
+  local now=${EPOCHREALTIME:-$(date +%s.%N)}
+  now=${now/,/.}
+  SEG_PHASES="${SEG_PHASES:+$SEG_PHASES, }\\"$1\\": [$SEG_T, $now]"
+  SEG_T=$now
+}
+SEG_T0=${EPOCHREALTIME:-$(date +%s.%N)}
+SEG_T0=${SEG_T0/,/.}
+SEG_T=$SEG_T0
+SEG_MD_RUNS=0
+
+{% endif %}{% if local_scratch %}# Run in node-local scratch ($SLURM_TMPDIR, $TMPDIR or /tmp); only seg.rst, seg.nc, gamd.log and the
+# pcoord files are copied back to $WEST_CURRENT_SEG_DATA_REF, in one transfer at the end
+SCRATCH_CLEANUP={{ scratch_cleanup }}
+SCRATCH=$(mktemp -d ${SLURM_TMPDIR:-${TMPDIR:-/tmp}}/westseg-$(printf %06d-%06d $WEST_CURRENT_ITER $WEST_CURRENT_SEG_ID)-XXXXXX) || exit 1
+scratch_cleanup() {
+  local status=$?
+  cd $WEST_SIM_ROOT
+  if [ "$SCRATCH_CLEANUP" = always ] || { [ "$SCRATCH_CLEANUP" = success ] && [ $status -eq 0 ]; }; then
+    rm -rf $SCRATCH
+  else
+    echo "RUNSEG.SH: scratch directory kept: $SCRATCH"
+  fi
+}
+trap scratch_cleanup EXIT
+cd $SCRATCH
+
+cp -pv $WEST_SIM_ROOT/common_files/{{ protein_name }}.prmtop .
+cp -pv $WEST_SIM_ROOT/common_files/gamd-restart.dat .
+{% else %}cd $WEST_SIM_ROOT
 mkdir -pv $WEST_CURRENT_SEG_DATA_REF
 cd $WEST_CURRENT_SEG_DATA_REF
 
 ln -sv $WEST_SIM_ROOT/common_files/{{ protein_name }}.prmtop .
 ln -sv $WEST_SIM_ROOT/common_files/gamd-restart.dat .
-
+{% endif %}
 if [ "$WEST_CURRENT_SEG_INITPOINT_TYPE" = "SEG_INITPOINT_CONTINUES" ]; then
   sed "s/RAND/$WEST_RAND16/g" $WEST_SIM_ROOT/common_files/md.in > md.in
-  ln -sv $WEST_PARENT_DATA_REF/seg.rst ./parent.rst
+  {% if local_scratch %}cp -v{% else %}ln -sv{% endif %} $WEST_PARENT_DATA_REF/seg.rst ./parent.rst
 elif [ "$WEST_CURRENT_SEG_INITPOINT_TYPE" = "SEG_INITPOINT_NEWTRAJ" ]; then
   sed "s/RAND/$WEST_RAND16/g" $WEST_SIM_ROOT/common_files/md_init.in > md.in
-  ln -sv $WEST_PARENT_DATA_REF ./parent.rst
+  {% if local_scratch %}cp -v{% else %}ln -sv{% endif %} $WEST_PARENT_DATA_REF ./parent.rst
 fi
 
 {% if enable_gpu_parallelization %}
@@ -217,16 +253,64 @@ echo "RUNSEG.SH: WM_PROCESS_INDEX = " $WM_PROCESS_INDEX
 echo "RUNSEG.SH: CUDA_VISIBLE_DEVICES = " $CUDA_VISIBLE_DEVICES
 {% endif %}
 
-while ! grep -q "Final Performance Info" seg.log; do
-	$PMEMD -O -i md.in   -p {{ protein_name }}.prmtop  -c parent.rst \\
-          -r seg.rst -x seg.nc      -o seg.log    -inf seg.nfo -gamd gamd.log
-done
-
-RMSD=rmsd.dat
+{% if segment_timing %}seg_phase setup
+{% endif %}{% if md_retry %}# Bounded pmemd retries: every failed attempt is classified from seg.log and pmemd.err (cuda, nan,
+# vlimit, box, no_output, other) and appended to $WEST_SIM_ROOT/seg_failures/, summarized by seg_failures.py
+MD_MAX_ATTEMPTS={{ md_max_attempts }}
+MD_RETRY_BACKOFF={{ md_retry_backoff }}
+md_failure() {
+  local rule
+  MD_FAIL_CLASS=other
+  MD_FAIL_MSG=$(cat seg.log pmemd.err 2>/dev/null | grep -v '^ *$' | tail -n 1)
+  for rule in 'cuda:cuda[a-z]* .*failed|cudaerror|cuda error|illegal memory access|launch failure|out of memory' \\
+              'nan:\\bnan\\b' 'vlimit:vlimit exceeded' 'box:periodic box dimensions have changed'; do
+    if grep -qiE "${rule#*:}" seg.log pmemd.err 2>/dev/null; then
+      MD_FAIL_CLASS=${rule%%:*}
+      MD_FAIL_MSG=$(grep -hiE "${rule#*:}" seg.log pmemd.err 2>/dev/null | head -n 1)
+      break
+    fi
+  done
+  [ -s seg.log ] || [ -s pmemd.err ] || MD_FAIL_CLASS=no_output
+  MD_FAIL_MSG=$(echo "$MD_FAIL_MSG" | tr -d '"\\\\' | tr -s '[:space:]' ' ' | sed 's/^ //; s/ $//' | cut -c1-200)
+  mkdir -p $WEST_SIM_ROOT/seg_failures
+  echo "{\\"n_iter\\": $WEST_CURRENT_ITER, \\"seg_id\\": $WEST_CURRENT_SEG_ID, \\"host\\": \\"$(hostname)\\", \\"worker\\": ${WM_PROCESS_INDEX:-0}, \\"gpu\\": \\"$CUDA_VISIBLE_DEVICES\\", \\"attempt\\": $MD_ATTEMPT, \\"max_attempts\\": $MD_MAX_ATTEMPTS, \\"class\\": \\"$MD_FAIL_CLASS\\", \\"exit_code\\": $MD_EXIT, \\"final\\": $1, \\"time\\": $(date +%s), \\"message\\": \\"$MD_FAIL_MSG\\"}" \\
+    >> $WEST_SIM_ROOT/seg_failures/$(printf %06d $WEST_CURRENT_ITER)-$(hostname)-${WM_PROCESS_INDEX:-0}.jsonl
+}
+MD_ATTEMPT=0
+{% endif %}while ! grep -q "Final Performance Info" seg.log{% if md_retry %} 2>/dev/null{% endif %}; do
+{% if md_retry %}  if [ $MD_ATTEMPT -gt 0 ]; then
+    if [ $MD_ATTEMPT -ge $MD_MAX_ATTEMPTS ]; then
+      md_failure true
+      echo "RUNSEG.SH: pmemd failed $MD_ATTEMPT times ($MD_FAIL_CLASS: $MD_FAIL_MSG), giving up"
+      exit 1
+    fi
+    md_failure false
+    echo "RUNSEG.SH: pmemd attempt $MD_ATTEMPT failed ($MD_FAIL_CLASS: $MD_FAIL_MSG), retrying"
+    # the same seed reproduces a blow-up, so unstable runs continue with a new one
+    case $MD_FAIL_CLASS in
+      nan|vlimit|box) sed -i "s/^\\( *ig *= *\\)-\\?[0-9]*/\\1$((RANDOM * 32768 + RANDOM))/" md.in ;;
+    esac
+    sleep $((MD_RETRY_BACKOFF << (MD_ATTEMPT - 1)))
+  fi
+  MD_ATTEMPT=$((MD_ATTEMPT + 1))
+  rm -f seg.log
+{% endif %}	$PMEMD -O -i md.in   -p {{ protein_name }}.prmtop  -c parent.rst \\
+          -r seg.rst -x seg.nc      -o seg.log    -inf seg.nfo -gamd gamd.log{% if md_retry %} 2> pmemd.err
+  MD_EXIT=$?
+  cat pmemd.err >&2{% endif %}
+{% if segment_timing %}  SEG_MD_RUNS=$((SEG_MD_RUNS + 1))
+{% endif %}done
+{% if segment_timing %}seg_phase md
+{% endif %}
+{% if python_pcoord %}# CA RMSD and Rg computed in Python (westpa_scripts/pcoord.py) instead of cpptraj
+python $WEST_SIM_ROOT/westpa_scripts/{% if pcoord_daemon %}pcoord_daemon.py client{% else %}pcoord.py{% endif %} --prmtop $WEST_SIM_ROOT/common_files/{{ protein_name }}.prmtop \\
+  --ref $WEST_SIM_ROOT/common_files/{{ protein_name }}.pdb --cache $WEST_SIM_ROOT/common_files/{{ protein_name }}.pcoord.npz \\
+  --ndim {{ pcoord_ndim }} --rmsd rmsd.dat --rg rg.dat -o $WEST_PCOORD_RETURN parent.rst seg.nc
+{% else %}RMSD=rmsd.dat
 RG=rg.dat
 COMMAND="         parm {{ protein_name }}.prmtop\\n"
-COMMAND="${COMMAND} trajin $WEST_CURRENT_SEG_DATA_REF/parent.rst\\n"
-COMMAND="${COMMAND} trajin $WEST_CURRENT_SEG_DATA_REF/seg.nc\\n"
+COMMAND="${COMMAND} trajin {% if local_scratch %}$SCRATCH{% else %}$WEST_CURRENT_SEG_DATA_REF{% endif %}/parent.rst\\n"
+COMMAND="${COMMAND} trajin {% if local_scratch %}$SCRATCH{% else %}$WEST_CURRENT_SEG_DATA_REF{% endif %}/seg.nc\\n"
 COMMAND="${COMMAND} reference $WEST_SIM_ROOT/common_files/{{ protein_name }}.pdb\\n"
 COMMAND="${COMMAND} rms ca-rmsd @CA reference out $RMSD mass\\n"
 COMMAND="${COMMAND} radgyr ca-rg @CA  out $RG  mass\\n"
@@ -235,14 +319,68 @@ COMMAND="${COMMAND} go\\n"
 echo -e $COMMAND | $CPPTRAJ
 #cat $RMSD > rmsd.dat
 #cat $RG > rg.dat
-paste <(cat rmsd.dat | tail -n +2 | awk {'print $2'}) <(cat rg.dat | tail -n +2 | awk {'print $2'})>$WEST_PCOORD_RETURN
+{% if pcoord_ndim == 1 %}cat rmsd.dat | tail -n +2 | awk {'print $2'}>$WEST_PCOORD_RETURN{% else %}paste <(cat rmsd.dat | tail -n +2 | awk {'print $2'}) <(cat rg.dat | tail -n +2 | awk {'print $2{% if pcoord_ndim == 3 %}, $3{% endif %}'})>$WEST_PCOORD_RETURN{% endif %}
+{% endif %}{% if segment_timing %}seg_phase pcoord
+{% endif %}{% if store_gamd_auxdata %}
+# Store the GaMD boosts in west.h5 (iterations/*/auxdata/gamd) next to the pcoords
+if [ -n "$WEST_GAMD_RETURN" ]; then
+  grep -v '^#' gamd.log > $WEST_GAMD_RETURN
+fi
+{% if segment_timing %}seg_phase auxdata
+{% endif %}{% endif %}{% if local_scratch %}
+# One batched copy of the outputs back to the segment directory on the shared filesystem
+mkdir -p $WEST_CURRENT_SEG_DATA_REF
+if ! (set -o pipefail; tar -cf - seg.rst seg.nc gamd.log rmsd.dat rg.dat | tar -xf - -C $WEST_CURRENT_SEG_DATA_REF); then
+  echo "RUNSEG.SH: copy back to $WEST_CURRENT_SEG_DATA_REF failed"
+  exit 1
+fi
+{% if segment_timing %}seg_phase stageout
+{% endif %}{% endif %}
 #cat $TEMP | tail -n +2 | awk '{print $2}' > $WEST_PCOORD_RETURN
 #paste <(cat $TEMP | tail -n 1 | awk {'print $2'}) <(cat $RG | tail -n 1 | awk {'print $2'})>$WEST_PCOORD_RETURN
 #cat $TEMP >pcoord.dat
 # Clean up
-rm -f $TEMP md.in seg.nfo seg.pdb
+rm -f $TEMP md.in seg.nfo seg.pdb{% if md_retry %} pmemd.err{% endif %}{% if segment_timing %}
+seg_phase cleanup
+mkdir -p $WEST_SIM_ROOT/seg_timing
+echo "{\\"n_iter\\": $WEST_CURRENT_ITER, \\"seg_id\\": $WEST_CURRENT_SEG_ID, \\"host\\": \\"$(hostname)\\", \\"worker\\": ${WM_PROCESS_INDEX:-0}, \\"gpu\\": \\"$CUDA_VISIBLE_DEVICES\\", \\"md_runs\\": $SEG_MD_RUNS, \\"start\\": $SEG_T0, \\"end\\": $SEG_T, \\"phases\\": {$SEG_PHASES}}" \\
+  >> $WEST_SIM_ROOT/seg_timing/$(printf %06d $WEST_CURRENT_ITER)-$(hostname)-${WM_PROCESS_INDEX:-0}.jsonl{% endif %}
 """)
     
+    def _get_get_pcoord_sh_template(self):
+        return Template("""#!/bin/bash
+
+if [ -n "$SEG_DEBUG" ] ; then
+  set -x
+  env | sort
+fi
+
+cd $WEST_SIM_ROOT
+
+{% if python_pcoord %}python $WEST_SIM_ROOT/westpa_scripts/{% if pcoord_daemon %}pcoord_daemon.py client{% else %}pcoord.py{% endif %} --prmtop $WEST_SIM_ROOT/common_files/{{ protein_name }}.prmtop \\
+  --ref $WEST_SIM_ROOT/common_files/{{ protein_name }}.pdb --cache $WEST_SIM_ROOT/common_files/{{ protein_name }}.pcoord.npz \\
+  --ndim {{ pcoord_ndim }} --last -o $WEST_PCOORD_RETURN $WEST_STRUCT_DATA_REF
+{% else %}RMSD=$(mktemp)
+RG=$(mktemp)
+
+COMMAND="parm $WEST_SIM_ROOT/common_files/{{ protein_name }}.prmtop \\n"
+COMMAND="${COMMAND} trajin $WEST_STRUCT_DATA_REF \\n"
+COMMAND="${COMMAND} reference $WEST_SIM_ROOT/common_files/{{ protein_name }}.pdb \\n"
+COMMAND="${COMMAND} rms ca-rmsd @CA reference out $RMSD mass\\n"
+COMMAND="${COMMAND} radgyr ca-rg @CA  out $RG mass\\n"
+COMMAND="${COMMAND} go"
+
+echo -e "${COMMAND}" | $CPPTRAJ
+
+# One value per pcoord dimension: RMSD, Rg and the largest distance from the center (radgyr Max)
+{% if pcoord_ndim == 1 %}cat $RMSD | tail -n 1 | awk {'print $2'}>$WEST_PCOORD_RETURN{% else %}paste <(cat $RMSD | tail -n 1 | awk {'print $2'}) <(cat $RG | tail -n 1 | awk {'print $2{% if pcoord_ndim == 3 %}, $3{% endif %}'})>$WEST_PCOORD_RETURN{% endif %}
+rm -f $RMSD $RG
+{% endif %}
+if [ -n "$SEG_DEBUG" ] ; then
+  head -v $WEST_PCOORD_RETURN
+fi
+""")
+
     def _get_run_cmd_sh_template(self):
         return Template("""#!/bin/bash
 #SBATCH --job-name="{{ protein_name }}_GaMD"
@@ -367,18 +505,40 @@ wait
             boundaries.append('inf')
         return boundaries
     
+    def pcoord_ndim(self, params):
+        """Progress coordinate dimensions: RMSD, Rg and the largest distance from the center (radgyr Max)"""
+        return min(max(int(params.get('pcoord_ndim', 2) or 2), 1), 3)
+
+    def pcoord_boundaries(self, params, ndim, include_infinite_bounds=True):
+        """Bin boundaries of every pcoord dimension; the third one is tracked but not binned"""
+        boundaries = [
+            self.generate_bin_boundaries(params.get('pc1_min', 0.0), params.get('pc1_max', 8.0),
+                                         params.get('pc1_step', 0.2), include_infinite_bounds),
+            self.generate_bin_boundaries(params.get('pc2_min', 0.0), params.get('pc2_max', 8.0),
+                                         params.get('pc2_step', 0.2), include_infinite_bounds),
+            ['-inf', 'inf'],
+        ]
+        return boundaries[:ndim]
+
+    def scratch_cleanup(self, params):
+        """When runseg.sh removes its scratch directory: always, success (keep failed segments) or never"""
+        policy = params.get('scratch_cleanup', 'success')
+        return policy if policy in ('always', 'success', 'never') else 'success'
+
+    def md_retry(self, params):
+        """(attempts, backoff seconds) of the bounded pmemd retries; the backoff doubles after every failure"""
+        attempts = min(max(int(params.get('md_max_attempts', 3) or 3), 1), 20)
+        backoff = min(max(int(params.get('md_retry_backoff', 30) or 0), 0), 3600)
+        return attempts, backoff
+
     def generate_configs(self, params):
         """Generate all configuration files based on user parameters"""
         configs = {}
         
         include_inf = bool(params.get('include_infinite_bounds', True))
         # Generate bin boundaries
-        pc1_bins = self.generate_bin_boundaries(
-            params['pc1_min'], params['pc1_max'], params['pc1_step'], include_inf
-        )
-        pc2_bins = self.generate_bin_boundaries(
-            params['pc2_min'], params['pc2_max'], params['pc2_step'], include_inf
-        )
+        pcoord_ndim = self.pcoord_ndim(params)
+        boundaries = self.pcoord_boundaries(params, pcoord_ndim, include_inf)
         
         # Calculate pcoord_len based on nstlim and ntpr
         nstlim = int(params['nstlim'])
@@ -387,22 +547,50 @@ wait
             ntpr = 1
         pcoord_len = (nstlim // ntpr) + 1
         
+        store_gamd_auxdata = bool(params.get('store_gamd_auxdata', False))
+        pcoord_daemon = bool(params.get('pcoord_daemon', False))
+        python_pcoord = bool(params.get('python_pcoord', False)) or pcoord_daemon
+        segment_timing = bool(params.get('segment_timing', False))
+        local_scratch = bool(params.get('local_scratch', False))
+        scratch_cleanup = self.scratch_cleanup(params)
+        md_retry = bool(params.get('md_retry', False))
+        md_max_attempts, md_retry_backoff = self.md_retry(params)
+
         # Generate west.cfg
         configs['west.cfg'] = self.templates['west_cfg'].render(
+            pcoord_ndim=pcoord_ndim,
             pcoord_len=pcoord_len,
-            pc1_bins=pc1_bins,
-            pc2_bins=pc2_bins,
+            boundaries=boundaries,
             bin_target_counts=int(params['bin_target_counts']),
-            max_total_iterations=int(params['max_total_iterations'])
+            max_total_iterations=int(params['max_total_iterations']),
+            store_gamd_auxdata=store_gamd_auxdata
         )
         
         # Generate env.sh (SSH-free; uses $PWD/WEST_SIM_ROOT)
-        configs['env.sh'] = self.templates['env_sh'].render()
+        configs['env.sh'] = self.templates['env_sh'].render(pcoord_daemon=pcoord_daemon)
         
         # Generate runseg.sh
         configs['westpa_scripts/runseg.sh'] = self.templates['runseg_sh'].render(
             protein_name=params['protein_name'],
-            enable_gpu_parallelization=params['enable_gpu_parallelization']
+            enable_gpu_parallelization=params['enable_gpu_parallelization'],
+            store_gamd_auxdata=store_gamd_auxdata,
+            pcoord_ndim=pcoord_ndim,
+            python_pcoord=python_pcoord,
+            pcoord_daemon=pcoord_daemon,
+            segment_timing=segment_timing,
+            local_scratch=local_scratch,
+            scratch_cleanup=scratch_cleanup,
+            md_retry=md_retry,
+            md_max_attempts=md_max_attempts,
+            md_retry_backoff=md_retry_backoff
+        )
+
+        # Generate get_pcoord.sh (basis state pcoords, same dimensions as runseg.sh returns)
+        configs['westpa_scripts/get_pcoord.sh'] = self.templates['get_pcoord_sh'].render(
+            protein_name=params['protein_name'],
+            pcoord_ndim=pcoord_ndim,
+            python_pcoord=python_pcoord,
+            pcoord_daemon=pcoord_daemon
         )
         
         # Generate run_cmd.sh
@@ -458,7 +646,8 @@ def download_configs_zip():
         include_root_files = [
             'west.cfg', 'run_WE.sh', 'env.sh',
             'node.sh', 'init.sh', 'run_data.sh', 'data_extract.py',
-            'nodefilelist.txt', 'simtime.py', 'tstate.file'
+            'fes_update.py', 'pyreweighting.py',
+            'nodefilelist.txt', 'simtime.py', 'seg_timing.py', 'seg_failures.py', 'tstate.file'
         ]
 
         mem_zip = BytesIO()
@@ -561,6 +750,7 @@ def generate_config_preview():
             'west.cfg': 'west.cfg',
             'env.sh': 'env.sh',
             'run_we.sh': 'run_we.sh',
+            'get_pcoord.sh': 'westpa_scripts/get_pcoord.sh',
         }
         key = name_map.get(filename, filename)
 
@@ -572,25 +762,38 @@ def generate_config_preview():
             nstlim = int(params.get('nstlim', 50000))
             ntpr = int(params.get('ntpr', 500)) or 1
             pcoord_len = (nstlim // ntpr) + 1
-            pc1_bins = config_generator.generate_bin_boundaries(
-                params.get('pc1_min', 0.0), params.get('pc1_max', 8.0), params.get('pc1_step', 0.2), include_inf
-            )
-            pc2_bins = config_generator.generate_bin_boundaries(
-                params.get('pc2_min', 0.0), params.get('pc2_max', 8.0), params.get('pc2_step', 0.2), include_inf
-            )
+            pcoord_ndim = config_generator.pcoord_ndim(params)
             content = tpls['west_cfg'].render(
+                pcoord_ndim=pcoord_ndim,
                 pcoord_len=pcoord_len,
-                pc1_bins=pc1_bins,
-                pc2_bins=pc2_bins,
+                boundaries=config_generator.pcoord_boundaries(params, pcoord_ndim, include_inf),
                 bin_target_counts=int(params.get('bin_target_counts', 4)),
-                max_total_iterations=int(params.get('max_total_iterations', 1000))
+                max_total_iterations=int(params.get('max_total_iterations', 1000)),
+                store_gamd_auxdata=bool(params.get('store_gamd_auxdata', False))
             )
         elif key == 'env.sh':
-            content = tpls['env_sh'].render()
+            content = tpls['env_sh'].render(pcoord_daemon=bool(params.get('pcoord_daemon', False)))
         elif key == 'westpa_scripts/runseg.sh':
             content = tpls['runseg_sh'].render(
                 protein_name=params.get('protein_name', 'protein'),
-                enable_gpu_parallelization=bool(params.get('enable_gpu_parallelization', False))
+                enable_gpu_parallelization=bool(params.get('enable_gpu_parallelization', False)),
+                store_gamd_auxdata=bool(params.get('store_gamd_auxdata', False)),
+                pcoord_ndim=config_generator.pcoord_ndim(params),
+                python_pcoord=bool(params.get('python_pcoord', False) or params.get('pcoord_daemon', False)),
+                pcoord_daemon=bool(params.get('pcoord_daemon', False)),
+                segment_timing=bool(params.get('segment_timing', False)),
+                local_scratch=bool(params.get('local_scratch', False)),
+                scratch_cleanup=config_generator.scratch_cleanup(params),
+                md_retry=bool(params.get('md_retry', False)),
+                md_max_attempts=config_generator.md_retry(params)[0],
+                md_retry_backoff=config_generator.md_retry(params)[1]
+            )
+        elif key == 'westpa_scripts/get_pcoord.sh':
+            content = tpls['get_pcoord_sh'].render(
+                protein_name=params.get('protein_name', 'protein'),
+                pcoord_ndim=config_generator.pcoord_ndim(params),
+                python_pcoord=bool(params.get('python_pcoord', False) or params.get('pcoord_daemon', False)),
+                pcoord_daemon=bool(params.get('pcoord_daemon', False))
             )
         elif key == 'cMD/run_cmd.sh':
             content = tpls['run_cmd_sh'].render(
@@ -1,20 +1,155 @@
-#!/usr/bin/python
-
-import h5py, numpy, sys
-
-infile = numpy.loadtxt(sys.argv[1], usecols = (0, 1))
-west   = h5py.File('west.h5')
-coords = []
-for iteration, seg_id in infile[1:]:
-    iter_key = "iter_{0:08d}".format(int(iteration))
-    SOD      = west['iterations'][iter_key]['auxdata']['coord'][seg_id,1:,0,:]
-    CLA      = west['iterations'][iter_key]['auxdata']['coord'][seg_id,1:,1,:]
-    coords  += [numpy.column_stack((SOD, CLA))]
-with open(sys.argv[1][:-4] + ".xyz", 'w') as outfile:
-    for i, frame in enumerate(numpy.concatenate(coords)):
-        outfile.write("2\n")
-        outfile.write("{0}\n".format(i))
-        outfile.write("SOD {0:9.5f} {1:9.5f} {2:9.5f}\n".format(
-          float(frame[0]), float(frame[1]), float(frame[2])))
-        outfile.write("CLA {0:9.5f} {1:9.5f} {2:9.5f}\n".format(
-          float(frame[3]), float(frame[4]), float(frame[5])))
+#!/usr/bin/env python3
+"""
+Concatenate the coordinates of traced WE pathways into trajectories
+
+Each trace file is a w_trace output (iteration and seg_id in the first two
+columns, one row per iteration, the first row being the initial state). The
+coordinates come from iterations/iter_*/auxdata/coord in west.h5, with
+shape (segments, frames, atoms, 3); frame 0 of every segment is its parent
+and is skipped. Requests of all traces are grouped by iteration so every
+iteration's coord block is read once with one fancy-indexed read, and frames
+are written in bulk as XYZ, binary DCD and/or AMBER NetCDF (needs scipy):
+
+    python cat_trajectory.py traj_000012_000034_trace.txt
+    python cat_trajectory.py trace_*.txt --format xyz dcd nc --atoms 0 1 --names SOD CLA
+"""
+
+import struct
+import sys
+from argparse import ArgumentParser
+
+import h5py
+import numpy
+
+FORMATS = ('xyz', 'dcd', 'nc')
+## Frames formatted per write() call of the XYZ and DCD writers
+FRAME_BLOCK = 4096
+
+
+def load_trace(path):
+    """(iteration, seg_id) rows of a w_trace file, without the initial state"""
+    rows = numpy.loadtxt(path, usecols=(0, 1), ndmin=2).astype(numpy.int64)
+    return rows[1:]
+
+
+def read_coords(west, traces, atoms=None):
+    """Coordinates of every trace as an (frames, atoms, 3) array, reading each iteration once"""
+    wanted = {}
+    for rows in traces:
+        for iteration, seg_id in rows:
+            wanted.setdefault(int(iteration), set()).add(int(seg_id))
+    blocks = {}
+    for iteration in sorted(wanted):
+        seg_ids = sorted(wanted[iteration])
+        coord = west['iterations']['iter_{0:08d}'.format(iteration)]['auxdata']['coord']
+        ## h5py takes one increasing index list per read
+        block = coord[seg_ids, 1:]
+        if atoms is not None:
+            block = block[:, :, atoms]
+        blocks[iteration] = dict(zip(seg_ids, block))
+    return [numpy.concatenate([blocks[int(i)][int(s)] for i, s in rows]) if len(rows) else numpy.zeros((0, 0, 3))
+            for rows in traces]
+
+
+def write_xyz(path, coords, names):
+    natoms = coords.shape[1]
+    framefmt = '%d\n%d\n' + ''.join(name + ' %9.5f %9.5f %9.5f\n' for name in names)
+    with open(path, 'w') as outfile:
+        for start in range(0, len(coords), FRAME_BLOCK):
+            block = coords[start:start + FRAME_BLOCK].reshape(-1, natoms * 3)
+            table = numpy.column_stack((numpy.full(len(block), natoms), numpy.arange(start, start + len(block)), block))
+            outfile.write((framefmt * len(block)) % tuple(table.ravel().tolist()))
+
+
+def _record(data):
+    return struct.pack('<i', len(data)) + data + struct.pack('<i', len(data))
+
+
+def write_dcd(path, coords, timestep=1.0, title='cat_trajectory.py'):
+    """CHARMM-style DCD: no fixed atoms, no unit cell, little endian"""
+    nframes, natoms = coords.shape[:2]
+    icntrl = struct.pack('<9if10i', nframes, 0, 1, 0, 0, 0, 0, 0, 0, timestep, 0, 0, 0, 0, 0, 0, 0, 0, 0, 24)
+    with open(path, 'wb') as outfile:
+        outfile.write(_record(b'CORD' + icntrl))
+        outfile.write(_record(struct.pack('<i', 1) + title.encode()[:80].ljust(80)))
+        outfile.write(_record(struct.pack('<i', natoms)))
+        ## each frame is three Fortran records (X, Y, Z), built for a block of frames at once
+        records = numpy.dtype([('head', '<i4'), ('xyz', '<f4', (natoms,)), ('tail', '<i4')])
+        for start in range(0, nframes, FRAME_BLOCK):
+            block = coords[start:start + FRAME_BLOCK]
+            out = numpy.empty((len(block), 3), dtype=records)
+            out['head'] = out['tail'] = 4 * natoms
+            out['xyz'] = block.transpose(0, 2, 1)
+            outfile.write(out.tobytes())
+
+
+def write_netcdf(path, coords, timestep=1.0):
+    """AMBER NetCDF trajectory (NetCDF3 64-bit offset) through scipy.io"""
+    try:
+        from scipy.io import netcdf_file
+    except ImportError:
+        raise SystemExit('ERROR: NetCDF output needs scipy')
+    nframes, natoms = coords.shape[:2]
+    nc = netcdf_file(path, 'w', version=2)
+    try:
+        nc.Conventions = 'AMBER'
+        nc.ConventionVersion = '1.0'
+        nc.program = 'cat_trajectory.py'
+        nc.programVersion = '1.0'
+        nc.createDimension('frame', None)
+        nc.createDimension('spatial', 3)
+        nc.createDimension('atom', natoms)
+        spatial = nc.createVariable('spatial', 'c', ('spatial',))
+        spatial[:] = numpy.array(list('xyz'), dtype='S1')
+        time = nc.createVariable('time', 'f', ('frame',))
+        time.units = 'picosecond'
+        time[:] = numpy.arange(nframes, dtype=numpy.float32) * timestep
+        xyz = nc.createVariable('coordinates', 'f', ('frame', 'atom', 'spatial'))
+        xyz.units = 'angstrom'
+        xyz[:] = coords.astype(numpy.float32)
+    finally:
+        nc.close()
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Concatenate the coordinates of traced WE pathways from west.h5")
+    parser.add_argument("trace", nargs="+", help="w_trace output file(s) with iteration and seg_id columns")
+    parser.add_argument("--west", default="west.h5", help="WESTPA data file (default: west.h5)")
+    parser.add_argument("--format", nargs="+", choices=FORMATS, default=["xyz"],
+                        help="outputs written next to each trace file (default: xyz)")
+    parser.add_argument("--atoms", nargs="+", type=int, default=None,
+                        help="indices of the auxdata/coord atoms to keep (default: all)")
+    parser.add_argument("--names", nargs="+", default=None,
+                        help="XYZ atom names, one per atom or one for all (default: SOD CLA for two atoms, X otherwise)")
+    parser.add_argument("--timestep", type=float, default=1.0, help="time between frames in ps for DCD/NetCDF")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    traces = [load_trace(path) for path in args.trace]
+    with h5py.File(args.west, 'r') as west:
+        coords = read_coords(west, traces, args.atoms)
+    for path, frames in zip(args.trace, coords):
+        if frames.size == 0:
+            print('%s: empty trace (%d frames, %d atoms), nothing written' % (path, frames.shape[0], frames.shape[1]))
+            continue
+        natoms = frames.shape[1]
+        if args.names:
+            names = args.names * natoms if len(args.names) == 1 else args.names
+        else:
+            names = ['SOD', 'CLA'] if natoms == 2 else ['X'] * natoms
+        if len(names) != natoms:
+            raise SystemExit('ERROR: %d atom names for %d atoms' % (len(names), natoms))
+        stem = path[:-4]
+        if 'xyz' in args.format:
+            write_xyz(stem + '.xyz', frames, names)
+        if 'dcd' in args.format:
+            write_dcd(stem + '.dcd', frames, args.timestep)
+        if 'nc' in args.format:
+            write_netcdf(stem + '.nc', frames, args.timestep)
+        print('%s: %d frames of %d atoms (%s)' % (path, len(frames), natoms, ', '.join(args.format)))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Progress coordinates of a segment without cpptraj
+
+Computes what the cpptraj input of runseg.sh computes:
+
+    rms ca-rmsd @CA reference out rmsd.dat mass
+    radgyr ca-rg @CA out rg.dat mass
+
+i.e. the mass-weighted RMSD of the CA atoms to the reference PDB after an
+optimal (Kabsch) superposition, and the mass-weighted radius of gyration
+with the largest distance from the center. The CA selection and masses
+are parsed from the prmtop and the reference coordinates from the PDB
+once, and kept in an .npz cache (--cache) keyed by the size and mtime of
+both files, so later segments skip the parsing. Frames are read from
+AMBER NetCDF trajectories and restarts or ASCII restarts, and all frames
+are fitted in one batched SVD. NetCDF3 files (classic and 64-bit offset,
+what pmemd writes) are read by a small header parser instead of
+scipy.io, whose import would dominate the per-segment cost.
+
+The pcoord file ($WEST_PCOORD_RETURN) gets one row per frame with RMSD,
+Rg and the maximum distance, for the first --ndim of them; rmsd.dat and
+rg.dat are written in cpptraj's layout for data_extract.py:
+
+    python pcoord.py --prmtop chignolin.prmtop --ref chignolin.pdb --ndim 2 \\
+        --rmsd rmsd.dat --rg rg.dat -o $WEST_PCOORD_RETURN parent.rst seg.nc
+    python pcoord.py --prmtop chignolin.prmtop --ref chignolin.pdb --last -o $WEST_PCOORD_RETURN bstate.rst
+"""
+
+import os
+import struct
+import sys
+from argparse import ArgumentParser
+
+import numpy as np
+
+
+def read_prmtop(path):
+    """Atom names and masses from the ATOM_NAME and MASS sections of an AMBER prmtop"""
+    sections = {}
+    flag = None
+    with open(path) as f:
+        for line in f:
+            if line.startswith('%FLAG'):
+                flag = line.split()[1]
+                sections[flag] = []
+            elif line.startswith('%') or flag is None:
+                continue
+            else:
+                sections[flag].append(line.rstrip('\n'))
+    names = ''.join(sections['ATOM_NAME'])
+    names = np.array([names[i:i + 4].strip() for i in range(0, len(names), 4)])
+    masses = np.array(' '.join(sections['MASS']).split(), dtype=np.float64)
+    return names[:len(masses)], masses
+
+
+def read_pdb(path):
+    """(atoms, 3) coordinates and atom names of the ATOM/HETATM records of a PDB"""
+    xyz, names = [], []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(('ATOM  ', 'HETATM')):
+                xyz.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+                names.append(line[12:16].strip())
+            elif line.startswith('ENDMDL'):
+                break
+    return np.array(xyz), np.array(names)
+
+
+## NetCDF3 nc_type codes and their big-endian dtypes
+NC_DTYPES = {1: '>i1', 2: 'S1', 3: '>i2', 4: '>i4', 5: '>f4', 6: '>f8'}
+
+
+def read_netcdf(path, name='coordinates'):
+    """One variable of a NetCDF3 file (classic or 64-bit offset) as an array, without scipy"""
+    with open(path, 'rb') as f:
+        buf = f.read()
+    offset_size = 8 if buf[3] == 2 else 4
+    pos = [4]
+
+    def take(fmt):
+        value = struct.unpack_from(fmt, buf, pos[0])
+        pos[0] += struct.calcsize(fmt)
+        return value[0]
+
+    def text():
+        n = take('>i')
+        value = buf[pos[0]:pos[0] + n].decode()
+        pos[0] += -(-n // 4) * 4
+        return value
+
+    def skip_attributes():
+        take('>i')
+        for _ in range(take('>i')):
+            text()
+            nc_type, n = take('>i'), take('>i')
+            pos[0] += -(-n * numpy_size(nc_type) // 4) * 4
+
+    def numpy_size(nc_type):
+        return np.dtype(NC_DTYPES[nc_type]).itemsize
+
+    numrecs = take('>i')
+    take('>i')
+    dims = [(text(), take('>i')) for _ in range(take('>i'))]
+    skip_attributes()
+    take('>i')
+    variables = {}
+    for _ in range(take('>i')):
+        vname = text()
+        dimids = [take('>i') for _ in range(take('>i'))]
+        skip_attributes()
+        nc_type, vsize = take('>i'), take('>i')
+        begin = take('>q' if offset_size == 8 else '>i')
+        variables[vname] = (dimids, nc_type, vsize, begin)
+    record = [v for v in variables.values() if v[0] and dims[v[0][0]][1] == 0]
+    ## a lone record variable is not padded to 4 bytes
+    recsize = sum(v[2] for v in record) if len(record) != 1 else record[0][2]
+    dimids, nc_type, vsize, begin = variables[name]
+    dtype = np.dtype(NC_DTYPES[nc_type])
+    shape = [dims[d][1] for d in dimids]
+    if dimids and shape[0] == 0:
+        if numrecs < 0:
+            numrecs = (len(buf) - begin) // recsize
+        ## records are interleaved with the other record variables, each record is C-ordered
+        strides = [recsize] + [int(np.prod(shape[k + 1:])) * dtype.itemsize for k in range(1, len(shape))]
+        shape[0] = numrecs
+        return np.ndarray(shape, dtype, buf, begin, strides).copy()
+    return np.ndarray(shape, dtype, buf, begin).copy()
+
+
+def read_frames(path):
+    """(frames, atoms, 3) coordinates of an AMBER NetCDF trajectory or restart, or an ASCII restart"""
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic in (b'CDF\x01', b'CDF\x02'):
+        xyz = read_netcdf(path).astype(np.float64)
+        return xyz.reshape(-1, xyz.shape[-2], 3)
+    if magic.startswith(b'CDF') or magic.startswith(b'\x89HDF'):
+        from scipy.io import netcdf_file
+        nc = netcdf_file(path, 'r', mmap=False)
+        try:
+            xyz = np.array(nc.variables['coordinates'][:], dtype=np.float64)
+        finally:
+            nc.close()
+        return xyz.reshape(-1, xyz.shape[-2], 3)
+    with open(path) as f:
+        f.readline()
+        natom = int(f.readline().split()[0])
+        ## 6F12.7, velocities and box follow the coordinates
+        text = f.read().replace('\n', '')
+    values = np.array([text[i:i + 12] for i in range(0, natom * 36, 12)], dtype=np.float64)
+    return values.reshape(1, natom, 3)
+
+
+class PcoordEngine(object):
+    """Mass-weighted RMSD to a reference and radius of gyration of one atom selection"""
+
+    def __init__(self, atoms, masses, reference):
+        self.atoms = atoms
+        self.masses = masses
+        self.weights = masses / masses.sum()
+        self.reference = reference - self.weights.dot(reference)
+
+    @classmethod
+    def load(cls, prmtop, reference, mask='CA', cache=None):
+        """Selection and reference from the prmtop and PDB, or from the cache when both are unchanged"""
+        key = np.array([os.path.getsize(prmtop), os.stat(prmtop).st_mtime_ns,
+                        os.path.getsize(reference), os.stat(reference).st_mtime_ns], dtype=np.int64)
+        if cache and os.path.exists(cache):
+            try:
+                with np.load(cache) as c:
+                    if str(c['mask']) == mask and np.array_equal(c['key'], key):
+                        return cls(c['atoms'], c['masses'], c['reference'])
+            except (OSError, KeyError, ValueError):
+                pass
+        names, masses = read_prmtop(prmtop)
+        atoms = np.flatnonzero(names == mask)
+        if not len(atoms):
+            raise SystemExit('ERROR: no atoms named %s in %s' % (mask, prmtop))
+        xyz, pdbnames = read_pdb(reference)
+        if len(xyz) == len(names):
+            ref = xyz[atoms]
+        elif (pdbnames == mask).sum() == len(atoms):
+            ref = xyz[pdbnames == mask]
+        else:
+            raise SystemExit('ERROR: %s does not match the atoms of %s' % (reference, prmtop))
+        engine = cls(atoms, masses[atoms], ref)
+        if cache:
+            ## written under a private name and renamed, so concurrent segments never read a partial file
+            tmp = '%s.%d.tmp.npz' % (cache[:-4] if cache.endswith('.npz') else cache, os.getpid())
+            np.savez(tmp, key=key, mask=mask, atoms=atoms, masses=engine.masses, reference=ref)
+            os.replace(tmp, cache)
+        return engine
+
+    def rmsd(self, frames):
+        """Best-fit RMSD of every frame (frames, all atoms, 3)"""
+        x = frames[:, self.atoms]
+        x = x - np.einsum('a,fai->fi', self.weights, x)[:, None]
+        y = self.reference
+        h = np.einsum('fai,a,aj->fij', x, self.weights, y)
+        u, s, vt = np.linalg.svd(h)
+        ## reflections are not rotations: flip the smallest singular value
+        s[:, -1] *= np.sign(np.linalg.det(u) * np.linalg.det(vt))
+        e0 = np.einsum('a,fai,fai->f', self.weights, x, x) + self.weights.dot((y * y).sum(axis=1))
+        return np.sqrt(np.maximum(e0 - 2.0 * s.sum(axis=1), 0.0))
+
+    def radgyr(self, frames):
+        """(Rg, largest distance from the center of mass) of every frame"""
+        x = frames[:, self.atoms]
+        d2 = ((x - np.einsum('a,fai->fi', self.weights, x)[:, None]) ** 2).sum(axis=2)
+        return np.sqrt(d2.dot(self.weights)), np.sqrt(d2.max(axis=1))
+
+    def compute(self, frames):
+        """(frames, 3) array of RMSD, Rg and maximum distance"""
+        rg, rmax = self.radgyr(frames)
+        return np.column_stack((self.rmsd(frames), rg, rmax))
+
+
+def write_cpptraj(path, columns, names):
+    """Data file in cpptraj's layout: #Frame header, 1-based frame numbers"""
+    rows = np.column_stack([np.arange(1, len(columns[0]) + 1)] + list(columns))
+    header = '%-8s' % '#Frame' + ''.join(' %12s' % name for name in names)
+    np.savetxt(path, rows, fmt=['%8d'] + ['%12.4f'] * len(names), header=header, comments='')
+
+
+def segment(engine, traj, ndim=2, last=False, rmsd=None, rg=None, output=None):
+    """Pcoords of the concatenated frames of traj written to output (default: stdout); returns the frame count"""
+    frames = np.concatenate([read_frames(path) for path in traj])
+    if last:
+        frames = frames[-1:]
+    values = engine.compute(frames)
+    if rmsd:
+        write_cpptraj(rmsd, [values[:, 0]], ['ca-rmsd'])
+    if rg:
+        write_cpptraj(rg, [values[:, 1], values[:, 2]], ['ca-rg', 'ca-rg[max]'])
+    np.savetxt(output if output else sys.stdout, values[:, :ndim], fmt='%.6f', delimiter='\t')
+    return len(frames)
+
+
+def cmdlineparser():
+    parser = ArgumentParser(description="Progress coordinates (CA RMSD, Rg) of a segment without cpptraj")
+    parser.add_argument("traj", nargs="+", help="trajectory/restart files, concatenated in order (e.g. parent.rst seg.nc)")
+    parser.add_argument("--prmtop", required=True, help="AMBER topology")
+    parser.add_argument("--ref", required=True, help="reference PDB for the RMSD")
+    parser.add_argument("--mask", default="CA", help="atom name of the selection (default: CA)")
+    parser.add_argument("--ndim", type=int, default=2, choices=(1, 2, 3),
+                        help="pcoord columns: RMSD, Rg, maximum distance (default: 2)")
+    parser.add_argument("--last", action="store_true", help="only the last frame (basis and initial states)")
+    parser.add_argument("--cache", default=None, help=".npz cache of the selection and reference")
+    parser.add_argument("--rmsd", default=None, help="also write the RMSD as a cpptraj data file")
+    parser.add_argument("--rg", default=None, help="also write Rg and the maximum distance as a cpptraj data file")
+    parser.add_argument("-o", "--output", default=None, help="pcoord file (default: stdout)")
+    return parser
+
+
+def main(argv=None):
+    args = cmdlineparser().parse_args(argv)
+    engine = PcoordEngine.load(args.prmtop, args.ref, args.mask, args.cache)
+    segment(engine, args.traj, args.ndim, args.last, args.rmsd, args.rg, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Per-node pcoord daemon for runseg.sh and get_pcoord.sh
+
+pcoord.py run once per segment pays the interpreter, NumPy import and
+topology setup every time. The daemon is started once per node (node.sh
+does this when PCOORD_DAEMON is set) and keeps one PcoordEngine per
+topology, reference and mask in memory (keyed by their real paths, the
+MAX_ENGINES most recently used). Segments hand it their pcoord.py
+arguments over a local UNIX socket through the client, which only imports
+the standard library:
+
+    python pcoord_daemon.py serve --socket $PCOORD_SOCKET &
+    python pcoord_daemon.py client --prmtop chignolin.prmtop --ref chignolin.pdb \\
+        --rmsd rmsd.dat --rg rg.dat -o $WEST_PCOORD_RETURN parent.rst seg.nc
+
+Each request is one JSON line {"argv": [...], "cwd": ...} and each reply
+one JSON line {"ok": ..., "frames": ..., "error": ..., "pcoord": ...}.
+When the socket is missing, the daemon does not answer or it reports an
+error, the client computes the pcoords itself exactly as pcoord.py does.
+"""
+
+import json
+import os
+import socket
+import sys
+from argparse import ArgumentParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+## engines (topology, reference, mask) kept in memory, least recently used dropped first
+MAX_ENGINES = 4
+## pcoord.py arguments that name files, resolved against the client's working directory
+PATH_ARGS = ('prmtop', 'ref', 'cache', 'rmsd', 'rg', 'output')
+
+
+def default_socket():
+    return os.environ.get('PCOORD_SOCKET') or os.path.join(os.environ.get('TMPDIR', '/tmp'), 'pcoord-%d.sock' % os.getuid())
+
+
+def serve(path):
+    """Answer pcoord requests on the UNIX socket at path until terminated"""
+    import io
+    import signal
+    import socketserver
+    import threading
+    from collections import OrderedDict
+
+    sys.path.insert(0, HERE)
+    import pcoord
+
+    engines = OrderedDict()
+    lock = threading.Lock()
+
+    def engine(args):
+        ## a topology linked into each segment directory is still one engine
+        key = (os.path.realpath(args.prmtop), os.path.realpath(args.ref), args.mask)
+        stamp = tuple(os.stat(p).st_mtime_ns for p in key[:2])
+        with lock:
+            if key not in engines or engines[key][0] != stamp:
+                engines[key] = (stamp, pcoord.PcoordEngine.load(args.prmtop, args.ref, args.mask, args.cache))
+                print('pcoord daemon: loaded %s, %s, mask %s' % key, flush=True)
+            engines.move_to_end(key)
+            while len(engines) > MAX_ENGINES:
+                engines.popitem(last=False)
+            return engines[key][1]
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    request = json.loads(line.decode())
+                    args = pcoord.cmdlineparser().parse_args(request['argv'])
+                    cwd = request['cwd']
+                    args.traj = [os.path.join(cwd, p) for p in args.traj]
+                    for name in PATH_ARGS:
+                        if getattr(args, name):
+                            setattr(args, name, os.path.join(cwd, getattr(args, name)))
+                    out = args.output or io.StringIO()
+                    frames = pcoord.segment(engine(args), args.traj, args.ndim, args.last, args.rmsd, args.rg, out)
+                    reply = {'ok': True, 'frames': frames}
+                    if not args.output:
+                        reply['pcoord'] = out.getvalue()
+                ## pcoord.py and argparse report bad input with SystemExit
+                except (Exception, SystemExit) as e:
+                    reply = {'ok': False, 'error': '%s: %s' % (type(e).__name__, e)}
+                self.wfile.write((json.dumps(reply) + '\n').encode())
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = Server(path, Handler)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print('pcoord daemon listening on %s (pid %d)' % (path, os.getpid()), flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def request(path, argv, timeout):
+    """Reply of the daemon to one set of pcoord.py arguments"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall((json.dumps({'argv': argv, 'cwd': os.getcwd()}) + '\n').encode())
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise OSError('connection closed by the daemon')
+            reply += chunk
+    finally:
+        sock.close()
+    return json.loads(reply.decode())
+
+
+def client(path, argv, timeout):
+    """Pcoords through the daemon, computed in-process when it is not available"""
+    try:
+        reply = request(path, argv, timeout)
+        if reply['ok']:
+            if 'pcoord' in reply:
+                sys.stdout.write(reply['pcoord'])
+            return
+        sys.stderr.write('pcoord daemon: %s; computing locally\n' % reply['error'])
+    except (OSError, ValueError) as e:
+        sys.stderr.write('pcoord daemon at %s unavailable (%s); computing locally\n' % (path, e))
+    sys.path.insert(0, HERE)
+    import pcoord
+    pcoord.main(argv)
+
+
+def main():
+    parser = ArgumentParser(description="Per-node pcoord daemon and its client", allow_abbrev=False)
+    parser.add_argument("mode", choices=("serve", "client"),
+                        help="serve: run the daemon; client: send the remaining pcoord.py arguments to it")
+    parser.add_argument("--socket", default=default_socket(),
+                        help="UNIX socket path (default: $PCOORD_SOCKET or $TMPDIR/pcoord-<uid>.sock)")
+    parser.add_argument("--timeout", type=float, default=300.0,
+                        help="seconds the client waits for the daemon before computing locally (default: 300)")
+    args, rest = parser.parse_known_args()
+    if args.mode == 'serve':
+        if rest:
+            parser.error('unrecognized arguments: %s' % ' '.join(rest))
+        serve(args.socket)
+    else:
+        client(args.socket, rest, args.timeout)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
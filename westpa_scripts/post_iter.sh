@@ -10,3 +10,10 @@ cd $WEST_SIM_ROOT || exit 1
 ITER=$(printf "%06d" $WEST_CURRENT_ITER)
 tar -cf seg_logs/$ITER.tar seg_logs/$ITER-*.log
 rm  -f  seg_logs/$ITER-*.log
+
+# Fold this iteration into the live free energy surface in fes/ once it has
+# been set up with: python3 fes_update.py $WEST_SIM_ROOT --init -Xdim ... -Ydim ...
+if [ -f fes/state.npz ] ; then
+    python3 fes_update.py $WEST_SIM_ROOT --iter $WEST_CURRENT_ITER --finished $WEST_CURRENT_ITER -j 4 \
+        || echo "fes_update.py failed for iteration $WEST_CURRENT_ITER"
+fi
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Trace WE pathways through the parent links in west.h5 and stitch their trajectories
+
+The ancestry of many target segments is traced at once: iterations are
+walked from the last target down to 1, each iteration's seg_index is read
+once, and the parent_id of all active segments is looked up in one
+vectorized step. Segments shared by several pathways are looked up only
+once. Every pathway is written as a w_trace style text file in the
+format cat_trajectory.py reads: n_iter, seg_id and weight, with the
+initial state first.
+
+With --stitch the seg.nc pieces of every pathway, read from
+traj_segs/<iter>/<seg>/ or from the traj_segs/<iter>.tar archives
+tar_segs.sh writes, are concatenated into one continuous trajectory per
+pathway by a thread pool:
+
+    python trace_pathways.py --iter 200 --reached 0 0 1.0 --stitch -j 8
+    python trace_pathways.py --targets targets.txt --stitch --format nc dcd
+"""
+
+import os
+import sys
+import tarfile
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import h5py
+import numpy
+
+from cat_trajectory import write_dcd, write_netcdf
+
+## seg_index status of a completed segment
+SEG_STATUS_COMPLETE = 2
+
+
+def iteration_group(west, n_iter):
+    return west['iterations']['iter_{0:08d}'.format(n_iter)]
+
+
+def last_iteration(west):
+    """Last iteration with completed segments"""
+    for name in sorted(west['iterations'], reverse=True):
+        if (west['iterations'][name]['seg_index'].fields('status')[:] == SEG_STATUS_COMPLETE).any():
+            return int(name[5:])
+    raise SystemExit('ERROR: no completed segments in west.h5')
+
+
+def select_targets(west, n_iter, seg_ids=None, reached=None):
+    """(n_iter, seg_id) rows of the completed segments of one iteration, optionally only those whose
+    final pcoord[dim] lies in [lo, hi]"""
+    group = iteration_group(west, n_iter)
+    complete = group['seg_index'].fields('status')[:] == SEG_STATUS_COMPLETE
+    keep = numpy.flatnonzero(complete)
+    if seg_ids is not None:
+        keep = numpy.intersect1d(keep, seg_ids)
+    if reached is not None:
+        dim, lo, hi = reached
+        final = group['pcoord'][:, -1, int(dim)][keep]
+        keep = keep[(final >= lo) & (final <= hi)]
+    return numpy.column_stack((numpy.full(len(keep), n_iter), keep)).astype(numpy.int64)
+
+
+def trace(west, targets):
+    """Ancestry of every target as (paths, weights, istates)
+
+    paths[k, n_iter] is the seg_id of pathway k in iteration n_iter (-1 outside the pathway),
+    weights holds the matching segment weights and istates the initial state each pathway starts from.
+    """
+    targets = numpy.asarray(targets, dtype=numpy.int64).reshape(-1, 2)
+    top = int(targets[:, 0].max())
+    links = {}
+    carry = numpy.zeros(0, dtype=numpy.int64)
+    for n_iter in range(top, 0, -1):
+        segs = numpy.unique(numpy.concatenate((carry, targets[targets[:, 0] == n_iter, 1])))
+        if not len(segs):
+            continue
+        ## one read of the iteration's seg_index, one lookup for every active segment
+        index = iteration_group(west, n_iter)['seg_index'][...]
+        parents = index['parent_id'][segs].astype(numpy.int64)
+        links[n_iter] = (segs, parents, index['weight'][segs])
+        carry = numpy.unique(parents[parents >= 0])
+
+    paths = numpy.full((len(targets), top + 1), -1, dtype=numpy.int64)
+    weights = numpy.zeros((len(targets), top + 1))
+    istates = numpy.full(len(targets), -1, dtype=numpy.int64)
+    current = numpy.full(len(targets), -1, dtype=numpy.int64)
+    for n_iter in range(top, 0, -1):
+        current[targets[:, 0] == n_iter] = targets[targets[:, 0] == n_iter, 1]
+        alive = numpy.flatnonzero(current >= 0)
+        if not len(alive):
+            continue
+        segs, parents, segweights = links[n_iter]
+        pos = numpy.searchsorted(segs, current[alive])
+        paths[alive, n_iter] = current[alive]
+        weights[alive, n_iter] = segweights[pos]
+        parent = parents[pos]
+        ## a negative parent_id is -(initial state id + 1): the pathway starts here
+        started = parent < 0
+        istates[alive[started]] = -(parent[started] + 1)
+        current[alive] = numpy.where(started, -1, parent)
+    return paths, weights, istates
+
+
+def write_trace(path, segs, weights, istate):
+    """w_trace style pathway file: the initial state, then one (n_iter, seg_id, weight) row per iteration"""
+    iters = numpy.flatnonzero(segs >= 0)
+    rows = numpy.column_stack((numpy.concatenate(([0], iters)), numpy.concatenate(([istate], segs[iters])),
+                               numpy.concatenate(([weights[iters[0]]], weights[iters]))))
+    numpy.savetxt(path, rows, fmt=('%d', '%d', '%.12g'), header='n_iter seg_id weight')
+
+
+class SegmentReader(object):
+    """seg.nc coordinates of a segment, from traj_segs/<iter>/<seg>/ or from traj_segs/<iter>.tar
+
+    Every archive is indexed once (member offsets and sizes); threads then read members with plain
+    seeks, so the tar files are never scanned again.
+    """
+
+    def __init__(self, sim_root):
+        self.traj_segs = os.path.join(sim_root, 'traj_segs')
+        self._tars = {}
+        self._lock = threading.Lock()
+
+    def _tarindex(self, n_iter):
+        with self._lock:
+            if n_iter not in self._tars:
+                path = os.path.join(self.traj_segs, '%06d.tar' % n_iter)
+                index = {}
+                if os.path.isfile(path):
+                    with tarfile.open(path) as tar:
+                        index = {m.name: (m.offset_data, m.size) for m in tar if m.isfile()}
+                self._tars[n_iter] = (path, index)
+            return self._tars[n_iter]
+
+    def read(self, n_iter, seg_id):
+        from scipy.io import netcdf_file
+        path = os.path.join(self.traj_segs, '%06d' % n_iter, '%06d' % seg_id, 'seg.nc')
+        if os.path.isfile(path):
+            source = path
+        else:
+            tarpath, index = self._tarindex(n_iter)
+            member = index.get('%06d/%06d/seg.nc' % (n_iter, seg_id))
+            if member is None:
+                raise IOError('no seg.nc for iteration %d segment %d' % (n_iter, seg_id))
+            with open(tarpath, 'rb') as f:
+                f.seek(member[0])
+                source = BytesIO(f.read(member[1]))
+        nc = netcdf_file(source, 'r', mmap=False)
+        try:
+            return numpy.array(nc.variables['coordinates'][:], dtype=numpy.float32)
+        finally:
+            nc.close()
+
+
+def stitch(reader, segs, stem, formats, timestep):
+    """Concatenate the seg.nc pieces of one pathway; returns the number of frames"""
+    iters = numpy.flatnonzero(segs >= 0)
+    coords = numpy.concatenate([reader.read(int(n_iter), int(segs[n_iter])) for n_iter in iters])
+    if 'nc' in formats:
+        write_netcdf(stem + '.nc', coords, timestep)
+    if 'dcd' in formats:
+        write_dcd(stem + '.dcd', coords, timestep)
+    return len(coords)
+
+
+def cmdlineparse():
+    parser = ArgumentParser(description="Trace WE pathways through west.h5 parent links and stitch their trajectories")
+    parser.add_argument("--west", default="west.h5", help="WESTPA data file (default: west.h5)")
+    parser.add_argument("--sim-root", dest="sim_root", default=os.environ.get('WEST_SIM_ROOT', '.'),
+                        help="simulation root containing traj_segs/ (default: $WEST_SIM_ROOT or .)")
+    parser.add_argument("--targets", default=None, help="text file of target n_iter seg_id rows")
+    parser.add_argument("--iter", type=int, default=None,
+                        help="trace the completed segments of this iteration (default: the last one)")
+    parser.add_argument("--seg", nargs="+", type=int, default=None, help="only these seg_ids of --iter")
+    parser.add_argument("--reached", nargs=3, type=float, default=None, metavar=("DIM", "LO", "HI"),
+                        help="only segments of --iter whose final pcoord[DIM] lies in [LO, HI]")
+    parser.add_argument("--outdir", default="pathways", help="output directory (default: pathways)")
+    parser.add_argument("--stitch", action="store_true", help="also concatenate the seg.nc pieces of every pathway")
+    parser.add_argument("--format", nargs="+", choices=("nc", "dcd"), default=["nc"],
+                        help="stitched trajectory formats (default: nc)")
+    parser.add_argument("--timestep", type=float, default=1.0, help="time between stitched frames in ps")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="stitching threads (default: CPUs x 5)")
+    return parser.parse_args()
+
+
+def main():
+    args = cmdlineparse()
+    start = time.perf_counter()
+    with h5py.File(args.west, 'r') as west:
+        if args.targets:
+            targets = numpy.loadtxt(args.targets, usecols=(0, 1), ndmin=2).astype(numpy.int64)
+        else:
+            n_iter = args.iter if args.iter is not None else last_iteration(west)
+            targets = select_targets(west, n_iter, args.seg, args.reached)
+        if not len(targets):
+            raise SystemExit('ERROR: no target segments')
+        paths, weights, istates = trace(west, targets)
+    t_trace = time.perf_counter() - start
+    distinct = sum(len(numpy.unique(segs[segs >= 0])) for segs in paths.T)
+    print('Traced %d pathways through %d iterations in %.3f s (%d distinct segments)'
+          % (len(targets), paths.shape[1] - 1, t_trace, distinct))
+
+    os.makedirs(args.outdir, exist_ok=True)
+    stems = [os.path.join(args.outdir, 'traj_%06d_%06d' % (n_iter, seg_id)) for n_iter, seg_id in targets]
+    for stem, segs, w, istate in zip(stems, paths, weights, istates):
+        write_trace(stem + '_trace.txt', segs, w, istate)
+
+    if args.stitch:
+        start = time.perf_counter()
+        reader = SegmentReader(args.sim_root)
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            frames = list(pool.map(lambda job: stitch(reader, job[0], job[1], args.format, args.timestep),
+                                   zip(paths, stems)))
+        print('Stitched %d trajectories (%d frames) in %.3f s' % (len(frames), sum(frames), time.perf_counter() - start))
+    print('Pathways written to %s' % args.outdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())